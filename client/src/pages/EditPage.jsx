@@ -315,6 +315,7 @@ function EditPage() {
         >
           <option value="default">Default Algorithm</option>
           <option value="elo">Elo Ranking</option>
+          <option value="bradley_terry">Bradley-Terry</option>
         </select>
         <button onClick={handleGenerateRanking} style={{marginLeft: '1rem'}}>Generate Rankings</button>
       </div>
@@ -336,7 +337,7 @@ function EditPage() {
       {/* Ranking Results Display */}
       {ranking && (
         <div style={{marginTop: '1rem'}}>
-          <h2>Ranking Results ({selectedAlgorithm === 'elo' ? 'Elo' : 'Default'})</h2>
+          <h2>Ranking Results ({{elo: 'Elo', bradley_terry: 'Bradley-Terry'}[selectedAlgorithm] || 'Default'})</h2>
           <ol>
             {ranking
               .map((score, idx) => ({
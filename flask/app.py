@@ -1,15 +1,52 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Request, request, send_file, jsonify, g, copy_current_request_context
 from flask_cors import CORS
 import os
+import sys
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
 import tempfile
+import shutil
+import json
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
+import csv
+import io
+import re
+import time
+import uuid
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservices'))
+sys.path.append(microservices_path)
+
+from scores.scores import parse_table
+from scores import wire
+from caching.byte_cache import ByteCache
 
 # Import the functions from your client_socket.py
 # Ensure client_socket.py is in the same directory as app.py
-from client_socket import upload_csv, request_heatmap
+from client_socket import upload_stream, request_heatmap, stream_heatmap, upload_and_request_heatmap, HeatmapServerBusy, UPLOAD_BUFFER_SIZE
+from client_socket import request_heatmap_tiles, request_heatmap_tile, HeatmapNotStored, HeatmapRequestInvalid
+import deadlines
+
+class InMemoryUploadRequest(Request):
+    """
+    Keeps multipart file uploads in memory; Werkzeug would otherwise spool any
+    upload over 500 KB to a temporary file before the handler runs. The
+    upload endpoint caps them at MAX_UPLOAD_BYTES.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
 
 # --- CORS Configuration ---
 # This allows your React frontend (on port 5173) to communicate with this Flask backend (on port 5000).
@@ -22,20 +59,188 @@ CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Content types of a heatmap CSV sent as the raw request body instead of a form
+RAW_UPLOAD_TYPES = ('text/csv', 'application/octet-stream')
+DEFAULT_UPLOAD_NAME = 'league_data.csv'
+# A raw upload without Content-Length is buffered in memory up to this size
+UPLOAD_SPOOL_BYTES = int(os.environ.get('GATEWAY_UPLOAD_SPOOL_BYTES', 64 * 1024 * 1024))
+# Largest heatmap CSV the gateway accepts, the heatmap upload server's default limit;
+# larger uploads are refused with 413 before they are read into memory
+MAX_UPLOAD_BYTES = int(os.environ.get('GATEWAY_MAX_UPLOAD_MB', 256)) * 1024 * 1024
+
 
 # --- Microservice Communication Functions ---
 
+# Seconds to wait for a microservice connection, and for each read of its response
+CONNECT_TIMEOUT = float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', 2))
+READ_TIMEOUT = float(os.environ.get('GATEWAY_READ_TIMEOUT', 60))
+# Total seconds a client request may spend in the gateway and downstream; a
+# client can ask for less with the X-Request-Timeout-Ms header. What is left is
+# forwarded to each microservice in the same header and caps its read timeout.
+REQUEST_BUDGET = float(os.environ.get('GATEWAY_REQUEST_BUDGET', 60))
+# Keep-alive connections kept open to each microservice
+POOL_SIZE = int(os.environ.get('GATEWAY_POOL_SIZE', 16))
+
+# One pooled session per microservice host, created on first use
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+def http_session(url):
+    host = urlsplit(url).netloc
+    with _http_sessions_lock:
+        session = _http_sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            # Retry once only when the connection itself fails (e.g. a stale keep-alive socket)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_sessions[host] = session
+    return session
+
+@app.before_request
+def start_deadline():
+    g.deadline = deadlines.request_deadline(request.headers, REQUEST_BUDGET)
+
+def post_with_deadline(url, **kwargs):
+    """
+    POSTs over the microservice's pooled session, with timeouts capped by and
+    the remaining budget forwarded from the current request's deadline.
+    """
+    remaining = deadlines.remaining(g.deadline)
+    if remaining is not None and remaining <= 0:
+        raise requests.exceptions.Timeout('Request deadline exceeded before calling the microservice')
+    headers = dict(kwargs.pop('headers', None) or {})
+    connect_timeout, read_timeout = CONNECT_TIMEOUT, READ_TIMEOUT
+    if remaining is not None:
+        connect_timeout, read_timeout = min(connect_timeout, remaining), min(read_timeout, remaining)
+        headers[deadlines.DEADLINE_HEADER] = str(int(remaining * 1000))
+    return http_session(url).post(url, headers=headers, timeout=(connect_timeout, read_timeout), **kwargs)
+
+# 'http' calls the ranking, export and validation microservices on ports
+# 5050-5052 (split deployments); 'inprocess' imports them and calls the same
+# functions directly, skipping the localhost HTTP hops and JSON round trips.
+GATEWAY_BACKEND = os.environ.get('GATEWAY_BACKEND', 'http')
+# In-process ranking solves run on this many worker processes so they do not
+# hold the GIL against request threads; 0 solves on the request thread
+RANKING_WORKERS = int(os.environ.get('GATEWAY_RANKING_WORKERS', os.cpu_count() or 1))
+
+if GATEWAY_BACKEND == 'inprocess':
+    import ranking_service
+    import export_service
+    import validation_service
+
+_ranking_pool = None
+_ranking_pool_lock = threading.Lock()
+
+def run_ranking_job(job, deadline=None):
+    """
+    Runs a ranking_service solve job on the worker pool (created on first use),
+    waiting no longer than `deadline`.
+    """
+    global _ranking_pool
+    if RANKING_WORKERS <= 0:
+        return ranking_service.run_ranking(job)
+    with _ranking_pool_lock:
+        if _ranking_pool is None:
+            # Spawned rather than forked, since this process already runs request threads
+            _ranking_pool = ProcessPoolExecutor(RANKING_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        # Narrow score arrays, since the job is pickled across to the worker
+        future = _ranking_pool.submit(ranking_service.run_ranking, ranking_service.compact_job(job))
+        return future.result(timeout=deadlines.remaining(deadline))
+    except FutureTimeoutError:
+        raise requests.exceptions.Timeout('Ranking did not finish within the request deadline')
+
+# How tables are sent to the microservices: 'binary' packs the parsed score
+# matrices with scores/wire.py, 'json' forwards the "X -- Y" strings as received.
+# The React client always talks JSON to this gateway.
+WIRE_FORMAT = os.environ.get('GATEWAY_WIRE_FORMAT', 'binary')
+# Deflate binary bodies, trading gateway CPU for bytes on the wire
+WIRE_COMPRESS = os.environ.get('GATEWAY_WIRE_COMPRESS', '0') == '1'
+
+# Microservice URLs that answered a binary body with 415, so get JSON from then on
+json_only_urls = set()
+
+def post_table(url, payload, binary_body=None):
+    """
+    POSTs to a microservice, as a binary wire body when one could be built and
+    the service accepts it, otherwise as the JSON payload.
+    """
+    if binary_body is not None and WIRE_FORMAT == 'binary' and url not in json_only_urls:
+        response = post_with_deadline(url, data=binary_body, headers={'Content-Type': wire.CONTENT_TYPE})
+        if response.status_code != 415:
+            return response
+        json_only_urls.add(url)
+    return post_with_deadline(url, json=payload)
+
+def is_table(table):
+    return isinstance(table, list) and all(isinstance(row, list) for row in table)
+
+def encode_table(table, meta):
+    """
+    Binary body for a "table" of "X -- Y" rows, or None if it is not a list of lists.
+    """
+    if WIRE_FORMAT != 'binary' or not is_table(table):
+        return None
+    wins, losses, valid = parse_table(table)
+    return wire.encode(wins, losses, valid, meta, compress=WIRE_COMPRESS)
+
+def encode_export_table(table, player_names, meta):
+    """
+    Binary body for the export service, or None unless the table is a list of
+    lists with a row for every player. The export service reads one row per
+    player, cell for cell, so those rows are sent exactly (wire.encode_table).
+    """
+    if WIRE_FORMAT != 'binary' or not isinstance(player_names, list) or not is_table(table) \
+            or not len(table) >= len(player_names) > 0:
+        return None
+    return wire.encode_table(table[:len(player_names)], meta, compress=WIRE_COMPRESS)
+
+def encode_validation_rows(headers, rows):
+    """
+    Binary body for /validate_data, or None unless every row is an object
+    whose 'data' list has one cell per header. The validator reads the cells
+    itself, so they are sent exactly (wire.encode_table).
+    """
+    if WIRE_FORMAT != 'binary' or not isinstance(headers, list) or not isinstance(rows, list) or not rows:
+        return None
+    if not all(isinstance(row, dict) and isinstance(row.get('data'), list) and len(row['data']) == len(headers)
+               for row in rows):
+        return None
+    meta = {'headers': headers, 'names': [row.get('name') for row in rows]}
+    return wire.encode_table([row['data'] for row in rows], meta, compress=WIRE_COMPRESS)
+
+# Optional /rank fields passed through to the ranking microservice unchanged
+# (sparse edge lists, warm-start handles, deltas and previous scores, solver settings)
+RANKING_OPTION_KEYS = ('edges', 'players', 'mirror', 'handle', 'delta', 'previous', 'session', 'engine',
+                       'solver', 'elo_mode', 'max_iters', 'tolerance')
+
 # Algorithm microservice communication (assuming it's on localhost:5050)
-def get_ranking_from_microservice(table, algorithm_type='default'):
+# Returns the full response body, i.e. 'ranking' plus any extras such as 'handle'
+def get_ranking_from_microservice(table, algorithm_type='default', options=None):
     try:
-        response = requests.post(
-            'http://localhost:5050/rank',
-            json={'table': table, 'algorithm': algorithm_type}
-        )
+        payload = {'table': table, 'algorithm': algorithm_type}
+        payload.update(options or {})
+        if GATEWAY_BACKEND == 'inprocess':
+            # Same validation, sessions and cache as the microservice, without the HTTP hop,
+            # and the same timeout as post_with_deadline once the deadline has passed
+            if deadlines.expired(g.deadline):
+                raise requests.exceptions.Timeout('Request deadline exceeded before ranking')
+            run = functools.partial(run_ranking_job, deadline=g.deadline)
+            status, body, _ = ranking_service.rank_payload(payload, run=run, deadline=g.deadline)
+            result = json.loads(body)
+            if status != 200:
+                return None, result.get('error', f'Unknown error from ranking service (Status: {status})')
+            return result, None
+        binary_body = None
+        if table and payload.get('engine') != 'python':
+            binary_body = encode_table(table, {key: value for key, value in payload.items() if key != 'table'})
+        response = post_table('http://localhost:5050/rank', payload, binary_body)
         if response.status_code != 200:
             error_data = response.json()
             return None, error_data.get('error', f'Unknown error from ranking microservice (Status: {response.status_code})')
-        return response.json()['ranking'], None
+        return response.json(), None
     except requests.exceptions.ConnectionError:
         return None, "Could not connect to the ranking microservice. Is it running on port 5050?"
     except requests.exceptions.Timeout:
@@ -47,21 +252,65 @@ def get_ranking_from_microservice(table, algorithm_type='default'):
 
 
 # Export microservice communication (assuming it's on localhost:5051)
-def get_exported_ranking_data(table, ranking_scores, player_names):
+# With `player_stats` from get_player_stats the table is not sent again
+def get_exported_ranking_data(table, ranking_scores, player_names, player_stats=None):
+    try:
+        if GATEWAY_BACKEND == 'inprocess':
+            if player_stats is None:
+                stats = export_service.compute_player_stats(table, player_names)
+            else:
+                stats = export_service.player_stats_from_lists(player_stats, player_names)
+            return export_service.build_ranking_csv(stats, ranking_scores, player_names).encode('utf-8'), None
+        if player_stats is not None:
+            response = post_with_deadline(
+                'http://localhost:5051/export_ranking_data',
+                json={'ranking': ranking_scores, 'playerNames': player_names, 'playerStats': player_stats}
+            )
+        else:
+            binary_body = encode_export_table(table, player_names, {'ranking': ranking_scores, 'playerNames': player_names})
+            response = post_table(
+                'http://localhost:5051/export_ranking_data',
+                {
+                    'table': table,
+                    'ranking': ranking_scores,
+                    'playerNames': player_names
+                },
+                binary_body
+            )
+        if response.status_code != 200:
+            error_data = response.json()
+            return None, error_data.get('error', f'Unknown error from export microservice (Status: {response.status_code})')
+        
+        return response.content, None
+    except requests.exceptions.ConnectionError:
+        return None, "Could not connect to the export microservice. Is it running on port 5051?"
+    except requests.exceptions.Timeout:
+        return None, "Export microservice request timed out."
+    except requests.exceptions.RequestException as e:
+        return None, f"An error occurred during request to export microservice: {str(e)}"
+    except Exception as e:
+        return None, str(e)
+
+# Export statistics (win rates and matches played) of every player, which
+# need only the table, so they can be computed while the ranking runs
+def get_player_stats(table, player_names):
     try:
-        response = requests.post(
-            'http://localhost:5051/export_ranking_data',
-            json={
+        if GATEWAY_BACKEND == 'inprocess':
+            stats = export_service.compute_player_stats(table, player_names)
+            return export_service.player_stats_lists(stats, player_names), None
+        response = post_table(
+            'http://localhost:5051/player_stats',
+            {
                 'table': table,
-                'ranking': ranking_scores,
                 'playerNames': player_names
-            }
+            },
+            encode_export_table(table, player_names, {'playerNames': player_names})
         )
         if response.status_code != 200:
             error_data = response.json()
             return None, error_data.get('error', f'Unknown error from export microservice (Status: {response.status_code})')
-        
-        return response.content, None
+
+        return response.json(), None
     except requests.exceptions.ConnectionError:
         return None, "Could not connect to the export microservice. Is it running on port 5051?"
     except requests.exceptions.Timeout:
@@ -74,12 +323,17 @@ def get_exported_ranking_data(table, ranking_scores, player_names):
 # Validation microservice communication (assuming it's on localhost:5052)
 def validate_data_with_microservice(headers, rows):
     try:
-        response = requests.post(
+        if GATEWAY_BACKEND == 'inprocess':
+            if not isinstance(headers, list) or not isinstance(rows, list):
+                return None, "Headers and rows must be lists"
+            return validation_service.validate_head_to_head_data(headers, rows), None
+        response = post_table(
             'http://localhost:5052/validate_data',
-            json={
+            {
                 'headers': headers,
                 'rows': rows
-            }
+            },
+            encode_validation_rows(headers, rows)
         )
         if response.status_code != 200:
             error_data = response.json()
@@ -101,31 +355,46 @@ def validate_data_with_microservice(headers, rows):
 @app.route('/upload_heatmap_csv', methods=['POST'])
 def upload_heatmap_csv_endpoint():
     """
-    Receives a CSV file from the frontend, saves it locally, and sends it
-    to the remote heatmap upload server via client_socket.py.
+    Relays a CSV from the frontend to the remote heatmap upload server via
+    client_socket.py without writing it to disk. Accepts a multipart form
+    with a 'file' part (kept in memory by InMemoryUploadRequest), or the raw
+    CSV as the request body (text/csv or application/octet-stream, named by
+    the 'filename' query argument), which is streamed straight into the
+    upload socket as it arrives when Content-Length is given. Either is
+    refused with 413 past MAX_UPLOAD_BYTES.
     """
-    if 'file' not in request.files:
-        return jsonify({"error":"No file part"}), 400
-
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error":"No selected file"}), 400
-
-    temp_dir = None
-    local_filepath = None
+    # Werkzeug checks the cap against Content-Length, and while a chunked body is read
+    request.max_content_length = MAX_UPLOAD_BYTES
     try:
-        # Use tempfile to securely create a temporary file and directory
-        temp_dir = tempfile.mkdtemp()
-        # Secure filename to prevent directory traversal attacks
-        local_filepath = os.path.join(temp_dir, secure_filename(file.filename))
-        file.save(local_filepath)
-        print(f"Saved local temp file for heatmap upload: {local_filepath}")
-
-        # Use the imported upload_csv function from client_socket.py
-        upload_csv(local_filepath)
-        
+        if request.mimetype in RAW_UPLOAD_TYPES:
+            filename = secure_filename(request.args.get('filename', '')) or DEFAULT_UPLOAD_NAME
+            if request.content_length is not None:
+                upload_stream(filename, request.stream, request.content_length)
+            else:
+                # Unknown length (chunked body): the server needs the size up front
+                with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES) as spool:
+                    shutil.copyfileobj(request.stream, spool, UPLOAD_BUFFER_SIZE)
+                    size = spool.tell()
+                    spool.seek(0)
+                    upload_stream(filename, spool, size)
+        else:
+            if 'file' not in request.files:
+                return jsonify({"error":"No file part"}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({"error":"No selected file"}), 400
+
+            # Secure filename to prevent directory traversal attacks
+            filename = secure_filename(file.filename)
+            size = file.stream.seek(0, os.SEEK_END)
+            file.stream.seek(0)
+            upload_stream(filename, file.stream, size)
+
         # Return the basename of the file so the frontend can use it for the heatmap request
-        return jsonify({"message": "CSV uploaded to heatmap server successfully", "filename": os.path.basename(local_filepath)}), 200
+        return jsonify({"message": "CSV uploaded to heatmap server successfully", "filename": filename}), 200
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"CSV is larger than the {MAX_UPLOAD_BYTES} bytes allowed"}), 413
     except ConnectionError as e: # Catch custom ConnectionError from client_socket.py
         import traceback
         traceback.print_exc()
@@ -134,12 +403,6 @@ def upload_heatmap_csv_endpoint():
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"An error occurred during CSV upload for heatmap: {str(e)}"}), 500
-    finally:
-        # Clean up the temporary file and directory
-        if local_filepath and os.path.exists(local_filepath):
-            os.remove(local_filepath)
-        if temp_dir and os.path.exists(temp_dir):
-            os.rmdir(temp_dir)
 
 
 @app.route('/request_heatmap_image', methods=['POST'])
@@ -147,6 +410,8 @@ def request_heatmap_image_endpoint():
     """
     Requests a heatmap image from the remote heatmap generator server
     via client_socket.py, using the filename previously uploaded.
+    With "stream": true the image is forwarded to the client as it arrives
+    instead of being received in full first.
     """
     data = request.json
     filename = data.get('filename') # This is the original filename (basename)
@@ -156,6 +421,12 @@ def request_heatmap_image_endpoint():
         return jsonify({"error": "Missing filename for heatmap request"}), 400
 
     try:
+        if data.get('stream'):
+            # Errors up to the image header are still reported as JSON below
+            filesize, chunks = stream_heatmap(filename, color_string)
+            return app.response_class(chunks, mimetype="image/png", direct_passthrough=True,
+                                      headers={"Content-Length": str(filesize)})
+
         # Use the imported request_heatmap function from client_socket.py
         image_data = request_heatmap(filename, color_string)
         
@@ -164,6 +435,8 @@ def request_heatmap_image_endpoint():
         response.headers["Content-Type"] = "image/png"
         return response
 
+    except HeatmapServerBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
     except ConnectionError as e: # Catch custom ConnectionError from client_socket.py
         import traceback
         traceback.print_exc()
@@ -174,6 +447,94 @@ def request_heatmap_image_endpoint():
         return jsonify({"error": f"An error occurred during heatmap generation: {str(e)}"}), 500
 
 
+# --- Heatmap tiles ---
+
+# Tiles kept in the gateway's memory, least recently used evicted first
+TILE_CACHE_BYTES = int(os.environ.get('GATEWAY_TILE_CACHE_BYTES', 64 * 1024 * 1024))
+# A tile's URL names the CSV's contents and the colors, so it never changes
+TILE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+TILE_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+# (pyramid id, level, x, y, color string) -> PNG bytes
+_tiles = ByteCache(TILE_CACHE_BYTES)
+
+def tile_pyramid_response(meta):
+    """
+    A pyramid's metadata and the URL template of its tiles, as returned by the /heatmap_tiles endpoints.
+    """
+    return {**meta, "tiles": f"/heatmap_tiles/{meta['sha256']}/{{level}}/{{x}}/{{y}}.png"}
+
+@app.route('/heatmap_tiles', methods=['POST'])
+def heatmap_tiles_endpoint():
+    """
+    Has the remote heatmap generator build the tile pyramid of a CSV
+    previously uploaded with /upload_heatmap_csv ("filename"), or of one
+    it still stores ("sha256", the id of an earlier pyramid), so a league
+    too large for one image can be panned and zoomed a tile at a time.
+    Responds with the pyramid's metadata and the URL template of its tiles.
+    """
+    data = request.json
+    filename = data.get('filename')
+    digest = data.get('sha256')
+
+    if not filename and not digest:
+        return jsonify({"error": "Missing filename for heatmap tiles request"}), 400
+
+    try:
+        meta = request_heatmap_tiles(filename, digest)
+        return jsonify(tile_pyramid_response(meta)), 200
+    except HeatmapServerBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except HeatmapNotStored as e:
+        return jsonify({"error": str(e)}), 404
+    except ConnectionError as e: # Catch custom ConnectionError from client_socket.py
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Failed to connect to or build heatmap tiles on remote server: {str(e)}"}), 500
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"An error occurred during heatmap tiles generation: {str(e)}"}), 500
+
+
+@app.route('/heatmap_tiles/<digest>/<int:level>/<int:x>/<int:y>.png', methods=['GET'])
+def heatmap_tile_endpoint(digest, level, x, y):
+    """
+    One tile of a pyramid built by /heatmap_tiles: column x, row y of zoom
+    `level`, in the colors of the 'color' query argument. Tiles are cached
+    in the gateway and may be cached by the browser indefinitely. A 404
+    means the pyramid has expired and should be requested again; a 400,
+    that the tile is outside it.
+    """
+    if not TILE_ID_PATTERN.fullmatch(digest):
+        return jsonify({"error": "Unknown heatmap tiles"}), 404
+    color_string = request.args.get('color', '')
+    key = (digest, level, x, y, color_string)
+
+    image_data = _tiles.get(key)
+    if image_data is None:
+        try:
+            image_data = bytes(request_heatmap_tile(digest, level, x, y, color_string))
+        except HeatmapServerBusy as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+        except HeatmapNotStored as e:
+            return jsonify({"error": str(e)}), 404
+        except HeatmapRequestInvalid as e:
+            return jsonify({"error": str(e)}), 400
+        except ConnectionError as e: # Catch custom ConnectionError from client_socket.py
+            import traceback
+            traceback.print_exc()
+            return jsonify({"error": f"Failed to connect to or retrieve heatmap tile from remote server: {str(e)}"}), 500
+        except Exception as e:
+            return jsonify({"error": f"An error occurred during heatmap tile generation: {str(e)}"}), 500
+        _tiles.put(key, image_data)
+
+    response = app.make_response(image_data)
+    response.headers["Content-Type"] = "image/png"
+    response.headers["Cache-Control"] = TILE_CACHE_CONTROL
+    return response
+
+
 @app.route('/rank', methods=['POST'])
 def rank_endpoint():
     data = request.get_json()
@@ -182,15 +543,16 @@ def rank_endpoint():
 
     table = data.get('table')
     algorithm = data.get('algorithm', 'default')
+    options = {key: data[key] for key in RANKING_OPTION_KEYS if key in data}
 
-    if not table:
+    if not table and 'edges' not in options and 'handle' not in options:
         return jsonify({"error": "Missing 'table' data for ranking"}), 400
 
-    ranking, error = get_ranking_from_microservice(table, algorithm)
+    result, error = get_ranking_from_microservice(table, algorithm, options)
 
     if error:
         return jsonify({"error": error}), 500
-    return jsonify({"ranking": ranking}), 200
+    return jsonify(result), 200
 
 
 @app.route('/export_ranking', methods=['POST'])
@@ -238,6 +600,183 @@ def validate_data_endpoint():
     return jsonify({"errors": errors}), 200 # Return the list of errors
 
 
+# --- One-shot analysis pipeline ---
+
+# Threads running the concurrent stages of /analyze requests
+ANALYZE_WORKERS = int(os.environ.get('GATEWAY_ANALYZE_WORKERS', 8))
+# Number of finished analyses whose CSV and PNG stay downloadable
+MAX_ANALYSES = int(os.environ.get('GATEWAY_MAX_ANALYSES', 32))
+
+_analyze_pool = ThreadPoolExecutor(ANALYZE_WORKERS)
+# analysis id -> {'ranking.csv': bytes, 'heatmap.png': bytes}, oldest evicted first
+_analyses = OrderedDict()
+_analyses_lock = threading.Lock()
+
+ANALYSIS_FILES = {'ranking.csv': 'text/csv', 'heatmap.png': 'image/png'}
+# Fields of a ranking result passed on by /analyze
+ANALYSIS_RANKING_FIELDS = ('ranking', 'convergence', 'handle')
+
+def table_csv(headers, rows):
+    """
+    The head-to-head CSV the heatmap server reads: a blank corner cell and
+    the player names on top, then each player's name followed by their row.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow([''] + list(headers))
+    for row in rows:
+        writer.writerow([row.get('name', '')] + list(row.get('data', [])))
+    return output.getvalue().encode('utf-8')
+
+def render_heatmap(csv_data, filename, color_string, deadline=None):
+    """
+    Sends a CSV to the remote heatmap server under `filename` and returns the
+    rendered PNG, in one round trip on one connection. No wait on the
+    connection lasts past `deadline`.
+    """
+    timeout = deadlines.remaining(deadline)
+    if timeout is not None and timeout <= 0:
+        raise TimeoutError('Request deadline exceeded before the heatmap was requested')
+    return upload_and_request_heatmap(filename, io.BytesIO(csv_data), len(csv_data), color_string, timeout)
+
+def analysis_ranking(result):
+    """
+    The public fields of a ranking result for the /analyze response: the
+    scores as "ranking", plus "convergence" and the session "handle" when
+    the ranking has them.
+    """
+    if result is None:
+        return {"ranking": None}
+    return {key: result[key] for key in ANALYSIS_RANKING_FIELDS if key in result}
+
+def store_analysis(analysis_id, files):
+    with _analyses_lock:
+        _analyses[analysis_id] = files
+        while len(_analyses) > MAX_ANALYSES:
+            _analyses.popitem(last=False)
+
+@app.route('/analyze', methods=['POST'])
+def analyze_endpoint():
+    """
+    Runs the whole pipeline for one table, sent once: validation first, then
+    ranking, the export statistics and heatmap rendering side by side; only
+    writing the export CSV waits for the ranking. The JSON response carries
+    the ranking, per-stage timings and errors, and links to the exported CSV
+    and heatmap PNG, which are kept for the last MAX_ANALYSES analyses.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    headers = data.get('headers')
+    rows = data.get('rows')
+    if not isinstance(headers, list) or not headers or not isinstance(rows, list):
+        return jsonify({"error": "Missing headers or rows data for analysis"}), 400
+
+    algorithm = data.get('algorithm', 'default')
+    options = {key: data[key] for key in RANKING_OPTION_KEYS if key in data}
+    player_names = data.get('playerNames') or headers
+    timings = {}
+
+    started = time.perf_counter()
+    errors, error_message = validate_data_with_microservice(headers, rows)
+    timings['validate'] = round((time.perf_counter() - started) * 1000, 1)
+    if error_message:
+        return jsonify({"error": error_message}), 500
+    if errors:
+        # Inconsistent tables are not ranked or plotted
+        return jsonify({"errors": errors, "timings_ms": timings}), 422
+
+    table = [row.get('data') for row in rows]
+    analysis_id = uuid.uuid4().hex
+    deadline = g.deadline
+
+    @copy_current_request_context
+    def rank():
+        g.deadline = deadline # the copied context starts with an empty g
+        stage_started = time.perf_counter()
+        try:
+            return get_ranking_from_microservice(table, algorithm, options)
+        finally:
+            timings['rank'] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+    @copy_current_request_context
+    def export_stats():
+        g.deadline = deadline
+        stage_started = time.perf_counter()
+        try:
+            return get_player_stats(table, player_names)
+        finally:
+            timings['export'] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+    def heatmap():
+        stage_started = time.perf_counter()
+        try:
+            # A unique name, so concurrent analyses never overwrite each other's upload
+            return render_heatmap(table_csv(headers, rows), f'analysis_{analysis_id}.csv', data.get('color', ''),
+                                  deadline), None
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return None, f"Heatmap generation failed: {str(e)}"
+        finally:
+            timings['heatmap'] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+    rank_future = _analyze_pool.submit(rank)
+    stats_future = _analyze_pool.submit(export_stats)
+    heatmap_future = _analyze_pool.submit(heatmap) if data.get('heatmap', True) else None
+    ranking_result, rank_error = rank_future.result()
+    player_stats, export_error = stats_future.result()
+
+    # Only the CSV itself waits for the ranking
+    stage_errors = {}
+    exported_data = None
+    if rank_error:
+        stage_errors['rank'] = rank_error
+    elif export_error:
+        stage_errors['export'] = export_error
+    else:
+        stage_started = time.perf_counter()
+        exported_data, export_error = get_exported_ranking_data(None, ranking_result['ranking'], player_names,
+                                                                player_stats)
+        timings['export'] += round((time.perf_counter() - stage_started) * 1000, 1)
+        if export_error:
+            stage_errors['export'] = export_error
+    image_data, heatmap_error = heatmap_future.result() if heatmap_future else (None, None)
+    if heatmap_error:
+        stage_errors['heatmap'] = heatmap_error
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+
+    files = {}
+    if exported_data is not None:
+        files['ranking.csv'] = exported_data
+    if image_data is not None:
+        files['heatmap.png'] = image_data
+    store_analysis(analysis_id, files)
+
+    return jsonify({
+        "id": analysis_id,
+        "errors": [],
+        **analysis_ranking(ranking_result),
+        "links": {name: f"/analyze/{analysis_id}/{name}" for name in files},
+        "stage_errors": stage_errors,
+        "timings_ms": timings,
+    }), 200
+
+
+@app.route('/analyze/<analysis_id>/<name>', methods=['GET'])
+def analysis_file_endpoint(analysis_id, name):
+    with _analyses_lock:
+        content = _analyses.get(analysis_id, {}).get(name)
+    if content is None:
+        return jsonify({"error": "Unknown or expired analysis file"}), 404
+    response = app.make_response(content)
+    response.headers["Content-Type"] = ANALYSIS_FILES[name]
+    if name == 'ranking.csv':
+        response.headers["Content-Disposition"] = "attachment; filename=league_ranking_data.csv"
+    return response
+
+
 if __name__ == '__main__':
     # Flask app runs on port 5000, listening for requests from your React frontend
     app.run(port=5000, debug=True) # debug=True provides more detailed error messages
\ No newline at end of file
@@ -0,0 +1,555 @@
+import asyncio
+import functools
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import httpx
+import requests
+from quart import Quart, request, jsonify, g
+from quart_cors import cors
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+# Asynchronous (ASGI) variant of the app.py gateway with identical routes and
+# responses. Calls to the microservices go through httpx.AsyncClient and the
+# heatmap socket protocol through client_socket_async.py, so a slow render or
+# ranking waits on the event loop instead of pinning a worker thread and one
+# process can keep hundreds of requests in flight. CPU-bound work in the
+# gateway itself (parsing tables for the binary wire format, the in-process
+# backend) runs on threads. Serve it with an ASGI server, e.g.
+#     hypercorn async_app:app --bind localhost:5000
+# Configuration (GATEWAY_* variables) is shared with app.py.
+import app as gateway
+import deadlines
+from client_socket_async import upload_stream, request_heatmap, stream_heatmap, upload_and_request_heatmap, HeatmapServerBusy
+from client_socket_async import request_heatmap_tiles, request_heatmap_tile, HeatmapNotStored, HeatmapRequestInvalid
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+# Quart refuses any body over its 16 MB default with 413; allow the uploads app.py does
+app.config['MAX_CONTENT_LENGTH'] = gateway.MAX_UPLOAD_BYTES
+
+os.makedirs(gateway.UPLOAD_FOLDER, exist_ok=True)
+
+
+# --- Microservice Communication Functions ---
+
+# One pooled AsyncClient per microservice host; created on the serving event loop
+_http_clients = {}
+
+def http_client(url):
+    host = httpx.URL(url).netloc
+    client = _http_clients.get(host)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=gateway.POOL_SIZE),
+            transport=httpx.AsyncHTTPTransport(retries=1), # only retries failed connection attempts
+        )
+        _http_clients[host] = client
+    return client
+
+@app.after_serving
+async def close_http_clients():
+    for client in _http_clients.values():
+        await client.aclose()
+    _http_clients.clear()
+
+@app.before_request
+async def start_deadline():
+    g.deadline = deadlines.request_deadline(request.headers, gateway.REQUEST_BUDGET)
+
+async def post_with_deadline(url, **kwargs):
+    """
+    Async counterpart of app.post_with_deadline.
+    """
+    remaining = deadlines.remaining(g.deadline)
+    if remaining is not None and remaining <= 0:
+        raise httpx.TimeoutException('Request deadline exceeded before calling the microservice')
+    headers = dict(kwargs.pop('headers', None) or {})
+    connect_timeout, read_timeout = gateway.CONNECT_TIMEOUT, gateway.READ_TIMEOUT
+    if remaining is not None:
+        connect_timeout, read_timeout = min(connect_timeout, remaining), min(read_timeout, remaining)
+        headers[deadlines.DEADLINE_HEADER] = str(int(remaining * 1000))
+    timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    return await http_client(url).post(url, headers=headers, timeout=timeout, **kwargs)
+
+async def post_table(url, payload, binary_body=None):
+    """
+    Async counterpart of app.post_table, sharing its record of JSON-only services.
+    """
+    if binary_body is not None and gateway.WIRE_FORMAT == 'binary' and url not in gateway.json_only_urls:
+        response = await post_with_deadline(url, content=binary_body, headers={'Content-Type': gateway.wire.CONTENT_TYPE})
+        if response.status_code != 415:
+            return response
+        gateway.json_only_urls.add(url)
+    return await post_with_deadline(url, json=payload)
+
+def service_error(service, port, e):
+    """
+    The error message app.py gives for a failed microservice call.
+    """
+    # the in-process ranking pool reports a missed deadline as a requests Timeout
+    if isinstance(e, (httpx.TimeoutException, requests.exceptions.Timeout)):
+        return f"{service.capitalize()} microservice request timed out."
+    if isinstance(e, httpx.ConnectError):
+        return f"Could not connect to the {service} microservice. Is it running on port {port}?"
+    if isinstance(e, httpx.HTTPError):
+        return f"An error occurred during request to {service} microservice: {str(e)}"
+    return str(e)
+
+# Algorithm microservice communication (assuming it's on localhost:5050)
+# Returns the full response body, i.e. 'ranking' plus any extras such as 'handle'
+async def get_ranking_from_microservice(table, algorithm_type='default', options=None):
+    try:
+        payload = {'table': table, 'algorithm': algorithm_type}
+        payload.update(options or {})
+        if gateway.GATEWAY_BACKEND == 'inprocess':
+            if deadlines.expired(g.deadline):
+                raise httpx.TimeoutException('Request deadline exceeded before ranking')
+            run = functools.partial(gateway.run_ranking_job, deadline=g.deadline)
+            status, body, _ = await asyncio.to_thread(gateway.ranking_service.rank_payload, payload,
+                                                      run=run, deadline=g.deadline)
+            result = json.loads(body)
+            if status != 200:
+                return None, result.get('error', f'Unknown error from ranking service (Status: {status})')
+            return result, None
+        binary_body = None
+        if table and payload.get('engine') != 'python':
+            meta = {key: value for key, value in payload.items() if key != 'table'}
+            binary_body = await asyncio.to_thread(gateway.encode_table, table, meta)
+        response = await post_table('http://localhost:5050/rank', payload, binary_body)
+        if response.status_code != 200:
+            error_data = response.json()
+            return None, error_data.get('error', f'Unknown error from ranking microservice (Status: {response.status_code})')
+        return response.json(), None
+    except (httpx.HTTPError, requests.exceptions.Timeout) as e:
+        return None, service_error('ranking', 5050, e)
+    except Exception as e:
+        return None, str(e)
+
+# Export microservice communication (assuming it's on localhost:5051)
+async def get_exported_ranking_data(table, ranking_scores, player_names, player_stats=None):
+    try:
+        if gateway.GATEWAY_BACKEND == 'inprocess':
+            return await asyncio.to_thread(gateway.get_exported_ranking_data, table, ranking_scores, player_names,
+                                           player_stats)
+        if player_stats is not None:
+            response = await post_with_deadline(
+                'http://localhost:5051/export_ranking_data',
+                json={'ranking': ranking_scores, 'playerNames': player_names, 'playerStats': player_stats}
+            )
+        else:
+            binary_body = await asyncio.to_thread(gateway.encode_export_table, table, player_names,
+                                                  {'ranking': ranking_scores, 'playerNames': player_names})
+            response = await post_table(
+                'http://localhost:5051/export_ranking_data',
+                {
+                    'table': table,
+                    'ranking': ranking_scores,
+                    'playerNames': player_names
+                },
+                binary_body
+            )
+        if response.status_code != 200:
+            error_data = response.json()
+            return None, error_data.get('error', f'Unknown error from export microservice (Status: {response.status_code})')
+
+        return response.content, None
+    except httpx.HTTPError as e:
+        return None, service_error('export', 5051, e)
+    except Exception as e:
+        return None, str(e)
+
+async def get_player_stats(table, player_names):
+    try:
+        if gateway.GATEWAY_BACKEND == 'inprocess':
+            return await asyncio.to_thread(gateway.get_player_stats, table, player_names)
+        binary_body = await asyncio.to_thread(gateway.encode_export_table, table, player_names,
+                                              {'playerNames': player_names})
+        response = await post_table(
+            'http://localhost:5051/player_stats',
+            {
+                'table': table,
+                'playerNames': player_names
+            },
+            binary_body
+        )
+        if response.status_code != 200:
+            error_data = response.json()
+            return None, error_data.get('error', f'Unknown error from export microservice (Status: {response.status_code})')
+
+        return response.json(), None
+    except httpx.HTTPError as e:
+        return None, service_error('export', 5051, e)
+    except Exception as e:
+        return None, str(e)
+
+# Validation microservice communication (assuming it's on localhost:5052)
+async def validate_data_with_microservice(headers, rows):
+    try:
+        if gateway.GATEWAY_BACKEND == 'inprocess':
+            return await asyncio.to_thread(gateway.validate_data_with_microservice, headers, rows)
+        binary_body = await asyncio.to_thread(gateway.encode_validation_rows, headers, rows)
+        response = await post_table(
+            'http://localhost:5052/validate_data',
+            {
+                'headers': headers,
+                'rows': rows
+            },
+            binary_body
+        )
+        if response.status_code != 200:
+            error_data = response.json()
+            return None, error_data.get('error', f'Unknown error from validation microservice (Status: {response.status_code})')
+
+        return response.json()['errors'], None
+    except httpx.HTTPError as e:
+        return None, service_error('validation', 5052, e)
+    except Exception as e:
+        return None, str(e)
+
+
+# --- Quart Routes (Endpoints for Frontend, same as app.py) ---
+
+@app.route('/upload_heatmap_csv', methods=['POST'])
+async def upload_heatmap_csv_endpoint():
+    """
+    Relays a CSV from the frontend to the remote heatmap upload server via
+    client_socket_async.py without writing it to disk; accepts the same
+    multipart form or raw CSV body as app.upload_heatmap_csv_endpoint.
+    """
+    try:
+        if request.mimetype in gateway.RAW_UPLOAD_TYPES:
+            filename = secure_filename(request.args.get('filename', '')) or gateway.DEFAULT_UPLOAD_NAME
+            # Hashed as it arrives, so the upload server can skip contents it already stores
+            digest = hashlib.sha256()
+            with tempfile.SpooledTemporaryFile(max_size=gateway.UPLOAD_SPOOL_BYTES) as spool:
+                async for chunk in request.body:
+                    digest.update(chunk)
+                    spool.write(chunk)
+                size = spool.tell()
+                spool.seek(0)
+                await upload_stream(filename, spool, size, digest.hexdigest())
+        else:
+            files = await request.files
+            if 'file' not in files:
+                return jsonify({"error":"No file part"}), 400
+
+            file = files['file']
+            if file.filename == '':
+                return jsonify({"error":"No selected file"}), 400
+
+            # Secure filename to prevent directory traversal attacks
+            filename = secure_filename(file.filename)
+            size = file.stream.seek(0, os.SEEK_END)
+            file.stream.seek(0)
+            await upload_stream(filename, file.stream, size)
+
+        # Return the basename of the file so the frontend can use it for the heatmap request
+        return jsonify({"message": "CSV uploaded to heatmap server successfully", "filename": filename}), 200
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"CSV is larger than the {gateway.MAX_UPLOAD_BYTES} bytes allowed"}), 413
+    except ConnectionError as e: # Catch custom ConnectionError from client_socket_async.py
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Failed to connect to or upload CSV to remote heatmap server: {str(e)}"}), 500
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"An error occurred during CSV upload for heatmap: {str(e)}"}), 500
+
+
+@app.route('/request_heatmap_image', methods=['POST'])
+async def request_heatmap_image_endpoint():
+    """
+    Requests a heatmap image from the remote heatmap generator server
+    via client_socket_async.py, using the filename previously uploaded.
+    With "stream": true the image is forwarded to the client as it arrives
+    instead of being received in full first.
+    """
+    data = await request.get_json()
+    filename = data.get('filename') # This is the original filename (basename)
+    color_string = data.get('color', '')
+
+    if not filename:
+        return jsonify({"error": "Missing filename for heatmap request"}), 400
+
+    try:
+        if data.get('stream'):
+            # Errors up to the image header are still reported as JSON below
+            filesize, chunks = await stream_heatmap(filename, color_string)
+            return chunks, 200, {"Content-Type": "image/png", "Content-Length": str(filesize)}
+
+        image_data = await request_heatmap(filename, color_string)
+        return image_data, 200, {"Content-Type": "image/png"}
+
+    except HeatmapServerBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except ConnectionError as e: # Catch custom ConnectionError from client_socket_async.py
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Failed to connect to or retrieve heatmap from remote server: {str(e)}"}), 500
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"An error occurred during heatmap generation: {str(e)}"}), 500
+
+
+@app.route('/heatmap_tiles', methods=['POST'])
+async def heatmap_tiles_endpoint():
+    """
+    Has the remote heatmap generator build the tile pyramid of an uploaded
+    or stored CSV, as app.heatmap_tiles_endpoint does.
+    """
+    data = await request.get_json()
+    filename = data.get('filename')
+    digest = data.get('sha256')
+
+    if not filename and not digest:
+        return jsonify({"error": "Missing filename for heatmap tiles request"}), 400
+
+    try:
+        meta = await request_heatmap_tiles(filename, digest)
+        return jsonify(gateway.tile_pyramid_response(meta)), 200
+    except HeatmapServerBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except HeatmapNotStored as e:
+        return jsonify({"error": str(e)}), 404
+    except ConnectionError as e: # Catch custom ConnectionError from client_socket_async.py
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Failed to connect to or build heatmap tiles on remote server: {str(e)}"}), 500
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"An error occurred during heatmap tiles generation: {str(e)}"}), 500
+
+
+@app.route('/heatmap_tiles/<digest>/<int:level>/<int:x>/<int:y>.png', methods=['GET'])
+async def heatmap_tile_endpoint(digest, level, x, y):
+    """
+    One tile of a pyramid built by /heatmap_tiles, sharing app.py's tile cache.
+    """
+    if not gateway.TILE_ID_PATTERN.fullmatch(digest):
+        return jsonify({"error": "Unknown heatmap tiles"}), 404
+    color_string = request.args.get('color', '')
+    key = (digest, level, x, y, color_string)
+
+    image_data = gateway._tiles.get(key)
+    if image_data is None:
+        try:
+            image_data = await request_heatmap_tile(digest, level, x, y, color_string)
+        except HeatmapServerBusy as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+        except HeatmapNotStored as e:
+            return jsonify({"error": str(e)}), 404
+        except HeatmapRequestInvalid as e:
+            return jsonify({"error": str(e)}), 400
+        except ConnectionError as e: # Catch custom ConnectionError from client_socket_async.py
+            import traceback
+            traceback.print_exc()
+            return jsonify({"error": f"Failed to connect to or retrieve heatmap tile from remote server: {str(e)}"}), 500
+        except Exception as e:
+            return jsonify({"error": f"An error occurred during heatmap tile generation: {str(e)}"}), 500
+        gateway._tiles.put(key, image_data)
+
+    return image_data, 200, {"Content-Type": "image/png", "Cache-Control": gateway.TILE_CACHE_CONTROL}
+
+
+@app.route('/rank', methods=['POST'])
+async def rank_endpoint():
+    data = await request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    table = data.get('table')
+    algorithm = data.get('algorithm', 'default')
+    options = {key: data[key] for key in gateway.RANKING_OPTION_KEYS if key in data}
+
+    if not table and 'edges' not in options and 'handle' not in options:
+        return jsonify({"error": "Missing 'table' data for ranking"}), 400
+
+    result, error = await get_ranking_from_microservice(table, algorithm, options)
+
+    if error:
+        return jsonify({"error": error}), 500
+    return jsonify(result), 200
+
+
+@app.route('/export_ranking', methods=['POST'])
+async def export_ranking_endpoint():
+    data = await request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    table = data.get('table')
+    ranking = data.get('ranking')
+    player_names = data.get('playerNames')
+
+    if not all([table, ranking, player_names]):
+        return jsonify({"error": "Missing table, ranking, or playerNames data for export"}), 400
+
+    exported_data, error = await get_exported_ranking_data(table, ranking, player_names)
+
+    if error:
+        return jsonify({"error": error}), 500
+
+    return exported_data, 200, {
+        "Content-Type": "text/csv",
+        "Content-Disposition": "attachment; filename=league_ranking_data.csv",
+    }
+
+
+@app.route('/validate', methods=['POST'])
+async def validate_data_endpoint():
+    data = await request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    headers = data.get('headers')
+    rows = data.get('rows')
+
+    if not all([headers, rows is not None]): # rows can be empty, but not None
+        return jsonify({"error": "Missing headers or rows data for validation"}), 400
+
+    errors, error_message = await validate_data_with_microservice(headers, rows)
+
+    if error_message:
+        return jsonify({"error": error_message}), 500
+
+    return jsonify({"errors": errors}), 200 # Return the list of errors
+
+
+# --- One-shot analysis pipeline ---
+
+async def render_heatmap(csv_data, filename, color_string, deadline=None):
+    """
+    Sends a CSV to the remote heatmap server under `filename` and returns the
+    rendered PNG, in one round trip on one connection, giving up at `deadline`.
+    """
+    timeout = deadlines.remaining(deadline)
+    if timeout is not None and timeout <= 0:
+        raise TimeoutError('Request deadline exceeded before the heatmap was requested')
+    try:
+        return await asyncio.wait_for(
+            upload_and_request_heatmap(filename, io.BytesIO(csv_data), len(csv_data), color_string), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError('Heatmap was not ready within the request deadline')
+
+@app.route('/analyze', methods=['POST'])
+async def analyze_endpoint():
+    """
+    Same pipeline as app.analyze_endpoint, with the stages run as coroutines.
+    """
+    data = await request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    headers = data.get('headers')
+    rows = data.get('rows')
+    if not isinstance(headers, list) or not headers or not isinstance(rows, list):
+        return jsonify({"error": "Missing headers or rows data for analysis"}), 400
+
+    algorithm = data.get('algorithm', 'default')
+    options = {key: data[key] for key in gateway.RANKING_OPTION_KEYS if key in data}
+    player_names = data.get('playerNames') or headers
+    timings = {}
+
+    started = time.perf_counter()
+    errors, error_message = await validate_data_with_microservice(headers, rows)
+    timings['validate'] = round((time.perf_counter() - started) * 1000, 1)
+    if error_message:
+        return jsonify({"error": error_message}), 500
+    if errors:
+        # Inconsistent tables are not ranked or plotted
+        return jsonify({"errors": errors, "timings_ms": timings}), 422
+
+    table = [row.get('data') for row in rows]
+    analysis_id = uuid.uuid4().hex
+
+    async def rank():
+        stage_started = time.perf_counter()
+        try:
+            return await get_ranking_from_microservice(table, algorithm, options)
+        finally:
+            timings['rank'] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+    async def export_stats():
+        stage_started = time.perf_counter()
+        try:
+            return await get_player_stats(table, player_names)
+        finally:
+            timings['export'] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+    async def heatmap():
+        if not data.get('heatmap', True):
+            return None, None
+        stage_started = time.perf_counter()
+        try:
+            # A unique name, so concurrent analyses never overwrite each other's upload
+            csv_data = gateway.table_csv(headers, rows)
+            return await render_heatmap(csv_data, f'analysis_{analysis_id}.csv', data.get('color', ''),
+                                        g.deadline), None
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return None, f"Heatmap generation failed: {str(e)}"
+        finally:
+            timings['heatmap'] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+    async def rank_and_export():
+        (ranking_result, rank_error), (player_stats, export_error) = await asyncio.gather(rank(), export_stats())
+        if rank_error:
+            return None, None, {'rank': rank_error}
+        if export_error:
+            return ranking_result, None, {'export': export_error}
+        # Only the CSV itself waits for the ranking
+        stage_started = time.perf_counter()
+        exported_data, export_error = await get_exported_ranking_data(None, ranking_result['ranking'], player_names,
+                                                                      player_stats)
+        timings['export'] += round((time.perf_counter() - stage_started) * 1000, 1)
+        return ranking_result, exported_data, {'export': export_error} if export_error else {}
+
+    (ranking_result, exported_data, stage_errors), (image_data, heatmap_error) = \
+        await asyncio.gather(rank_and_export(), heatmap())
+    if heatmap_error:
+        stage_errors['heatmap'] = heatmap_error
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+
+    files = {}
+    if exported_data is not None:
+        files['ranking.csv'] = exported_data
+    if image_data is not None:
+        files['heatmap.png'] = image_data
+    gateway.store_analysis(analysis_id, files)
+
+    return jsonify({
+        "id": analysis_id,
+        "errors": [],
+        **gateway.analysis_ranking(ranking_result),
+        "links": {name: f"/analyze/{analysis_id}/{name}" for name in files},
+        "stage_errors": stage_errors,
+        "timings_ms": timings,
+    }), 200
+
+
+@app.route('/analyze/<analysis_id>/<name>', methods=['GET'])
+async def analysis_file_endpoint(analysis_id, name):
+    with gateway._analyses_lock:
+        content = gateway._analyses.get(analysis_id, {}).get(name)
+    if content is None:
+        return jsonify({"error": "Unknown or expired analysis file"}), 404
+    response_headers = {"Content-Type": gateway.ANALYSIS_FILES[name]}
+    if name == 'ranking.csv':
+        response_headers["Content-Disposition"] = "attachment; filename=league_ranking_data.csv"
+    return content, 200, response_headers
+
+
+if __name__ == '__main__':
+    # Same port as app.py; run one gateway or the other
+    app.run(port=5000)
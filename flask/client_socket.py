@@ -1,5 +1,10 @@
 import socket
 import os
+import json
+import struct
+import hashlib
+import threading
+import time
 
 # Set the HOST to your peer's remote IP address
 HOST = '3.131.47.90'
@@ -8,82 +13,589 @@ REQUEST_PORT = 5556
 SEPARATOR = "<SEPERATOR>"
 BUFFER_SIZE = 4096
 MESSAGE_SIZE = 1024
+# read size when relaying an upload from a stream
+UPLOAD_BUFFER_SIZE = 64 * 1024
+# largest chunk forwarded at a time when streaming an image to the HTTP response
+DOWNLOAD_BUFFER_SIZE = 64 * 1024
+
+# Persistent connections: each header carries a third field asking the
+# servers to keep the connection open (and the upload server to acknowledge
+# every file), so one connection per port serves many uploads and heatmaps.
+# Set HEATMAP_KEEP_ALIVE=0 for peers still running the one-shot servers.
+KEEP_ALIVE = "keep-alive"
+PERSISTENT_CONNECTIONS = os.environ.get('HEATMAP_KEEP_ALIVE', '1') != '0'
+# idle connections kept open per port
+POOL_SIZE = int(os.environ.get('HEATMAP_POOL_SIZE', 4))
+# seconds an idle connection is trusted before it is closed instead of reused
+POOL_IDLE_TIMEOUT = float(os.environ.get('HEATMAP_POOL_IDLE_TIMEOUT', 60))
+# heatmap requests sent ahead of the replies when pipelining
+PIPELINE_DEPTH = 8
+
+# Binary framing (version 1): a fixed prefix (magic, version, op, header
+# length, body length), a JSON header and the body, for requests and replies
+# alike, so no message depends on padding or a single recv. Uploads are
+# always acknowledged, and OP_UPLOAD_HEATMAP sends a CSV and gets its heatmap
+# back in one round trip on the generator port. Set HEATMAP_PROTOCOL=legacy
+# for peers that only speak the 1024-byte text headers; heatmap tiles
+# (OP_TILE_PYRAMID, OP_TILE) are only served over binary framing.
+BINARY_FRAMING = os.environ.get('HEATMAP_PROTOCOL', 'binary') != 'legacy'
+FRAME_MAGIC = b'\x89HMP'
+PROTOCOL_VERSION = 1
+FRAME_PREFIX = struct.Struct('!4sBBIQ')
+OP_UPLOAD = 1
+OP_HEATMAP = 2
+OP_UPLOAD_HEATMAP = 3
+OP_TILE_PYRAMID = 4
+OP_TILE = 5
+OP_REPLY = 0x80
 
 def pad_string(text, length=MESSAGE_SIZE, char=' '):
     return text.ljust(length, char)
 
-def upload_csv(file_path):
+def _header(text):
+    if PERSISTENT_CONNECTIONS:
+        text = f"{text}{SEPARATOR}{KEEP_ALIVE}"
+    return pad_string(text).encode()
+
+def _frame(op, header, body_size=0):
     """
-    Connects to the remote upload server and sends a CSV file.
-    file_path: The local path to the CSV file to be uploaded.
+    The prefix and JSON header of a binary frame whose body of `body_size` bytes follows.
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Specify IPv4 and TCP
-    print(f"Attempting to connect to {HOST}:{UPLOAD_PORT} for CSV upload...")
+    header = json.dumps(header).encode()
+    return FRAME_PREFIX.pack(FRAME_MAGIC, PROTOCOL_VERSION, op, len(header), body_size) + header
+
+def _parse_frame_prefix(prefix):
+    """
+    Returns (header size, body size) of a reply frame's prefix.
+    """
+    magic, version, op, header_size, body_size = FRAME_PREFIX.unpack(prefix)
+    if magic != FRAME_MAGIC or op != OP_REPLY:
+        raise ConnectionError("Remote heatmap server sent something other than a reply frame")
+    if version != PROTOCOL_VERSION:
+        raise ConnectionError(f"Remote heatmap server replied with protocol version {version}")
+    return header_size, body_size
+
+def _reply_text(header):
+    """
+    A reply frame's header as the "NN message" status line of the text protocol.
+    """
+    header = json.loads(header)
+    return f"{header.get('status', '02')} {header.get('message', '')}"
+
+def _heatmap_request(file_name, color_string):
+    if BINARY_FRAMING:
+        return _frame(OP_HEATMAP, {"name": file_name, "colors": color_string})
+    return _header(f"{file_name}{SEPARATOR}{color_string}")
+
+class _StaleConnection(ConnectionError):
+    """
+    The server had closed the connection before it answered the request.
+    """
+
+# Errors showing that a reused connection was already dead when it was picked up
+STALE_ERRORS = (_StaleConnection, ConnectionResetError, BrokenPipeError)
+
+def _is_open(s):
+    """
+    Health check for an idle connection: it is usable if nothing is waiting
+    to be read, since a closed or reset connection reads as EOF or an error.
+    """
+    timeout = s.gettimeout()
+    try:
+        s.setblocking(False)
+        s.recv(1, socket.MSG_PEEK)
+        return False # EOF, or bytes nobody asked for
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        s.settimeout(timeout)
+
+class ConnectionPool:
+    """
+    Idle persistent connections to one heatmap server port. Connections are
+    health-checked before reuse, and dropped once they have been idle for
+    longer than `idle_timeout` or more than `size` are idle.
+    """
+    def __init__(self, port, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Specify IPv4 and TCP
+        try:
+            s.connect((HOST, self.port))
+        except socket.error:
+            s.close()
+            raise
+        return s
+
+    def acquire(self):
+        """
+        Returns (socket, reused), reusing the most recently released healthy connection if any.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                s, released_at = self._idle.pop()
+            if time.monotonic() - released_at < self.idle_timeout and _is_open(s):
+                return s, True
+            s.close()
+        return self.connect(), False
+
+    def release(self, s):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((s, time.monotonic()))
+                return
+        s.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for s, _ in idle:
+            s.close()
+
+upload_pool = ConnectionPool(UPLOAD_PORT)
+request_pool = ConnectionPool(REQUEST_PORT)
+
+def _acquire(pool):
+    if PERSISTENT_CONNECTIONS:
+        return pool.acquire()
+    return pool.connect(), False
+
+def _release(pool, s):
+    if PERSISTENT_CONNECTIONS:
+        pool.release(s)
+    else:
+        s.close()
+
+def _exchange(pool, exchange, timeout=None):
+    """
+    Runs exchange(socket) on a pooled connection and returns its result. A
+    reused connection that turns out to have been closed or reset by the
+    server is replaced by a fresh one and the exchange retried once. The connection
+    goes back to the pool only if the exchange completed. `timeout` caps each
+    send and receive of the exchange, in seconds.
+    """
+    s, reused = _acquire(pool)
     try:
-        s.connect((HOST, UPLOAD_PORT))
-        
-        file_size = os.path.getsize(file_path)
+        try:
+            s.settimeout(timeout)
+            result = exchange(s)
+        except STALE_ERRORS:
+            if not reused:
+                raise
+            s.close()
+            s = pool.connect()
+            s.settimeout(timeout)
+            result = exchange(s)
+    except BaseException:
+        s.close()
+        raise
+    s.settimeout(None)
+    _release(pool, s)
+    return result
+
+def _recv_exact(s, size):
+    """
+    Receives exactly `size` bytes into one preallocated buffer.
+    Raises ConnectionError if the peer closes the connection first.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = s.recv_into(view[received:])
+        if not count:
+            raise ConnectionError(f"Connection closed after {received} of the expected {size} bytes")
+        received += count
+    return buffer
+
+def _recv_reply(s):
+    """
+    Reads a 1024-byte reply, raising _StaleConnection if the connection was
+    already closed before any of it arrived.
+    """
+    first = s.recv(MESSAGE_SIZE)
+    if not first:
+        raise _StaleConnection("Connection closed by the server")
+    return (first + _recv_exact(s, MESSAGE_SIZE - len(first))).decode().strip()
+
+def _recv_frame_reply(s):
+    """
+    Reads a reply frame up to its body. Returns (status line, body size),
+    raising _StaleConnection if the connection was already closed.
+    """
+    first = s.recv(FRAME_PREFIX.size)
+    if not first:
+        raise _StaleConnection("Connection closed by the server")
+    header_size, body_size = _parse_frame_prefix(bytes(first + _recv_exact(s, FRAME_PREFIX.size - len(first))))
+    return _reply_text(_recv_exact(s, header_size)), body_size
+
+def _digest(stream, size):
+    """
+    sha256 hex digest of the next `size` bytes of a seekable stream, which is left where it was.
+    """
+    start = stream.tell()
+    digest = hashlib.sha256()
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(min(UPLOAD_BUFFER_SIZE, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+    stream.seek(start)
+    return digest.hexdigest()
+
+def _upload(file_name, file_size, send_body, digest=None, timeout=None):
+    """
+    Announces a file to the remote upload server and sends its contents with
+    send_body(socket). If the file's sha256 `digest` is given, the server is
+    first asked whether it already stores those contents, and the body is
+    only sent if it does not.
+    """
+    print(f"Attempting to connect to {HOST}:{UPLOAD_PORT} for CSV upload...")
+
+    def exchange(s):
+        if BINARY_FRAMING and digest:
+            s.sendall(_frame(OP_UPLOAD, {"name": os.path.basename(file_name), "sha256": digest}))
+            reply, _ = _recv_frame_reply(s)
+            if reply.startswith("00"):
+                print(f"Remote server already stores the contents of {os.path.basename(file_name)}")
+                return
+            if not reply.startswith("01"):
+                raise ConnectionError(f"Upload rejected by remote server: {reply[3:]}")
+
         # Send only the basename of the file, as the remote server expects this
-        message = f"{os.path.basename(file_path)}{SEPARATOR}{file_size}"
-        s.send(pad_string(message).encode())
-
-        with open(file_path, "rb") as f:
-            while True:
-                bytes_read = f.read(BUFFER_SIZE)
-                if not bytes_read:
-                    break # File transmitting is done
-                s.sendall(bytes_read)
-        print(f"Successfully uploaded {os.path.basename(file_path)} to {HOST}:{UPLOAD_PORT}")
+        if BINARY_FRAMING:
+            s.sendall(_frame(OP_UPLOAD, {"name": os.path.basename(file_name)}, file_size))
+        else:
+            s.sendall(_header(f"{os.path.basename(file_name)}{SEPARATOR}{file_size}"))
+        send_body(s)
+        if BINARY_FRAMING:
+            reply, _ = _recv_frame_reply(s)
+        elif PERSISTENT_CONNECTIONS:
+            reply = _recv_reply(s)
+        else:
+            return
+        if not reply.startswith("00"):
+            raise ConnectionError(f"Upload rejected by remote server: {reply[3:]}")
+
+    try:
+        _exchange(upload_pool, exchange, timeout)
+        print(f"Successfully uploaded {os.path.basename(file_name)} to {HOST}:{UPLOAD_PORT}")
     except socket.error as e:
         raise ConnectionError(f"Could not connect or send file to remote heatmap upload server: {e}")
-    finally:
-        s.close()
 
-def request_heatmap(file_name, color_string=""):
+def upload_csv(file_path):
+    """
+    Connects to the remote upload server and sends a CSV file.
+    file_path: The local path to the CSV file to be uploaded.
+    """
+    with open(file_path, "rb") as f:
+        def send_body(s):
+            # Let the kernel copy the file straight into the socket
+            f.seek(0)
+            s.sendfile(f)
+
+        file_size = os.fstat(f.fileno()).st_size
+        _upload(file_path, file_size, send_body, _digest(f, file_size) if BINARY_FRAMING else None)
+
+def _stream_sender(stream, file_size):
+    """
+    send_body(socket) for `file_size` bytes read from a binary stream.
+    """
+    # A retry on a fresh connection has to resend the body from the start
+    start = stream.tell() if stream.seekable() else None
+    attempts = 0
+
+    def send_body(s):
+        nonlocal attempts
+        attempts += 1
+        if start is not None:
+            stream.seek(start)
+        elif attempts > 1:
+            raise ConnectionError("Upload connection was lost and the stream cannot be read again")
+        remaining = file_size
+        while remaining > 0:
+            chunk = stream.read(min(UPLOAD_BUFFER_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"Upload ended after {file_size - remaining} of the announced {file_size} bytes")
+            s.sendall(chunk)
+            remaining -= len(chunk)
+
+    return send_body
+
+def upload_stream(file_name, stream, file_size, timeout=None):
+    """
+    Sends `file_size` bytes read from a binary stream (e.g. the incoming
+    request body) to the remote upload server as `file_name`, without
+    staging them in a file. Contents the server already stores are not sent
+    again if the stream can be read twice.
+    """
+    digest = _digest(stream, file_size) if BINARY_FRAMING and stream.seekable() else None
+    _upload(file_name, file_size, _stream_sender(stream, file_size), digest, timeout)
+
+def _read_heatmap_header(s):
+    """
+    Reads the status reply and image info for one heatmap request.
+    Returns (reply, filesize), with filesize None if the request failed.
+    """
+    if BINARY_FRAMING:
+        reply, filesize = _recv_frame_reply(s)
+        if not reply.startswith("00"):
+            _recv_exact(s, filesize) # an error reply has no image, but keep the connection in step
+            return reply, None
+        print(f"Receiving image, size: {filesize} bytes")
+        return reply, filesize
+
+    # Receive status reply (1024 bytes)
+    reply = _recv_reply(s)
+    if not reply.startswith("00"):
+        return reply, None
+
+    # Receive image file info
+    received_metadata = _recv_exact(s, MESSAGE_SIZE).decode().strip()
+    filename_received, filesize_str = received_metadata.split(SEPARATOR)
+    filesize = int(filesize_str)
+    print(f"Receiving image: {filename_received}, size: {filesize} bytes")
+    return reply, filesize
+
+class HeatmapServerBusy(Exception):
+    """
+    The generator server turned the request away because all its render slots were taken ('03').
+    """
+
+class HeatmapNotStored(Exception):
+    """
+    The generator server does not have the CSV or tile pyramid asked for ('01'), e.g. once its TTL has run out.
+    """
+
+class HeatmapRequestInvalid(Exception):
+    """
+    The generator server refused the request itself ('04'), e.g. a tile outside its pyramid.
+    """
+
+def _heatmap_failed(reply):
+    if reply.startswith("04"):
+        return HeatmapRequestInvalid(f"Invalid heatmap request: {reply[3:]}")
+    if reply.startswith("03"):
+        return HeatmapServerBusy(f"Heatmap server is busy: {reply[3:]}")
+    if reply.startswith("01"):
+        return HeatmapNotStored(f"Heatmap request failed on remote server: {reply[3:]}")
+    return Exception(f"Heatmap request failed on remote server: {reply[3:]}")
+
+def request_heatmap(file_name, color_string="", timeout=None):
     """
     Connects to the remote request server, requests a heatmap, and receives the image data.
     file_name: The basename of the CSV file already uploaded to the remote server.
     color_string: The color string for the heatmap (e.g., "#00FF00 #FFFF00 #FF0000").
-    Returns: Binary image data (bytes).
+    timeout: Seconds each send or receive may wait, or None to wait indefinitely.
+    Returns: Binary image data (bytearray).
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Specify IPv4 and TCP
     print(f"Attempting to connect to {HOST}:{REQUEST_PORT} for heatmap request...")
+
+    def exchange(s):
+        s.sendall(_heatmap_request(file_name, color_string))
+        reply, filesize = _read_heatmap_header(s)
+        if filesize is None:
+            return reply, None
+        # Receive image data straight into a buffer of the announced size
+        return reply, _recv_exact(s, filesize)
+
     try:
-        s.connect((HOST, REQUEST_PORT))
+        reply, image_data = _exchange(request_pool, exchange, timeout)
+    except socket.error as e:
+        raise ConnectionError(f"Could not connect or receive heatmap from remote generator server: {e}")
+    if image_data is None:
+        raise _heatmap_failed(reply)
+    print(f"Successfully received heatmap image data from {HOST}:{REQUEST_PORT}")
+    return image_data
 
-        message = f"{file_name}{SEPARATOR}{color_string}"
-        s.send(pad_string(message).encode())
+def upload_and_request_heatmap(file_name, stream, file_size, color_string="", timeout=None):
+    """
+    Sends `file_size` bytes of CSV read from a binary stream to the remote
+    generator server and receives its heatmap over the same connection, in
+    one round trip. The server also keeps the CSV under `file_name`, so it
+    can be requested again in other colors with request_heatmap. `timeout`
+    caps each send or receive, in seconds.
+    Returns: Binary image data (bytearray).
+    """
+    if not BINARY_FRAMING:
+        upload_stream(file_name, stream, file_size, timeout)
+        return request_heatmap(os.path.basename(file_name), color_string, timeout)
 
-        # Receive status reply (1024 bytes)
-        reply = s.recv(MESSAGE_SIZE).decode().strip()
-        if not reply.startswith("00"):
-            raise Exception(f"Heatmap request failed on remote server: {reply[3:]}")
-        
-        # Receive image file info
-        received_metadata = s.recv(MESSAGE_SIZE).decode().strip()
-        filename_received, filesize_str = received_metadata.split(SEPARATOR)
-        filesize = int(filesize_str)
-        print(f"Receiving image: {filename_received}, size: {filesize} bytes")
-
-        # Receive image data
-        image_data = b""
-        total_bytes_received = 0
-        while total_bytes_received < filesize:
-            chunk = s.recv(BUFFER_SIZE)
-            if not chunk:
-                # Connection closed prematurely
-                break
-            image_data += chunk
-            total_bytes_received += len(chunk)
-        
-        if total_bytes_received != filesize:
-            print(f"Warning: Expected {filesize} bytes but received {total_bytes_received} bytes.")
-
-        print(f"Successfully received heatmap image data from {HOST}:{REQUEST_PORT}")
-        return image_data
+    print(f"Attempting to connect to {HOST}:{REQUEST_PORT} to upload and request a heatmap...")
+    send_body = _stream_sender(stream, file_size)
+
+    def exchange(s):
+        s.sendall(_frame(OP_UPLOAD_HEATMAP, {"name": os.path.basename(file_name), "colors": color_string}, file_size))
+        send_body(s)
+        reply, filesize = _read_heatmap_header(s)
+        if filesize is None:
+            return reply, None
+        return reply, _recv_exact(s, filesize)
+
+    try:
+        reply, image_data = _exchange(request_pool, exchange, timeout)
     except socket.error as e:
         raise ConnectionError(f"Could not connect or receive heatmap from remote generator server: {e}")
-    finally:
+    if image_data is None:
+        raise _heatmap_failed(reply)
+    print(f"Successfully received heatmap image data from {HOST}:{REQUEST_PORT}")
+    return image_data
+
+def _tile_exchange(op, header, what):
+    """
+    Sends one tile request frame on a pooled generator connection and returns the body of its reply.
+    """
+    if not BINARY_FRAMING:
+        raise Exception("Heatmap tiles need binary framing, which HEATMAP_PROTOCOL=legacy turns off")
+
+    def exchange(s):
+        s.sendall(_frame(op, header))
+        reply, size = _recv_frame_reply(s)
+        return reply, _recv_exact(s, size)
+
+    try:
+        reply, body = _exchange(request_pool, exchange)
+    except socket.error as e:
+        raise ConnectionError(f"Could not connect or receive {what} from remote generator server: {e}")
+    if not reply.startswith("00"):
+        raise _heatmap_failed(reply)
+    return body
+
+def request_heatmap_tiles(file_name=None, digest=None):
+    """
+    Has the remote generator server build the tile pyramid of an uploaded
+    CSV (by its basename) or of contents it still stores (by their sha256
+    digest), unless it is already built.
+    Returns: The pyramid's metadata (dict) with its "sha256" id, "players",
+    "size", "levels", "tile_size" (pixels) and "tile_blocks" (blocks per tile side).
+    """
+    print(f"Attempting to connect to {HOST}:{REQUEST_PORT} for a tile pyramid...")
+    header = {"name": os.path.basename(file_name)} if file_name else {"sha256": digest}
+    meta = json.loads(_tile_exchange(OP_TILE_PYRAMID, header, "a tile pyramid"))
+    print(f"Tile pyramid {meta['sha256']} has {meta['levels']} levels")
+    return meta
+
+def request_heatmap_tile(digest, level, x, y, color_string=""):
+    """
+    Receives tile (x, y) (column, row) of zoom `level` of a built pyramid.
+    Returns: Binary PNG data (bytearray).
+    """
+    header = {"sha256": digest, "level": level, "x": x, "y": y, "colors": color_string}
+    return _tile_exchange(OP_TILE, header, "a heatmap tile")
+
+def request_heatmaps(requests):
+    """
+    Pipelines several heatmap requests over one connection: up to
+    PIPELINE_DEPTH requests are sent ahead of their replies, which the
+    server answers in order.
+    requests: A list of (file_name, color_string) pairs.
+    Returns: A list with the image data (bytearray) for each request, or the
+    Exception describing why the server could not create it.
+    """
+    if not PERSISTENT_CONNECTIONS:
+        results = []
+        for file_name, color_string in requests:
+            try:
+                results.append(request_heatmap(file_name, color_string))
+            except ConnectionError:
+                raise
+            except Exception as e:
+                results.append(e)
+        return results
+
+    print(f"Attempting to connect to {HOST}:{REQUEST_PORT} for {len(requests)} heatmap requests...")
+
+    def exchange(s):
+        results = []
+        sent = 0
+        while len(results) < len(requests):
+            try:
+                while sent < len(requests) and sent - len(results) < PIPELINE_DEPTH:
+                    file_name, color_string = requests[sent]
+                    s.sendall(_heatmap_request(file_name, color_string))
+                    sent += 1
+                reply, filesize = _read_heatmap_header(s)
+                results.append(_heatmap_failed(reply) if filesize is None else _recv_exact(s, filesize))
+            except STALE_ERRORS as e:
+                if results:
+                    # The server has already rendered (and deleted) some of the files, so no retry
+                    raise ConnectionError(f"Connection lost after {len(results)} of {len(requests)} replies: {e}")
+                raise
+        return results
+
+    try:
+        results = _exchange(request_pool, exchange)
+    except socket.error as e:
+        raise ConnectionError(f"Could not connect or receive heatmaps from remote generator server: {e}")
+    print(f"Successfully received {len(results)} heatmap replies from {HOST}:{REQUEST_PORT}")
+    return results
+
+def stream_heatmap(file_name, color_string=""):
+    """
+    Like request_heatmap, but returns (filesize, chunks) as soon as the
+    server has accepted the request, where `chunks` yields the image data
+    as it arrives. Errors before the image starts are raised here; a short
+    read while iterating raises ConnectionError.
+    """
+    print(f"Attempting to connect to {HOST}:{REQUEST_PORT} for heatmap request...")
+
+    def exchange(s):
+        s.sendall(_heatmap_request(file_name, color_string))
+        return _read_heatmap_header(s)
+
+    # The connection stays checked out until the image has been read
+    s, reused = _acquire(request_pool)
+    try:
+        try:
+            reply, filesize = exchange(s)
+        except STALE_ERRORS:
+            if not reused:
+                raise
+            s.close()
+            s = request_pool.connect()
+            reply, filesize = exchange(s)
+    except socket.error as e:
         s.close()
+        raise ConnectionError(f"Could not connect or receive heatmap from remote generator server: {e}")
+    except BaseException:
+        s.close()
+        raise
+    if filesize is None:
+        _release(request_pool, s)
+        raise _heatmap_failed(reply)
+
+    def chunks():
+        complete = False
+        try:
+            remaining = filesize
+            while remaining > 0:
+                chunk = s.recv(min(DOWNLOAD_BUFFER_SIZE, remaining))
+                if not chunk:
+                    raise ConnectionError(f"Connection closed after {filesize - remaining} of the expected {filesize} bytes")
+                remaining -= len(chunk)
+                yield chunk
+            complete = True
+            print(f"Successfully streamed heatmap image data from {HOST}:{REQUEST_PORT}")
+        except socket.error as e:
+            raise ConnectionError(f"Could not receive heatmap from remote generator server: {e}")
+        finally:
+            # A partly read image leaves the connection out of step, so only a complete one is reused
+            if complete:
+                _release(request_pool, s)
+            else:
+                s.close()
+
+    return filesize, chunks()
 
-# No `if __name__ == "__main__":` block needed here, as it's meant to be imported.
\ No newline at end of file
+# No `if __name__ == "__main__":` block needed here, as it's meant to be imported.
@@ -0,0 +1,235 @@
+import asyncio
+import os
+
+# asyncio-streams version of client_socket.py for async_app.py: the same
+# protocol and remote servers, but waiting on the heatmap server never blocks
+# a thread, so one event loop can hold many uploads and renders in flight.
+import json
+from client_socket import HOST, UPLOAD_PORT, REQUEST_PORT, SEPARATOR, MESSAGE_SIZE, UPLOAD_BUFFER_SIZE, DOWNLOAD_BUFFER_SIZE, HeatmapServerBusy, HeatmapNotStored, HeatmapRequestInvalid, pad_string
+from client_socket import BINARY_FRAMING, FRAME_PREFIX, OP_UPLOAD, OP_HEATMAP, OP_UPLOAD_HEATMAP, OP_TILE_PYRAMID, OP_TILE, _digest, _frame, _parse_frame_prefix, _reply_text, _heatmap_failed
+
+async def _send_stream(writer, stream, file_size):
+    remaining = file_size
+    while remaining > 0:
+        chunk = stream.read(min(UPLOAD_BUFFER_SIZE, remaining))
+        if not chunk:
+            raise ValueError(f"Upload ended after {file_size - remaining} of the announced {file_size} bytes")
+        writer.write(chunk)
+        await writer.drain()
+        remaining -= len(chunk)
+
+async def _read_frame_reply(reader):
+    """
+    Reads a reply frame up to its body. Returns (status line, body size).
+    """
+    header_size, body_size = _parse_frame_prefix(await reader.readexactly(FRAME_PREFIX.size))
+    return _reply_text(await reader.readexactly(header_size)), body_size
+
+async def upload_csv(file_path):
+    """
+    Connects to the remote upload server and sends a CSV file.
+    file_path: The local path to the CSV file to be uploaded.
+    """
+    with open(file_path, "rb") as f:
+        await upload_stream(file_path, f, os.fstat(f.fileno()).st_size)
+
+async def upload_stream(file_name, stream, file_size, digest=None):
+    """
+    Sends `file_size` bytes read from a binary stream to the remote upload
+    server as `file_name`, without staging them in a file. Contents the
+    server already stores are not sent again if their sha256 hex `digest`
+    is given or the stream can be read twice.
+    """
+    print(f"Attempting to connect to {HOST}:{UPLOAD_PORT} for CSV upload...")
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(HOST, UPLOAD_PORT)
+
+        if BINARY_FRAMING and (digest is not None or stream.seekable()):
+            if digest is None:
+                # hashing a large upload takes a while, so it runs on a thread rather than the event loop
+                digest = await asyncio.to_thread(_digest, stream, file_size)
+            writer.write(_frame(OP_UPLOAD, {"name": os.path.basename(file_name), "sha256": digest}))
+            reply, _ = await _read_frame_reply(reader)
+            if reply.startswith("00"):
+                print(f"Remote server already stores the contents of {os.path.basename(file_name)}")
+                return
+            if not reply.startswith("01"):
+                raise ConnectionError(f"Upload rejected by remote server: {reply[3:]}")
+
+        # Send only the basename of the file, as the remote server expects this
+        if BINARY_FRAMING:
+            writer.write(_frame(OP_UPLOAD, {"name": os.path.basename(file_name)}, file_size))
+        else:
+            message = f"{os.path.basename(file_name)}{SEPARATOR}{file_size}"
+            writer.write(pad_string(message).encode())
+
+        await _send_stream(writer, stream, file_size)
+        if BINARY_FRAMING:
+            reply, _ = await _read_frame_reply(reader)
+            if not reply.startswith("00"):
+                raise ConnectionError(f"Upload rejected by remote server: {reply[3:]}")
+        print(f"Successfully uploaded {os.path.basename(file_name)} to {HOST}:{UPLOAD_PORT}")
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError(f"Remote heatmap upload server closed the connection early: {e}")
+    except OSError as e:
+        raise ConnectionError(f"Could not connect or send file to remote heatmap upload server: {e}")
+    finally:
+        if writer is not None:
+            await _close(writer)
+
+async def _open_heatmap_request(file_name, color_string, csv_stream=None, csv_size=0):
+    """
+    Connects to the remote request server and requests a heatmap, of an
+    uploaded file or (binary framing only) of the CSV read from `csv_stream`.
+    Returns the stream pair, positioned at the start of the image data, and the image size.
+    """
+    print(f"Attempting to connect to {HOST}:{REQUEST_PORT} for heatmap request...")
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(HOST, REQUEST_PORT)
+
+        if csv_stream is not None:
+            writer.write(_frame(OP_UPLOAD_HEATMAP, {"name": os.path.basename(file_name), "colors": color_string}, csv_size))
+            await _send_stream(writer, csv_stream, csv_size)
+        elif BINARY_FRAMING:
+            writer.write(_frame(OP_HEATMAP, {"name": file_name, "colors": color_string}))
+        else:
+            message = f"{file_name}{SEPARATOR}{color_string}"
+            writer.write(pad_string(message).encode())
+        await writer.drain()
+
+        if BINARY_FRAMING:
+            reply, filesize = await _read_frame_reply(reader)
+        else:
+            # Receive status reply (1024 bytes)
+            reply = (await reader.readexactly(MESSAGE_SIZE)).decode().strip()
+        if not reply.startswith("00"):
+            raise _heatmap_failed(reply)
+
+        if not BINARY_FRAMING:
+            # Receive image file info
+            received_metadata = (await reader.readexactly(MESSAGE_SIZE)).decode().strip()
+            filename_received, filesize_str = received_metadata.split(SEPARATOR)
+            filesize = int(filesize_str)
+        print(f"Receiving image, size: {filesize} bytes")
+        return reader, writer, filesize
+    except asyncio.IncompleteReadError as e:
+        if writer is not None:
+            await _close(writer)
+        raise ConnectionError(f"Remote heatmap generator server closed the connection early: {e}")
+    except OSError as e:
+        if writer is not None:
+            await _close(writer)
+        raise ConnectionError(f"Could not connect or receive heatmap from remote generator server: {e}")
+    except Exception:
+        if writer is not None:
+            await _close(writer)
+        raise
+
+async def _close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+async def request_heatmap(file_name, color_string=""):
+    """
+    Connects to the remote request server, requests a heatmap, and receives the image data.
+    file_name: The basename of the CSV file already uploaded to the remote server.
+    color_string: The color string for the heatmap (e.g., "#00FF00 #FFFF00 #FF0000").
+    Returns: Binary image data (bytes).
+    """
+    return await _receive_heatmap(*await _open_heatmap_request(file_name, color_string))
+
+async def upload_and_request_heatmap(file_name, stream, file_size, color_string=""):
+    """
+    Sends `file_size` bytes of CSV read from a binary stream to the remote
+    generator server and receives its heatmap over the same connection, in
+    one round trip (an upload, then a request, with HEATMAP_PROTOCOL=legacy).
+    Returns: Binary image data (bytes).
+    """
+    if not BINARY_FRAMING:
+        await upload_stream(file_name, stream, file_size)
+        return await request_heatmap(os.path.basename(file_name), color_string)
+    return await _receive_heatmap(*await _open_heatmap_request(file_name, color_string, stream, file_size))
+
+async def _receive_heatmap(reader, writer, filesize):
+    try:
+        image_data = await reader.readexactly(filesize)
+        print(f"Successfully received heatmap image data from {HOST}:{REQUEST_PORT}")
+        return image_data
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError(f"Connection closed after {len(e.partial)} of the expected {filesize} bytes")
+    except OSError as e:
+        raise ConnectionError(f"Could not connect or receive heatmap from remote generator server: {e}")
+    finally:
+        await _close(writer)
+
+async def stream_heatmap(file_name, color_string=""):
+    """
+    Like request_heatmap, but returns (filesize, chunks) as soon as the
+    server has accepted the request, where `chunks` is an async generator
+    of the image data as it arrives.
+    """
+    reader, writer, filesize = await _open_heatmap_request(file_name, color_string)
+
+    async def chunks():
+        try:
+            remaining = filesize
+            while remaining > 0:
+                chunk = await reader.read(min(DOWNLOAD_BUFFER_SIZE, remaining))
+                if not chunk:
+                    raise ConnectionError(f"Connection closed after {filesize - remaining} of the expected {filesize} bytes")
+                remaining -= len(chunk)
+                yield chunk
+            print(f"Successfully streamed heatmap image data from {HOST}:{REQUEST_PORT}")
+        finally:
+            await _close(writer)
+
+    return filesize, chunks()
+
+async def _tile_exchange(op, header, what):
+    """
+    Sends one tile request frame to the remote generator server and returns the body of its reply.
+    """
+    if not BINARY_FRAMING:
+        raise Exception("Heatmap tiles need binary framing, which HEATMAP_PROTOCOL=legacy turns off")
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(HOST, REQUEST_PORT)
+        writer.write(_frame(op, header))
+        await writer.drain()
+        reply, size = await _read_frame_reply(reader)
+        body = await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError(f"Remote heatmap generator server closed the connection early: {e}")
+    except OSError as e:
+        raise ConnectionError(f"Could not connect or receive {what} from remote generator server: {e}")
+    finally:
+        if writer is not None:
+            await _close(writer)
+    if not reply.startswith("00"):
+        raise _heatmap_failed(reply)
+    return body
+
+async def request_heatmap_tiles(file_name=None, digest=None):
+    """
+    Has the remote generator server build the tile pyramid of an uploaded
+    CSV (by its basename) or of contents it still stores (by their sha256
+    digest), unless it is already built. Returns its metadata (dict).
+    """
+    print(f"Attempting to connect to {HOST}:{REQUEST_PORT} for a tile pyramid...")
+    header = {"name": os.path.basename(file_name)} if file_name else {"sha256": digest}
+    meta = json.loads(await _tile_exchange(OP_TILE_PYRAMID, header, "a tile pyramid"))
+    print(f"Tile pyramid {meta['sha256']} has {meta['levels']} levels")
+    return meta
+
+async def request_heatmap_tile(digest, level, x, y, color_string=""):
+    """
+    Receives tile (x, y) (column, row) of zoom `level` of a built pyramid.
+    Returns: Binary PNG data (bytes).
+    """
+    header = {"sha256": digest, "level": level, "x": x, "y": y, "colors": color_string}
+    return await _tile_exchange(OP_TILE, header, "a heatmap tile")
@@ -0,0 +1,47 @@
+import time
+
+from flask import g, jsonify, request
+
+# Request deadlines shared by the gateway and the microservices. The caller
+# sends its remaining budget in milliseconds (a relative value, so the hosts'
+# clocks never need to agree); each hop turns it back into a local monotonic
+# deadline and passes on whatever is left when it calls further downstream.
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+
+def request_deadline(headers, default_budget=None):
+    """
+    Monotonic deadline for a request: now plus the budget in DEADLINE_HEADER,
+    capped by `default_budget` seconds. None if neither is given.
+    """
+    budget = default_budget
+    header = headers.get(DEADLINE_HEADER)
+    if header is not None:
+        try:
+            budget_ms = float(header)
+        except ValueError:
+            budget_ms = None
+        if budget_ms is not None:
+            budget = budget_ms / 1000 if budget is None else min(budget, budget_ms / 1000)
+    if budget is None:
+        return None
+    return time.monotonic() + budget
+
+def remaining(deadline):
+    """
+    Seconds left until a deadline, or None for no deadline.
+    """
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+def reject_expired():
+    """
+    before_request hook for the microservices: records the request's deadline
+    in g.deadline and answers 504 at once if the budget is already spent.
+    """
+    g.deadline = request_deadline(request.headers)
+    if expired(g.deadline):
+        return jsonify({'error': 'Request deadline exceeded before the service could start on it'}), 504
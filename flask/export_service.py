@@ -1,35 +1,93 @@
+import sys
+import os
 from flask import Flask, request, jsonify, make_response
 from flask_cors import CORS
 import csv
 import io
-import math # For handling potential division by zero in win rate
+import numpy as np
 
-app = Flask(__name__)
-CORS(app) # Enable CORS for all routes by default
-
-# Function to safely parse 'X -- Y' string
-def parse_score_string(score_str):
-    try:
-        parts = [p.strip() for p in str(score_str).split('--')]
-        if len(parts) == 2:
-            return float(parts[0]), float(parts[1])
-    except (ValueError, AttributeError):
-        pass # Not in 'X -- Y' format or not parseable
-    return None, None
+current_dir = os.path.dirname(os.path.abspath(__file__))
 
-@app.route('/export_ranking_data', methods=['POST'])
-def export_ranking_data():
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "Invalid JSON payload"}), 400
+microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservices'))
+sys.path.append(microservices_path)
 
-    table_data = data.get('table') # This is the 2D array of scores (just numbers)
-    ranking_scores = data.get('ranking') # The ranking scores from the ranking service
-    player_names = data.get('playerNames') # The list of player names (headers from frontend)
+from scores import wire
+from scores.scores import parse_table
+import deadlines
 
-    if not all([table_data, ranking_scores, player_names]):
-        return jsonify({"error": "Missing table, ranking, or playerNames data"}), 400
+app = Flask(__name__)
+CORS(app) # Enable CORS for all routes by default
+app.before_request(deadlines.reject_expired)
+
+def compute_player_stats(table_data, player_names):
+    """
+    Win rate and matches played for every player, from the 'X -- Y' table
+    (table_data[i] is the row of player_names[i]). Every cell against another
+    player that is a valid score (by the same rules the ranking service uses)
+    counts as one match: a win if X > Y, a loss if X < Y and a draw otherwise.
+    Win rate is (wins + 0.5 * draws) / matches, or 0.0 with no matches.
+    """
+    num_players = len(player_names)
+    names = np.empty(num_players, dtype=object)
+    for i, player_name in enumerate(player_names):
+        names[i] = player_name
+    self_play = names[:, None] == names[None, :]
+
+    # Rows that are not lists have no cells to count
+    rows = [row[:num_players] if isinstance(row, list) else [] for row in table_data[:num_players]]
+    rows += [[]] * (num_players - len(rows))
+    wins, losses, valid = parse_table(rows)
+    # parse_table is only as wide as the widest row; pad it out to the full table
+    missing = num_players - valid.shape[1]
+    if missing:
+        wins, losses, valid = (np.pad(a, ((0, 0), (0, missing))) for a in (wins, losses, valid))
+    played = valid & ~self_play
+
+    player_total_wins = (played & (wins > losses)).sum(axis=1)
+    player_total_draws = (played & (wins == losses)).sum(axis=1)
+    matches_played = played.sum(axis=1)
+    win_rates = np.divide(player_total_wins + 0.5 * player_total_draws, matches_played,
+                          out=np.zeros(num_players), where=matches_played > 0)
 
+    player_stats = {}
+    for i, player_name in enumerate(player_names):
+        player_stats[player_name] = {
+            'win_rate': float(win_rates[i]),
+            'matches_played': int(matches_played[i])
+        }
+    return player_stats
+
+def player_stats_lists(player_stats, player_names):
+    """
+    compute_player_stats' result as JSON-safe lists in player_names order:
+    {"win_rates": [...], "matches_played": [...]}.
+    """
+    return {
+        'win_rates': [player_stats[name]['win_rate'] for name in player_names],
+        'matches_played': [player_stats[name]['matches_played'] for name in player_names],
+    }
+
+def player_stats_from_lists(stats_lists, player_names):
+    """
+    The inverse of player_stats_lists. Raises ValueError unless both lists have one number per player.
+    """
+    if not isinstance(stats_lists, dict):
+        raise ValueError("playerStats must be an object")
+    win_rates = stats_lists.get('win_rates')
+    matches_played = stats_lists.get('matches_played')
+    if not isinstance(win_rates, list) or not isinstance(matches_played, list) \
+            or not len(win_rates) == len(matches_played) == len(player_names):
+        raise ValueError("playerStats needs 'win_rates' and 'matches_played' lists with one entry per player")
+    try:
+        return {name: {'win_rate': float(win_rate), 'matches_played': int(matches)}
+                for name, win_rate, matches in zip(player_names, win_rates, matches_played)}
+    except (TypeError, ValueError):
+        raise ValueError("playerStats entries must be numbers")
+
+def build_ranking_csv(player_stats, ranking_scores, player_names):
+    """
+    Writes the ranking export CSV: one row per player, best ranking score first.
+    """
     output = io.StringIO()
     writer = csv.writer(output)
 
@@ -37,95 +95,6 @@ def export_ranking_data():
     headers = ["Rank", "Player Name", "Ranking Score", "Win Rate", "Matches Played"]
     writer.writerow(headers)
 
-    # Prepare player data for calculation
-    # Create a map from player name to their index in table_data/ranking_scores
-    player_name_to_index = {name: i for i, name in enumerate(player_names)}
-
-    # Calculate Win Rate and Matches Played for each player
-    player_stats = {}
-    for i, player_name in enumerate(player_names):
-        total_wins = 0
-        total_losses = 0 # Using 'losses' for the reciprocal score
-        matches_played = 0
-
-        # Iterate through the row data for the current player
-        # Note: table_data contains only the scores, not the player names on the left.
-        # So table_data[i] is the row for player_names[i]
-        current_player_row_scores = table_data[i] 
-
-        for j, opponent_name in enumerate(player_names):
-            if player_name == opponent_name:
-                continue # Skip self-play cell
-
-            # Get the score of current_player vs opponent_name
-            score_current_vs_opponent_str = current_player_row_scores[j]
-            
-            # Parse 'X -- Y' format
-            player_score, opponent_score_against_player = parse_score_string(score_current_vs_opponent_str)
-            
-            if player_score is not None and opponent_score_against_player is not None:
-                # If both parts are numeric and represent a valid match
-                total_wins += player_score
-                total_losses += opponent_score_against_player # opponent's score against current player is current player's loss
-                matches_played += 1 # Count as one match
-
-        win_rate = 0.0
-        if matches_played > 0:
-            # Assuming 'total_wins' represents points won, and 'total_losses' represents points lost.
-            # Win rate could be total_wins / (total_wins + total_losses) if 1-0 or 0-1.
-            # If 'X -- Y' means X points scored by player, Y points scored by opponent in that matchup,
-            # then total_wins / (total_wins + total_losses) is a reasonable 'score rate'.
-            # If it's pure win/loss, it's total_wins / matches_played.
-            # Let's assume X is wins for player, Y is wins for opponent in the game.
-            # So, player_score is player's wins in that match, opponent_score_against_player is opponent's wins.
-            # Total matches played is simply the count of valid encounters.
-            # Total wins is sum of X's where player is current_player.
-            # Total losses is sum of Y's where player is current_player.
-            
-            # Recalculate based on total points or total wins.
-            # If X is wins and Y is losses, then win rate is total_X / matches_played.
-            # If X is points and Y is points, then win rate is total_X / (total_X + total_Y).
-            # Given "2 -- 3" format, it's more likely points or small scores.
-            # Let's use total_wins / matches_played for win rate, where a 'win' contributes 1.
-            # This is tricky without strict definition. Let's make a common assumption:
-            # For 'X -- Y', X is player's points/games won, Y is opponent's points/games won.
-            # A 'win' means X > Y. A 'loss' means X < Y. A 'draw' means X == Y.
-            
-            player_total_wins = 0
-            player_total_draws = 0
-            player_total_losses = 0
-            
-            for j, opponent_name in enumerate(player_names):
-                if player_name == opponent_name:
-                    continue
-                
-                score_str = current_player_row_scores[j]
-                p_score, o_score = parse_score_string(score_str)
-                
-                if p_score is not None and o_score is not None:
-                    if p_score > o_score:
-                        player_total_wins += 1
-                    elif p_score < o_score:
-                        player_total_losses += 1
-                    else: # p_score == o_score
-                        player_total_draws += 1
-            
-            # Recalculate matches_played based on actual games recorded
-            actual_matches_played = player_total_wins + player_total_losses + player_total_draws
-
-            if actual_matches_played > 0:
-                # Common formula for win rate (wins + 0.5*draws) / total_games
-                win_rate = (player_total_wins + 0.5 * player_total_draws) / actual_matches_played
-            else:
-                win_rate = 0.0 # No matches played
-
-            matches_played = actual_matches_played # Update matches_played
-
-        player_stats[player_name] = {
-            'win_rate': win_rate,
-            'matches_played': matches_played
-        }
-
     # Combine ranking data with calculated stats and write to CSV
     # The ranking_scores list is already sorted by the ranking service.
     # We need to correctly map the ranking_scores to player names.
@@ -158,7 +127,66 @@ def export_ranking_data():
             player_info['matches_played']
         ])
 
-    csv_data = output.getvalue()
+    return output.getvalue()
+
+def read_table_payload():
+    """
+    The table and the rest of a JSON or binary request body, as (table_data, data).
+    Raises ValueError for a body that cannot be read.
+    """
+    if request.mimetype == wire.CONTENT_TYPE:
+        # Binary body: the cells are rebuilt exactly as sent, the rest is in its meta
+        wins, losses, _, data = wire.decode(request.get_data())
+        return wire.decode_table(wins, losses, data), data
+    data = request.get_json()
+    if not data:
+        raise ValueError("Invalid JSON payload")
+    return data.get('table'), data # The 2D array of scores (just numbers)
+
+@app.route('/player_stats', methods=['POST'])
+def player_stats_endpoint():
+    """
+    Win rate and matches played of every player, in playerNames order (see
+    player_stats_lists), for a caller that exports before its ranking is
+    ready: /export_ranking_data then takes them as "playerStats" instead of
+    the table.
+    """
+    try:
+        table_data, data = read_table_payload()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    player_names = data.get('playerNames')
+    if not all([table_data, player_names]):
+        return jsonify({"error": "Missing table or playerNames data"}), 400
+
+    return jsonify(player_stats_lists(compute_player_stats(table_data, player_names), player_names)), 200
+
+@app.route('/export_ranking_data', methods=['POST'])
+def export_ranking_data():
+    try:
+        table_data, data = read_table_payload()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    ranking_scores = data.get('ranking') # The ranking scores from the ranking service
+    player_names = data.get('playerNames') # The list of player names (headers from frontend)
+    stats_lists = data.get('playerStats') # From /player_stats, in place of the table
+
+    if stats_lists is not None and ranking_scores and player_names:
+        try:
+            player_stats = player_stats_from_lists(stats_lists, player_names)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    elif not all([table_data, ranking_scores, player_names]):
+        return jsonify({"error": "Missing table, ranking, or playerNames data"}), 400
+    else:
+        # Calculate Win Rate and Matches Played for each player
+        # Note: table_data contains only the scores, not the player names on the left.
+        # So table_data[i] is the row for player_names[i]
+        player_stats = compute_player_stats(table_data, player_names)
+
+    csv_data = build_ranking_csv(player_stats, ranking_scores, player_names)
     
     response = make_response(csv_data)
     response.headers["Content-Disposition"] = "attachment; filename=league_ranking_data.csv"
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservices'))
+sys.path.append(microservices_path)
+
+from caching.byte_cache import ByteCache
+
+# Content-addressed cache of /rank responses. Keys are sha256 digests of the
+# normalized score matrices (or edge list) together with the algorithm and
+# every option that affects the result, so the same table sent again, in
+# either wire format or with different cell spacing, is answered without
+# re-running the solver. Values are the serialized JSON response bodies,
+# kept least-recently-used in memory up to MAX_CACHE_BYTES. If RANK_CACHE_DIR
+# is set, entries are also written there as one file per key, which survives
+# restarts and is trimmed oldest-first to MAX_DISK_BYTES. The digest of a
+# raw request body maps to the key of its result, so a byte-identical repeat
+# is answered before parsing without storing the body twice.
+MAX_CACHE_BYTES = int(os.environ.get('RANK_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_DIR = os.environ.get('RANK_CACHE_DIR') or None
+MAX_DISK_BYTES = int(os.environ.get('RANK_CACHE_MAX_DISK_BYTES', 1024 * 1024 * 1024))
+
+_cache = ByteCache(MAX_CACHE_BYTES, CACHE_DIR, MAX_DISK_BYTES, suffix='.json')
+# Request digest -> result key, 64 bytes an entry
+_request_keys = ByteCache(MAX_CACHE_BYTES // 64)
+
+def make_key(*parts):
+    """
+    Digest of arrays (by dtype, shape and contents), bytes and JSON-serializable values.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(f'array:{part.dtype.str}:{part.shape};'.encode())
+            digest.update(part.data)
+        elif isinstance(part, bytes):
+            digest.update(f'bytes:{len(part)};'.encode())
+            digest.update(part)
+        else:
+            digest.update(json.dumps(part, sort_keys=True).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+def get(key):
+    """
+    Returns the cached response body for a key, or None on a miss.
+    """
+    return _cache.get(key)
+
+def get_request(request_key):
+    """
+    Returns the cached response body for a raw request key, or None. Only a
+    hit is counted: on a miss the caller goes on to look the result up by
+    its own key, which counts the request then.
+    """
+    result_key = _request_keys.get(request_key)
+    if result_key is None:
+        return None
+    return _cache.get(result_key.decode(), count_miss=False)
+
+def put_request(request_key, key):
+    """
+    Remembers that the raw request under request_key has its result under key.
+    """
+    _request_keys.put(request_key, key.encode())
+
+def put(key, body):
+    """
+    Caches a serialized response body under a key, in memory and on disk.
+    """
+    _cache.put(key, body)
+
+def stats():
+    """
+    Hit/miss counters and the current size of each tier.
+    """
+    return _cache.stats()
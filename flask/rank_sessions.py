@@ -0,0 +1,51 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+# Server-side state for warm-start re-ranking. A handle keeps the parsed
+# wins/losses matrices, the update operator and the last result of each
+# algorithm, so an edit can send only the changed cells and resume from the
+# previous fixed point. Sessions are evicted least-recently-used once their
+# arrays exceed MAX_SESSION_BYTES in total.
+MAX_SESSION_BYTES = int(os.environ.get('RANKING_MAX_SESSION_BYTES', 512 * 1024 * 1024))
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+_total_bytes = 0
+
+def _session_bytes(session):
+    return session['wins'].nbytes + session['losses'].nbytes + session['operator'].nbytes
+
+def create_session(wins, losses, operator):
+    """
+    Stores freshly parsed matrices and returns (handle, session).
+    The caller should hold session['lock'] while mutating or ranking it.
+    """
+    global _total_bytes
+    handle = uuid.uuid4().hex
+    session = {
+        'wins': wins,
+        'losses': losses,
+        'operator': operator,
+        'states': {}, # algorithm -> last ranking (raw Elo ratings for 'elo')
+        'lock': threading.Lock(),
+    }
+    with _sessions_lock:
+        _sessions[handle] = session
+        _total_bytes += _session_bytes(session)
+        # Evict the least recently used sessions, but never the one just created
+        while _total_bytes > MAX_SESSION_BYTES and len(_sessions) > 1:
+            _, evicted = _sessions.popitem(last=False)
+            _total_bytes -= _session_bytes(evicted)
+    return handle, session
+
+def get_session(handle):
+    """
+    Returns the session for a handle, or None if it is unknown or was evicted.
+    """
+    with _sessions_lock:
+        session = _sessions.get(handle)
+        if session is not None:
+            _sessions.move_to_end(handle)
+    return session
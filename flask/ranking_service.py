@@ -1,7 +1,9 @@
 import sys
 import os
+import json
+import numpy as np
 from flask_cors import CORS
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -9,10 +11,322 @@ microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservi
 sys.path.append(microservices_path)
 
 from algorithm.algorithm import rank as compute_rank_default
-from algorithm.elo import rank as compute_rank_elo
+from algorithm.elo import rank as compute_rank_elo, normalize_elos
+from algorithm import batch_elo, bradley_terry, solvers, sparse, vectorized
+from algorithm.online_elo import RatingStore
+from scores import wire
+import rank_sessions
+import rank_cache
+import deadlines
+
+# 'numpy' runs the array-backed engine, 'python' the original pure-Python loops
+DEFAULT_ENGINE = os.environ.get('RANKING_ENGINE', 'numpy')
+
+ALGORITHMS = ('default', 'elo', 'bradley_terry')
+
+# 'sequential' replays every game like elo.rank_elo, 'aggregated' runs batch_elo sweeps
+ELO_MODES = ('sequential', 'aggregated')
+DEFAULT_ELO_MODE = os.environ.get('RANKING_ELO_MODE', 'sequential')
+
+# Upper bound on the "max_iters" a caller may request
+MAX_ITERS_LIMIT = 10000
+
+# Upper bound on the "players" of a sparse "edges" request, which sizes its arrays
+MAX_EDGE_PLAYERS = int(os.environ.get('RANKING_MAX_EDGE_PLAYERS', 100000))
+
+# SQLite file holding the online Elo ratings and match event log
+RATING_DB_PATH = os.environ.get('RATING_DB_PATH', os.path.join(current_dir, 'ratings.db'))
+# bytes read per step when streaming an NDJSON match backfill
+NDJSON_CHUNK_SIZE = 1 << 20
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for this service, though app.py (server-side) calls it
+app.before_request(deadlines.reject_expired)
+
+rating_store = RatingStore(RATING_DB_PATH)
+
+def parse_solver_options(data):
+    """
+    Reads the optional "solver", "elo_mode", "max_iters" and "tolerance" fields
+    of a /rank request, raising ValueError for values the solvers cannot use.
+    """
+    solver = data.get('solver', 'fixed_point')
+    elo_mode = data.get('elo_mode', DEFAULT_ELO_MODE)
+    max_iters = data.get('max_iters', 100)
+    tolerance = data.get('tolerance', 0.001)
+    if solver not in solvers.SOLVERS:
+        raise ValueError(f'Invalid solver specified. Choose one of: {", ".join(solvers.SOLVERS)}.')
+    if elo_mode not in ELO_MODES:
+        raise ValueError(f'Invalid elo_mode specified. Choose one of: {", ".join(ELO_MODES)}.')
+    if not isinstance(max_iters, int) or isinstance(max_iters, bool) or not 1 <= max_iters <= MAX_ITERS_LIMIT:
+        raise ValueError(f'"max_iters" must be an integer between 1 and {MAX_ITERS_LIMIT}.')
+    if not isinstance(tolerance, (int, float)) or isinstance(tolerance, bool) or tolerance <= 0:
+        raise ValueError('"tolerance" must be a positive number.')
+    return {'solver': solver, 'elo_mode': elo_mode, 'max_iters': max_iters, 'tolerance': float(tolerance)}
+
+def parse_previous(previous, num_players):
+    """
+    Checks the optional "previous" scores of a /rank request, which the default
+    algorithm starts from: a flat list of one finite number per player.
+    Raises ValueError otherwise.
+    """
+    if previous is None:
+        return None
+    if not isinstance(previous, list) or len(previous) != num_players or \
+            not all(isinstance(score, (int, float)) and not isinstance(score, bool) for score in previous):
+        raise ValueError(f'"previous" must be a list of {num_players} numbers, one per player.')
+    try:
+        finite = np.isfinite(np.array(previous, dtype=np.float64)).all()
+    except OverflowError:
+        finite = False
+    if not finite:
+        raise ValueError('"previous" scores must be finite numbers.')
+    return previous
+
+def run_elo(edge_list, options, initial_elos=None):
+    """
+    Runs the Elo variant selected by options['elo_mode'], returning raw ratings and convergence info.
+    """
+    if options['elo_mode'] == 'aggregated':
+        return batch_elo.run_batch_elo(edge_list, options['max_iters'], options['tolerance'], initial_elos)
+    return sparse.run_elo(edge_list, options['max_iters'], options['tolerance'], initial_elos)
+
+def to_json(result):
+    return json.dumps(result, separators=(',', ':')).encode('utf-8')
+
+def rank_with_session(data, matrices, handle, algorithm_type, options):
+    """
+    Warm-start ranking against server-side state. Either stores the parsed
+    (wins, losses) `matrices` as a new session, or resumes the session named by
+    `handle` after applying the changed cells in `delta` ([[row, col, "X -- Y"], ...]).
+
+    Returns:
+        tuple: (result dict, HTTP status)
+    """
+    if handle:
+        session = rank_sessions.get_session(handle)
+        if session is None:
+            return {'error': 'Unknown or expired ranking handle. Resend the full "table".'}, 404
+    else:
+        wins, losses = vectorized.mask_diagonal(*matrices)
+        handle, session = rank_sessions.create_session(wins, losses, vectorized.build_operator(wins, losses))
+
+    with session['lock']:
+        try:
+            vectorized.set_cells(session['wins'], session['losses'], session['operator'], data.get('delta') or [])
+        except (ValueError, TypeError) as e:
+            return {'error': f'Invalid "delta" data: {e}'}, 400
+
+        # Resume from this session's previous fixed point for the algorithm, if any
+        state_key = f"elo_{options['elo_mode']}" if algorithm_type == 'elo' else algorithm_type
+        previous = session['states'].get(state_key)
+        if algorithm_type == 'elo':
+            edge_list = sparse.from_matrices(session['wins'], session['losses'])
+            state, info = run_elo(edge_list, options, initial_elos=previous)
+            ranks = normalize_elos(state)
+        elif algorithm_type == 'bradley_terry':
+            edge_list = sparse.from_matrices(session['wins'], session['losses'])
+            state, info = bradley_terry.fit(edge_list, options['max_iters'], options['tolerance'], initial=previous)
+            ranks = vectorized.normalize(np.asarray(state)).tolist()
+        else:
+            if previous is None:
+                try:
+                    previous = parse_previous(data.get('previous') or None, len(session['wins']))
+                except ValueError as e:
+                    return {'error': str(e)}, 400
+            if previous is None:
+                previous = vectorized.init_ranking(session['wins'], session['losses'])
+            prev_ranks = vectorized.normalize(np.asarray(previous, dtype=float))
+            state, info = vectorized.iterate(session['operator'], prev_ranks, options['max_iters'],
+                                             tolerance=options['tolerance'], solver=options['solver'])
+            state = state.tolist()
+            ranks = state
+        session['states'][state_key] = state
+
+    return {'ranking': ranks, 'convergence': info, 'handle': handle}, 200
+
+def result_settings(algorithm_type, options, previous, legacy):
+    """
+    The request fields a ranking depends on, as part of its rank_cache key.
+    Options an algorithm ignores are left out so they do not split the cache.
+    """
+    if algorithm_type == 'elo':
+        return [algorithm_type, options['elo_mode'], options['max_iters'], options['tolerance'], legacy]
+    if algorithm_type == 'bradley_terry':
+        return [algorithm_type, options['max_iters'], options['tolerance']]
+    return [algorithm_type, options['solver'], options['max_iters'], options['tolerance'], previous, legacy]
+
+def run_ranking(job):
+    """
+    Runs the solver for a job prepared by rank_payload. It touches neither
+    Flask nor this process's cache and sessions, so it can run in a worker
+    process.
+
+    Returns:
+        dict: 'ranking', plus 'convergence' except on the pure-Python engine.
+    """
+    algorithm_type, options, previous = job['algorithm'], job['options'], job['previous']
+    if job['legacy']:
+        # Original pure-Python implementations, which do not report convergence
+        if algorithm_type == 'elo':
+            ranks = compute_rank_elo(job['table'], options['max_iters'], options['tolerance'])
+        else:
+            ranks = compute_rank_default(job['table'], options['max_iters'], tolerance=options['tolerance'])
+        return {'ranking': ranks}
+
+    edge_list = job['edge_list']
+    if edge_list is not None:
+        # Undo compact_job's narrowing; a no-op for arrays that are already int64
+        edge_list = sparse.EdgeList(edge_list.num_players,
+                                    *(np.asarray(values, dtype=np.int64) for values in edge_list[1:]))
+    if algorithm_type == 'elo':
+        elos, info = run_elo(edge_list, options)
+        ranks = normalize_elos(elos)
+    elif algorithm_type == 'bradley_terry':
+        log_strengths, info = bradley_terry.fit(edge_list, options['max_iters'], options['tolerance'])
+        ranks = vectorized.normalize(np.asarray(log_strengths)).tolist() if log_strengths else []
+    elif edge_list is not None:
+        ranks, info = sparse.solve_default(edge_list, options['max_iters'], tolerance=options['tolerance'],
+                                           initial=previous, solver=options['solver'])
+    else:
+        ranks, info = vectorized.solve_matrices(job['wins'], job['losses'], options['max_iters'],
+                                                tolerance=options['tolerance'], initial=previous,
+                                                solver=options['solver'])
+    return {'ranking': ranks, 'convergence': info}
+
+def _narrow(values):
+    values = np.asarray(values)
+    if values.size and values.min() < 0:
+        return values
+    return values.astype(np.min_scalar_type(int(values.max(initial=0))), copy=False)
+
+def compact_job(job):
+    """
+    A run_ranking job with its score matrices and edge arrays in the narrowest
+    unsigned integer types that hold them, for handing to a worker process:
+    a 3,000-player table's two int64 matrices pickle to 144 MB, or 18 MB as
+    uint8. run_ranking widens them back to int64.
+    """
+    job = dict(job)
+    if job['wins'] is not None:
+        job['wins'], job['losses'] = _narrow(job['wins']), _narrow(job['losses'])
+    edge_list = job['edge_list']
+    if edge_list is not None:
+        job['edge_list'] = sparse.EdgeList(edge_list.num_players, *(_narrow(values) for values in edge_list[1:]))
+    return job
+
+DEADLINE_ERROR = 'Request deadline exceeded before ranking could start'
+
+def rank_payload(data, matrices=None, request_key=None, run=run_ranking, deadline=None):
+    """
+    Handles one /rank request body: validation, sessions, the result cache and
+    the solve itself, which is delegated to `run(job)` so a caller can move it
+    onto a worker pool. `matrices` holds the (wins, losses) of a table that
+    arrived already parsed; `request_key` is the rank_cache key of the raw
+    request, which is pointed at the cached result. Once `deadline` (a time.monotonic()
+    value) has passed, no solve is started and 504 is returned instead.
+
+    Returns:
+        tuple: (HTTP status, JSON body bytes, 'hit' or 'miss' for cacheable requests else None)
+    """
+    table = data.get('table') if matrices is None else None
+    edges = data.get('edges')
+    handle = data.get('handle')
+    previous = data.get('previous') # Scores from an earlier /rank call to warm-start from
+    algorithm_type = data.get('algorithm', 'default') # Default to existing algorithm if not specified
+    engine = data.get('engine', DEFAULT_ENGINE)
+
+    if not table and matrices is None and edges is None and not handle:
+        return 400, to_json({'error': 'Missing "table", "edges" or "handle" data'}), None
+
+    if handle is not None and not isinstance(handle, str):
+        return 400, to_json({'error': '"handle" must be the string returned by an earlier session request'}), None
+
+    if engine not in ('numpy', 'python'):
+        return 400, to_json({'error': 'Invalid engine specified. Choose "numpy" or "python".'}), None
+
+    if algorithm_type not in ALGORITHMS:
+        return 400, to_json({'error': 'Invalid algorithm type specified. Choose "default", "elo" or "bradley_terry".'}), None
+
+    # "solver" applies to the default algorithm, "elo_mode" to elo
+    try:
+        options = parse_solver_options(data)
+    except ValueError as e:
+        return 400, to_json({'error': str(e)}), None
+
+    # Incremental mode: keep the parsed table server-side and return a handle
+    if handle or ((table or matrices is not None) and data.get('session')):
+        if deadlines.expired(deadline):
+            return 504, to_json({'error': DEADLINE_ERROR}), None
+        if not handle and matrices is None:
+            matrices = vectorized.parse(table)
+        result, status = rank_with_session(data, matrices, handle, algorithm_type, options)
+        return status, to_json(result), None
+
+    legacy = bool(table and engine == 'python' and algorithm_type != 'bradley_terry'
+                  and not previous and options['elo_mode'] == 'sequential')
+    wins = losses = None
+    if matrices is not None:
+        # Already parsed, so the pure-Python engine (which reads strings) does not apply
+        edge_list = None
+        wins, losses = matrices
+        legacy = False
+    elif not table:
+        # Sparse payload: {"players": n or [names], "edges": [[i, j, wins, losses], ...]}
+        players = data.get('players')
+        num_players = len(players) if isinstance(players, list) else players
+        if not isinstance(num_players, int) or isinstance(num_players, bool):
+            return 400, to_json({'error': 'Sparse "edges" payload requires "players" (a count or a list of names)'}), None
+        if not 0 <= num_players <= MAX_EDGE_PLAYERS:
+            return 400, to_json({'error': f'"players" must be between 0 and {MAX_EDGE_PLAYERS}.'}), None
+        try:
+            edge_list = sparse.from_edges(num_players, edges, mirror=bool(data.get('mirror', False)))
+        except (ValueError, TypeError, OverflowError) as e:
+            return 400, to_json({'error': f'Invalid "edges" data: {e}'}), None
+    else:
+        edge_list = None
+        wins, losses = vectorized.parse(table)
+
+    if algorithm_type == 'default' and not legacy:
+        try:
+            previous = parse_previous(previous, edge_list.num_players if edge_list is not None else len(wins))
+        except ValueError as e:
+            return 400, to_json({'error': str(e)}), None
+
+    # Same scores, same settings, same result: key on the parsed content,
+    # so formatting differences and the wire format do not matter
+    settings = result_settings(algorithm_type, options, previous, legacy)
+    if edge_list is not None:
+        result_key = rank_cache.make_key('edges', edge_list.num_players, edge_list.rows, edge_list.cols,
+                                         edge_list.wins, edge_list.losses, settings)
+    else:
+        # Self-play cells never affect a ranking
+        np.fill_diagonal(wins, 0)
+        np.fill_diagonal(losses, 0)
+        result_key = rank_cache.make_key('dense', wins, losses, settings)
+    # Parsing may have used up the caller's budget; nobody would wait for the result,
+    # cached or not
+    if deadlines.expired(deadline):
+        return 504, to_json({'error': DEADLINE_ERROR}), None
+
+    body = rank_cache.get(result_key)
+    if body is not None:
+        if request_key is not None:
+            rank_cache.put_request(request_key, result_key)
+        return 200, body, 'hit'
+
+    job = {'algorithm': algorithm_type, 'options': options, 'previous': previous, 'legacy': legacy,
+           'table': table if legacy else None, 'edge_list': edge_list, 'wins': None, 'losses': None}
+    if not legacy and algorithm_type in ('elo', 'bradley_terry') and edge_list is None:
+        job['edge_list'] = sparse.from_matrices(wins, losses)
+    elif not legacy and edge_list is None:
+        job['wins'], job['losses'] = wins, losses
+
+    body = to_json(run(job))
+    rank_cache.put(result_key, body)
+    if request_key is not None:
+        rank_cache.put_request(request_key, result_key)
+    return 200, body, 'miss'
 
 @app.route('/rank', methods=['POST', 'OPTIONS'])
 def rank_endpoint():
@@ -21,26 +335,83 @@ def rank_endpoint():
         return '', 200
 
     try:
-        data = request.get_json()
-        table = data.get('table')
-        algorithm_type = data.get('algorithm', 'default') # Default to existing algorithm if not specified
-
-        if not table:
-            return jsonify({'error': 'Missing "table" data'}), 400
+        # Byte-identical repeat requests are answered before any parsing
+        request_key = rank_cache.make_key('request', request.mimetype, request.get_data())
+        body = rank_cache.get_request(request_key)
+        if body is not None:
+            return app.response_class(body, mimetype='application/json', headers={'X-Rank-Cache': 'hit'})
 
-        if algorithm_type == 'elo':
-            ranks = compute_rank_elo(table)
-        elif algorithm_type == 'default':
-            ranks = compute_rank_default(table)
+        if request.mimetype == wire.CONTENT_TYPE:
+            # Binary body: the table arrives already parsed, every other field is in its meta
+            try:
+                wins, losses, _, data = wire.decode(request.get_data())
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            matrices = vectorized.square(wins, losses, wins.shape[0])
         else:
-            return jsonify({'error': 'Invalid algorithm type specified. Choose "default" or "elo".'}), 400
+            data = request.get_json()
+            matrices = None
 
-        return jsonify({'ranking': ranks})
+        status, body, cache_state = rank_payload(data, matrices, request_key, deadline=g.deadline)
+        headers = {'X-Rank-Cache': cache_state} if cache_state else {}
+        return app.response_class(body, status=status, mimetype='application/json', headers=headers)
     except Exception as e:
         # It's good practice to log the full traceback for debugging
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def read_match_events():
+    """
+    Yields the match events of a /matches request. An application/x-ndjson
+    body (one event per line) is streamed, so a historical backfill is never
+    held in memory; a JSON body is either one event or {"events": [...]}.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        # Read large chunks and split lines ourselves; per-line stream reads are slow
+        remainder = b''
+        while True:
+            chunk = request.stream.read(NDJSON_CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if remainder.strip():
+            yield json.loads(remainder)
+        return
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError('Invalid JSON payload')
+    if 'events' in data:
+        if not isinstance(data['events'], list):
+            raise ValueError('"events" must be a list')
+        yield from data['events']
+    else:
+        yield data
+
+@app.route('/rank/cache', methods=['GET'])
+def rank_cache_stats_endpoint():
+    return jsonify(rank_cache.stats()), 200
+
+@app.route('/leagues/<league>/matches', methods=['POST'])
+def record_matches_endpoint(league):
+    try:
+        count = rating_store.record(league, read_match_events())
+    except ValueError as e:
+        return jsonify({'error': f'Invalid match events: {e}'}), 400
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'recorded': count}), 200
+
+@app.route('/leagues/<league>/ratings', methods=['GET'])
+def league_ratings_endpoint(league):
+    return jsonify(rating_store.ratings(league)), 200
+
 if __name__ == '__main__':
     app.run(port=5050) # use 5050 for the ranking microservice
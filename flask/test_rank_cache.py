@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservices'))
+sys.path.append(microservices_path)
+
+from caching.byte_cache import ByteCache
+import rank_cache
+import ranking_service
+
+@pytest.fixture
+def client():
+    return ranking_service.app.test_client()
+
+def counts():
+    stats = rank_cache.stats()
+    return stats['hits'], stats['misses'], stats['entries']
+
+def post(client, json):
+    response = client.post('/rank', json=json)
+    assert response.status_code == 200
+    return response.headers.get('X-Rank-Cache')
+
+def test_each_request_is_counted_once(client):
+    table = [['X', '4 -- 1'], ['1 -- 4', 'X']]
+    hits, misses, entries = counts()
+
+    assert post(client, {'table': table, 'tolerance': 0.0005}) == 'miss'
+    assert counts() == (hits, misses + 1, entries + 1)
+
+    # Byte-identical repeat, answered before parsing
+    assert post(client, {'table': table, 'tolerance': 0.0005}) == 'hit'
+    assert counts() == (hits + 1, misses + 1, entries + 1)
+
+    # Same scores written differently, answered by the result key
+    assert post(client, {'table': [['X', '4--1'], ['1 - 4', 'X']], 'tolerance': 0.0005}) == 'hit'
+    assert counts() == (hits + 2, misses + 1, entries + 1)
+
+def test_different_settings_miss(client):
+    table = [['X', '2 -- 3'], ['3 -- 2', 'X']]
+    post(client, {'table': table, 'algorithm': 'elo'})
+    hits, misses, entries = counts()
+    assert post(client, {'table': table, 'algorithm': 'bradley_terry'}) == 'miss'
+    assert counts() == (hits, misses + 1, entries + 1)
+
+def test_byte_cache_counts_and_evicts():
+    cache = ByteCache(10)
+    assert cache.get('a') is None
+    cache.put('a', b'12345')
+    cache.put('b', b'67890')
+    assert cache.get('a') == b'12345'
+    # 'b' is now the least recently used, so it makes room for 'c'
+    cache.put('c', b'abcde')
+    assert cache.get('b') is None
+    assert cache.get('c', count_miss=False) == b'abcde'
+    assert cache.get('d', count_miss=False) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 2, 1)
+    assert (stats['entries'], stats['bytes']) == (2, 10)
+
+def test_byte_cache_disk_tier(tmp_path):
+    cache = ByteCache(100, str(tmp_path), max_disk_bytes=100)
+    cache.put('a', b'value')
+    reopened = ByteCache(100, str(tmp_path), max_disk_bytes=100)
+    assert reopened.get('a') == b'value'
+    assert reopened.stats()['disk_hits'] == 1
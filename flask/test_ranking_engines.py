@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservices'))
+sys.path.append(microservices_path)
+
+from algorithm import algorithm, elo, sparse, vectorized
+
+# The NumPy, sparse and pure-Python engines should rank any table the same,
+# malformed and self-play cells included
+
+def random_table(num_players, seed, played=1.0):
+    rng = np.random.default_rng(seed)
+    table = [['X'] * num_players for _ in range(num_players)]
+    for i in range(num_players):
+        for j in range(i + 1, num_players):
+            if rng.random() >= played:
+                table[i][j] = table[j][i] = ''
+                continue
+            wins, losses = rng.integers(0, 10, size=2).tolist()
+            table[i][j] = f'{wins} -- {losses}'
+            table[j][i] = f'{losses}-{wins}'
+    return table
+
+TABLES = [
+    random_table(2, 0),
+    random_table(12, 1),
+    random_table(40, 2, played=0.2),
+    [['X', '3 -- 1', 'oops'], ['1 -- 3', 'X', '2 -- 2'], ['', '2 -- 2', '-']],
+]
+
+@pytest.mark.parametrize('table', TABLES)
+def test_numpy_engine_matches_algorithm_rank(table):
+    expected = algorithm.rank(table)
+    assert np.allclose(vectorized.rank(table), expected, atol=1e-9)
+
+@pytest.mark.parametrize('table', TABLES)
+def test_sparse_engine_matches_algorithm_rank(table):
+    expected = algorithm.rank(table)
+    assert np.allclose(sparse.rank_default(sparse.from_table(table)), expected, atol=1e-9)
+
+@pytest.mark.parametrize('table', TABLES)
+def test_sparse_elo_matches_elo_rank(table):
+    expected = elo.rank(table)
+    assert np.allclose(sparse.rank_elo(sparse.from_table(table)), expected, atol=1e-9)
+
+def test_anderson_solver_finds_a_fixed_point():
+    table = random_table(30, 3)
+    wins, losses = vectorized.mask_diagonal(*vectorized.parse(table))
+    ranks, info = vectorized.solve_matrices(wins, losses, max_iters=1000, tolerance=1e-10, solver='anderson')
+    assert info['converged']
+    operator = vectorized.build_operator(wins, losses)
+    assert np.allclose(vectorized.update(operator, np.asarray(ranks)), ranks, atol=1e-9)
+
+def test_empty_table():
+    assert vectorized.rank([]) == []
+    assert sparse.rank_default(sparse.from_table([])) == []
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import rank_sessions
+import ranking_service
+
+TABLE = [
+    ['X', '3 -- 1', '2 -- 2'],
+    ['1 -- 3', 'X', '0 -- 5'],
+    ['2 -- 2', '5 -- 0', 'X'],
+]
+
+@pytest.fixture
+def client():
+    return ranking_service.app.test_client()
+
+def start_session(client):
+    response = client.post('/rank', json={'table': TABLE, 'session': True})
+    assert response.status_code == 200
+    return response.get_json()
+
+def session_state(handle):
+    session = rank_sessions.get_session(handle)
+    return session['wins'].copy(), session['losses'].copy(), session['operator'].copy()
+
+@pytest.mark.parametrize('delta', [
+    [[0, 1, '9 -- 0'], [5, 0, '1 -- 1']],
+    [[0, 1, '9 -- 0'], [1, 0, 'not a score']],
+    [[0, 1, '9 -- 0'], [1.0, 0, '0 -- 9']],
+    [[0, 1, '9 -- 0'], [True, 0, '0 -- 9']],
+    [[0, 1, '9 -- 0'], [1, 0]],
+    [[0, 1, '9 -- 0'], 'not a list'],
+])
+def test_invalid_delta_leaves_session_unchanged(client, delta):
+    started = start_session(client)
+    before = session_state(started['handle'])
+
+    response = client.post('/rank', json={'handle': started['handle'], 'delta': delta})
+    assert response.status_code == 400
+    for old, new in zip(before, session_state(started['handle'])):
+        assert np.array_equal(old, new)
+
+    # The session still ranks the original table
+    response = client.post('/rank', json={'handle': started['handle']})
+    assert response.status_code == 200
+    assert np.allclose(response.get_json()['ranking'], started['ranking'], atol=1e-3)
+
+def test_valid_delta_is_applied(client):
+    started = start_session(client)
+    response = client.post('/rank', json={'handle': started['handle'], 'delta': [[0, 1, '9 -- 0'], [1, 0, '0 -- 9']]})
+    assert response.status_code == 200
+    wins, losses, _ = session_state(started['handle'])
+    assert (wins[0, 1], losses[0, 1], wins[1, 0], losses[1, 0]) == (9, 0, 0, 9)
+
+def test_handle_must_be_a_string(client):
+    response = client.post('/rank', json={'handle': ['x']})
+    assert response.status_code == 400
@@ -0,0 +1,73 @@
+import pytest
+
+import export_service
+import validation_service
+
+# The validator and the export service read cells by the shared parser's
+# rules, the same ones the ranking service uses
+
+HEADERS = ['A', 'B']
+
+def rows(a_vs_b, b_vs_a):
+    return [{'name': 'A', 'data': ['X', a_vs_b]}, {'name': 'B', 'data': [b_vs_a, '-']}]
+
+@pytest.mark.parametrize('a_vs_b, b_vs_a', [
+    ('3 -- 2', '2 -- 3'),
+    ('3-2', '2 -- 3'),
+    ('3 – 2', ' 2--3 '),
+    ('03 -- 2', '2 -- 3'),
+])
+def test_valid_reciprocal_scores(a_vs_b, b_vs_a):
+    assert validation_service.validate_head_to_head_data(HEADERS, rows(a_vs_b, b_vs_a)) == []
+
+@pytest.mark.parametrize('a_vs_b', ['3 -- ', 'hello -- world', '1.5 -- 2', '-1 -- 2', '3 -- 2 -- 1', 7, None])
+def test_invalid_scores(a_vs_b):
+    errors = validation_service.validate_head_to_head_data(HEADERS, rows(a_vs_b, '2 -- 3'))
+    assert sorted(errors) == [
+        f"Cell (A vs B): Invalid score format '{a_vs_b}'. Expected 'X -- Y' with numeric X and Y. "
+        f"Details: Invalid format: not 'X -- Y'",
+        "Cell (B vs A): Invalid score format '2 -- 3'. Expected 'X -- Y' with numeric X and Y. "
+        "Details: Invalid format: reciprocal not 'X -- Y'",
+    ]
+
+def test_reciprocal_mismatch():
+    errors = validation_service.validate_head_to_head_data(HEADERS, rows('3 -- 2', '2 -- 4'))
+    assert sorted(errors) == [
+        "Cell (A vs B): Reciprocal score mismatch. Expected '2 -- 3', but found '2 -- 4'.",
+        "Cell (B vs A): Reciprocal score mismatch. Expected '4 -- 2', but found '3 -- 2'.",
+    ]
+
+def test_structural_errors():
+    errors = validation_service.validate_head_to_head_data(['A', 'C'], [
+        {'name': 'A', 'data': ['X', '1 -- 0']},
+        {'name': 'B', 'data': 'not a list'},
+        {'data': []},
+    ])
+    assert "Header 'C' does not correspond to a player name in the first column." in errors
+    assert "Row for 'B' is malformed: missing or invalid 'data' list." in errors
+    assert "Row 3 has no player name (first column)." in errors
+
+def test_self_play_cell_must_be_zero_if_numeric():
+    errors = validation_service.validate_head_to_head_data(HEADERS, [
+        {'name': 'A', 'data': ['1', '1 -- 0']}, {'name': 'B', 'data': ['0 -- 1', 0]}])
+    assert errors == ["Cell (A vs A): Self-play cell should be 0 or a non-numeric indicator (e.g., 'X', '-'), but found '1'."]
+
+def test_player_stats_count_only_valid_scores():
+    table = [
+        ['X', '3-1', '2 -- 2', 'oops'],
+        ['1 -- 3', 'X', '', '1.5 -- 2'],
+        ['2 -- 2', '', 'X', '0 -- 4'],
+        ['x', '2 -- 1.5', '4 -- 0', 'X'],
+    ]
+    stats = export_service.compute_player_stats(table, ['A', 'B', 'C', 'D'])
+    assert stats == {
+        'A': {'win_rate': 0.75, 'matches_played': 2},
+        'B': {'win_rate': 0.0, 'matches_played': 1},
+        'C': {'win_rate': 0.25, 'matches_played': 2},
+        'D': {'win_rate': 1.0, 'matches_played': 1},
+    }
+
+def test_player_stats_of_short_or_missing_rows():
+    stats = export_service.compute_player_stats([['X', '2 -- 1'], 'not a row'], ['A', 'B', 'C'])
+    assert stats['A'] == {'win_rate': 1.0, 'matches_played': 1}
+    assert stats['B'] == stats['C'] == {'win_rate': 0.0, 'matches_played': 0}
@@ -0,0 +1,104 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservices'))
+sys.path.append(microservices_path)
+
+from scores import wire
+from scores.scores import parse_table
+import export_service
+import ranking_service
+import validation_service
+
+TABLE = [
+    ['X', '3 -- 1', ' 2--0', 'oops'],
+    ['1 -- 3', '-', '4 – 4', ''],
+    ['0 -- 2', '4 -- 4', 0, '007 -- 1'],
+    ['', None, '1 -- 7', 'X'],
+]
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_encode_decode_round_trip(compress):
+    wins, losses, valid = parse_table(TABLE)
+    meta = {'algorithm': 'elo', 'names': ['A', 'B', 'C', 'D']}
+    decoded = wire.decode(wire.encode(wins, losses, valid, meta, compress=compress))
+    assert np.array_equal(decoded[0], wins)
+    assert np.array_equal(decoded[1], losses)
+    assert np.array_equal(decoded[2], valid)
+    assert decoded[3] == meta
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_encode_table_gives_back_every_cell(compress):
+    wins, losses, _, meta = wire.decode(wire.encode_table(TABLE, {'playerNames': 'ABCD'}, compress=compress))
+    assert wire.decode_table(wins, losses, meta) == TABLE
+    assert meta['playerNames'] == 'ABCD'
+
+def test_encode_table_needs_rectangular_rows():
+    assert wire.encode_table([['X', '1 -- 0'], ['0 -- 1']]) is None
+
+def npy_body():
+    buffer = io.BytesIO()
+    np.save(buffer, np.zeros((2, 2)))
+    return buffer.getvalue()
+
+def body_without_meta():
+    buffer = io.BytesIO()
+    np.savez(buffer, wins=np.zeros((2, 2)), losses=np.zeros((2, 2)), valid=np.ones((2, 2), dtype=bool))
+    return buffer.getvalue()
+
+def body_with_mismatched_shapes():
+    buffer = io.BytesIO()
+    np.savez(buffer, wins=np.zeros((2, 2)), losses=np.zeros((3, 3)), valid=np.ones((2, 2), dtype=bool),
+             meta=np.frombuffer(b'{}', dtype=np.uint8))
+    return buffer.getvalue()
+
+GOOD_BODY = wire.encode_table(TABLE, {'headers': list('ABCD'), 'names': list('ABCD'), 'playerNames': list('ABCD')})
+
+MALFORMED_BODIES = [
+    b'',
+    b'not an archive',
+    GOOD_BODY[:len(GOOD_BODY) // 2],
+    GOOD_BODY[:-10],
+    npy_body(),
+    body_without_meta(),
+    body_with_mismatched_shapes(),
+    wire.encode(np.zeros((2, 2)), np.zeros((2, 2)), np.ones((2, 2)), meta=['not', 'an', 'object']),
+]
+
+@pytest.mark.parametrize('body', MALFORMED_BODIES)
+def test_decode_rejects_malformed_bodies(body):
+    with pytest.raises(ValueError):
+        wire.decode(body)
+
+def test_decode_table_rejects_bad_raw_cells():
+    wins, losses, _, meta = wire.decode(wire.encode_table(TABLE))
+    with pytest.raises(ValueError):
+        wire.decode_table(wins, losses, dict(meta, raw_cells={'9,9': 'x'}))
+    with pytest.raises(ValueError):
+        wire.decode_table(wins, losses, {})
+
+@pytest.mark.parametrize('service, path', [
+    (ranking_service, '/rank'),
+    (export_service, '/player_stats'),
+    (validation_service, '/validate_data'),
+])
+@pytest.mark.parametrize('body', MALFORMED_BODIES)
+def test_services_answer_malformed_bodies_with_400(service, path, body):
+    response = service.app.test_client().post(path, data=body, content_type=wire.CONTENT_TYPE)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+@pytest.mark.parametrize('service, path', [
+    (ranking_service, '/rank'),
+    (export_service, '/player_stats'),
+    (validation_service, '/validate_data'),
+])
+def test_services_accept_a_binary_body(service, path):
+    response = service.app.test_client().post(path, data=GOOD_BODY, content_type=wire.CONTENT_TYPE)
+    assert response.status_code == 200
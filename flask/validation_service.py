@@ -1,12 +1,42 @@
+import sys
+import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+microservices_path = os.path.abspath(os.path.join(current_dir, '..', 'microservices'))
+sys.path.append(microservices_path)
+
+from scores import wire
+from scores.scores import parse_table
+import deadlines
+
 app = Flask(__name__)
 
 # --- CORS Configuration for Validation Microservice ---
 # This allows your main Flask app (on port 5000) to communicate with this service (on port 5052).
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 # --- End CORS Configuration ---
+app.before_request(deadlines.reject_expired)
+
+def _first_indexes(items):
+    """
+    {item: index of its first occurrence}, leaving out unhashable items.
+    """
+    indexes = {}
+    for idx, item in enumerate(items):
+        try:
+            indexes.setdefault(item, idx)
+        except TypeError:
+            pass
+    return indexes
+
+def _lookup(indexes, key):
+    try:
+        return indexes.get(key)
+    except TypeError:
+        return None
 
 def validate_head_to_head_data(headers, rows):
     errors = []
@@ -24,14 +54,26 @@ def validate_head_to_head_data(headers, rows):
     player_names_in_rows = [row.get('name') for row in rows]
     
     # Check if all player names in rows are unique
-    if len(set(player_names_in_rows)) != len(player_names_in_rows):
+    row_name_set = set(player_names_in_rows)
+    if len(row_name_set) != len(player_names_in_rows):
         errors.append("All player names in the first column must be unique.")
 
     # Check if all headers correspond to valid player names (and vice-versa, implicitly)
     for header in headers:
-        if header not in player_names_in_rows:
+        try:
+            known = header in row_name_set
+        except TypeError:
+            known = header in player_names_in_rows
+        if not known:
             errors.append(f"Header '{header}' does not correspond to a player name in the first column.")
 
+    # Every cell is parsed once, by the same rules the ranking service uses.
+    # Rows without a data list have no cells to look up.
+    row_data = [row.get('data') if isinstance(row.get('data'), list) else [] for row in rows]
+    wins, losses, valid = (a.tolist() for a in parse_table(row_data))
+    row_index_by_name = _first_indexes(player_names_in_rows)
+    col_index_by_name = _first_indexes(headers)
+
     # Main data validation loop
     for i, row in enumerate(rows):
         current_player_name = row.get('name')
@@ -64,61 +106,39 @@ def validate_head_to_head_data(headers, rows):
             # --- Non-self-play cell check ---
             else:
                 # Find the opponent's row for reciprocal check
-                opponent_row = None
-                for p_row in rows:
-                    if p_row.get('name') == opponent_name:
-                        opponent_row = p_row
-                        break
-                
-                if opponent_row is None:
+                opponent_row_index = _lookup(row_index_by_name, opponent_name)
+                if opponent_row_index is None:
                     # This case should be caught by the header/player name mismatch check earlier,
                     # but it's a safe guard for structural issues.
                     errors.append(f"Internal error: Could not find row for opponent '{opponent_name}' when checking '{current_player_name}' vs '{opponent_name}'.")
                     continue
 
                 # Find the current player's column in the opponent's row
-                current_player_col_index = -1
-                try:
-                    current_player_col_index = headers.index(current_player_name)
-                except ValueError:
+                current_player_col_index = _lookup(col_index_by_name, current_player_name)
+                if current_player_col_index is None:
                     errors.append(f"Internal error: Could not find column for current player '{current_player_name}' in headers.")
                     continue
 
-                if current_player_col_index >= len(opponent_row['data']):
+                opponent_data = row_data[opponent_row_index]
+                if current_player_col_index >= len(opponent_data):
                     errors.append(f"Internal error: Reciprocal data index out of bounds for '{opponent_name}' vs '{current_player_name}'.")
                     continue
 
-                reciprocal_value = opponent_row['data'][current_player_col_index]
-
                 # Validate the 'X -- Y' format for both current and reciprocal values
-                try:
-                    # Parse current cell value (e.g., '2 -- 3')
-                    parts_current = [p.strip() for p in str(cell_value).split('--')]
-                    if len(parts_current) != 2:
-                        raise ValueError("Invalid format: not 'X -- Y'")
-
-                    # Parse reciprocal cell value (e.g., '3 -- 2')
-                    parts_reciprocal = [p.strip() for p in str(reciprocal_value).split('--')]
-                    if len(parts_reciprocal) != 2:
-                        raise ValueError("Invalid format: reciprocal not 'X -- Y'")
-
-                    # Ensure both parts are integers (e.g., '2' and '3')
-                    # This will catch cases like 'hello -- world'
-                    try:
-                        int(parts_current[0])
-                        int(parts_current[1])
-                        int(parts_reciprocal[0])
-                        int(parts_reciprocal[1])
-                    except ValueError:
-                        raise ValueError("Non-numeric parts in 'X -- Y' format")
-
-                    # Symmetry check: If current is 'X -- Y', reciprocal must be 'Y -- X'
-                    if not (parts_current[0] == parts_reciprocal[1] and parts_current[1] == parts_reciprocal[0]):
-                        errors.append(f"Cell ({current_player_name} vs {opponent_name}): Reciprocal score mismatch. Expected '{parts_current[1]} -- {parts_current[0]}', but found '{reciprocal_value}'.")
-
-                except ValueError as e:
-                    # Catch all parsing and format errors
-                    errors.append(f"Cell ({current_player_name} vs {opponent_name}): Invalid score format '{cell_value}'. Expected 'X -- Y' with numeric X and Y. Details: {e}")
+                details = None
+                if not valid[i][j]:
+                    details = "Invalid format: not 'X -- Y'"
+                elif not valid[opponent_row_index][current_player_col_index]:
+                    details = "Invalid format: reciprocal not 'X -- Y'"
+                if details:
+                    errors.append(f"Cell ({current_player_name} vs {opponent_name}): Invalid score format '{cell_value}'. Expected 'X -- Y' with numeric X and Y. Details: {details}")
+                    continue
+
+                # Symmetry check: If current is 'X -- Y', reciprocal must be 'Y -- X'
+                if wins[i][j] != losses[opponent_row_index][current_player_col_index] or \
+                        losses[i][j] != wins[opponent_row_index][current_player_col_index]:
+                    reciprocal_value = opponent_data[current_player_col_index]
+                    errors.append(f"Cell ({current_player_name} vs {opponent_name}): Reciprocal score mismatch. Expected '{losses[i][j]} -- {wins[i][j]}', but found '{reciprocal_value}'.")
 
     # Return unique errors only
     return list(set(errors))
@@ -126,6 +146,20 @@ def validate_head_to_head_data(headers, rows):
 
 @app.route('/validate_data', methods=['POST'])
 def validate_data():
+    if request.mimetype == wire.CONTENT_TYPE:
+        # Binary body: the cells are rebuilt exactly as sent, names and headers are in its meta
+        try:
+            wins, losses, _, data = wire.decode(request.get_data())
+            headers = data.get('headers')
+            names = data.get('names')
+            if not isinstance(headers, list) or not isinstance(names, list) or wins.shape != (len(names), len(headers)):
+                raise ValueError("Binary payload needs 'headers' and 'names' lists matching the matrix shape")
+            cells = wire.decode_table(wins, losses, data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        rows = [{'name': name, 'data': data} for name, data in zip(names, cells)]
+        return jsonify({"errors": validate_head_to_head_data(headers, rows)}), 200
+
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid JSON payload"}), 400
@@ -1,15 +1,10 @@
+from scores.scores import parse_cell
+
 # used to parse a 2D table of h2h records formatted as "X -- Y"
 def parse(table):
     parsed = []
     for row in table:
-        parsed_row = []
-        for cell in row:
-            try:
-                x, y = cell.strip().split('--')
-                parsed_row.append((int(x.strip()), int(y.strip())))
-            except Exception:
-                parsed_row.append((0, 0))
-        parsed.append(parsed_row)
+        parsed.append([parse_cell(cell) or (0, 0) for cell in row])
     return parsed
 
 # create an initial ranking based purely on win-rate
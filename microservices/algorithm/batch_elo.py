@@ -0,0 +1,89 @@
+import numpy as np
+
+from .elo import INITIAL_ELO, normalize_elos
+from .sparse import from_table
+
+# Aggregated-match Elo. Instead of replaying every game one by one, each sweep
+# scores every played pairing as one batch at the ratings from the start of
+# the sweep: a record of w wins in n games against an opponent contributes
+# w - n * expected to the player's residual. All players then move at once by
+# the step that zeroes their residual to first order (a diagonal Newton step
+# on the Elo logistic curve), so the cost of a sweep depends only on the number
+# of pairings, never on the raw game counts, and the result does not depend on
+# the order of the players. Steps are halved because both players of a
+# pairing move at once. One virtual draw against an INITIAL_ELO opponent
+# keeps unbeaten and winless players at a finite rating, and ratings are
+# re-centred on INITIAL_ELO after every sweep since only their differences matter.
+
+# weight of the virtual draw against an INITIAL_ELO opponent
+PRIOR_GAMES = 1.0
+# fraction of the per-player step taken each sweep; both players of a pairing
+# move at once, so a full step would overshoot their rating gap twofold
+DAMPING = 0.5
+# largest rating change a single sweep may make
+MAX_STEP = 400.0
+# slope of the Elo expected score per rating point, ln(10) / 400
+ELO_SLOPE = np.log(10) / 400
+
+def expected_scores(player_elos, opponent_elos):
+    return 1 / (1 + 10 ** ((opponent_elos - player_elos) / 400))
+
+def run_batch_elo(edges, max_iters=100, tolerance=0.001, initial_elos=None, prior_games=PRIOR_GAMES):
+    """
+    Runs aggregated Elo sweeps over an EdgeList until no rating moves by more
+    than `tolerance`. Each edge (i, j, wins, losses) is one cell of the table
+    and updates both players, as the sequential replay does.
+
+    Returns:
+        tuple: The raw Elo ratings for each player, and a dict with the
+               iterations used, the final residual and whether it converged.
+    """
+    num_players = edges.num_players
+    if num_players == 0:
+        return [], {'solver': 'aggregated', 'iterations': 0, 'residual': 0.0, 'converged': True}
+
+    if initial_elos is None:
+        elos = np.full(num_players, float(INITIAL_ELO))
+    else:
+        elos = np.asarray(initial_elos, dtype=np.float64)
+    games = (edges.wins + edges.losses).astype(np.float64)
+
+    iterations = 0
+    residual = float('inf')
+    for iteration in range(max_iters):
+        expected = expected_scores(elos[edges.rows], elos[edges.cols])
+        surplus = edges.wins - games * expected
+        information = games * expected * (1 - expected)
+
+        prior_expected = expected_scores(elos, INITIAL_ELO)
+        score_residual = (np.bincount(edges.rows, weights=surplus, minlength=num_players)
+                          - np.bincount(edges.cols, weights=surplus, minlength=num_players)
+                          + prior_games * (0.5 - prior_expected))
+        curvature = ELO_SLOPE * (np.bincount(edges.rows, weights=information, minlength=num_players)
+                                 + np.bincount(edges.cols, weights=information, minlength=num_players)
+                                 + prior_games * prior_expected * (1 - prior_expected))
+
+        new_elos = elos + np.clip(DAMPING * score_residual / curvature, -MAX_STEP, MAX_STEP)
+        new_elos += INITIAL_ELO - new_elos.mean()
+
+        iterations = iteration + 1
+        residual = float(np.abs(new_elos - elos).max())
+        elos = new_elos
+        if residual <= tolerance:
+            break
+
+    info = {'solver': 'aggregated', 'iterations': iterations, 'residual': residual, 'converged': residual <= tolerance}
+    return elos.tolist(), info
+
+def rank_batch_elo(edges, max_iters=100, tolerance=0.001):
+    """
+    Aggregated counterpart of elo.rank_elo over an EdgeList, normalized to [0, 1].
+    """
+    return normalize_elos(run_batch_elo(edges, max_iters, tolerance)[0])
+
+# Main function to be called from the ranking service
+def rank(table, max_iters=100, tolerance=0.001):
+    """
+    Parses the input table and computes aggregated Elo rankings.
+    """
+    return rank_batch_elo(from_table(table), max_iters, tolerance)
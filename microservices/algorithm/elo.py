@@ -1,5 +1,7 @@
 import math
 
+from scores.scores import parse_cell
+
 # Initial Elo rating for new players
 INITIAL_ELO = 1500
 # K-factor: determines the maximum possible adjustment per game.
@@ -61,61 +63,112 @@ def rank_elo(table, max_iters=100, tolerance=0.001):
         list: A normalized list of Elo ratings for each player.
     """
     num_players = len(table)
+
+    # Only cells with recorded games take part in the replay
+    cells = []
+    for i in range(num_players):
+        for j in range(num_players):
+            if i == j:
+                continue
+            wins, losses = table[i][j]
+            if wins or losses:
+                cells.append((i, j, wins, losses))
+
+    return rank_elo_cells(num_players, cells, max_iters, tolerance)
+
+def rank_elo_cells(num_players, cells, max_iters=100, tolerance=0.001):
+    """
+    Computes Elo rankings from a list of played pairings instead of a dense table.
+
+    Args:
+        num_players (int): Number of players in the league.
+        cells (list of tuple): (i, j, wins_i_vs_j, losses_i_vs_j) for every
+                               off-diagonal cell with recorded games, in
+                               row-major order.
+        max_iters (int): Maximum number of iterations for the ranking process.
+        tolerance (float): The convergence tolerance.
+
+    Returns:
+        list: A normalized list of Elo ratings for each player.
+    """
+    return normalize_elos(run_elo_cells(num_players, cells, max_iters, tolerance)[0])
+
+def run_elo_cells(num_players, cells, max_iters=100, tolerance=0.001, initial_elos=None):
+    """
+    Replays the played pairings until the ratings stop changing.
+
+    Args:
+        num_players (int): Number of players in the league.
+        cells (list of tuple): (i, j, wins_i_vs_j, losses_i_vs_j) in row-major order.
+        max_iters (int): Maximum number of iterations for the ranking process.
+        tolerance (float): The convergence tolerance.
+        initial_elos (list of float): Raw ratings from a previous run to
+                                      warm-start from; INITIAL_ELO when None.
+
+    Returns:
+        tuple: The raw (unnormalized) Elo ratings for each player, and a dict
+               with the iterations used, the final residual (largest rating
+               change in the last iteration) and whether it converged.
+    """
     if num_players == 0:
-        return []
+        return [], {'solver': 'sequential', 'iterations': 0, 'residual': 0.0, 'converged': True}
 
-    # Initialize all players with the initial Elo rating
-    current_elos = initialize_elos(num_players)
+    # Initialize all players with the initial Elo rating, or resume from a previous run
+    if initial_elos is None:
+        current_elos = initialize_elos(num_players)
+    else:
+        current_elos = [float(elo) for elo in initial_elos]
 
+    iterations = 0
+    residual = float('inf')
     for iteration in range(max_iters):
         # We need to perform all updates based on the ratings at the START of the iteration
         # to prevent update order bias. Then apply all changes at once.
         temp_elos = list(current_elos) # Store new ratings here
 
-        for i in range(num_players):
-            for j in range(num_players):
-                if i == j:
-                    continue
-
-                wins, losses = table[i][j]
-
-                # Process each win and loss as a separate "match" for Elo update
-                for _ in range(wins):
-                    # Player i won against player j
-                    new_elo_i, new_elo_j = update_elo(temp_elos[i], temp_elos[j], 1)
-                    # Accumulate changes
-                    temp_elos[i] = new_elo_i
-                    temp_elos[j] = new_elo_j
-
-                for _ in range(losses):
-                    # Player i lost against player j
-                    new_elo_i, new_elo_j = update_elo(temp_elos[i], temp_elos[j], 0)
-                    # Accumulate changes
-                    temp_elos[i] = new_elo_i
-                    temp_elos[j] = new_elo_j
+        for i, j, wins, losses in cells:
+            # Process each win and loss as a separate "match" for Elo update
+            for _ in range(wins):
+                # Player i won against player j
+                new_elo_i, new_elo_j = update_elo(temp_elos[i], temp_elos[j], 1)
+                # Accumulate changes
+                temp_elos[i] = new_elo_i
+                temp_elos[j] = new_elo_j
+
+            for _ in range(losses):
+                # Player i lost against player j
+                new_elo_i, new_elo_j = update_elo(temp_elos[i], temp_elos[j], 0)
+                # Accumulate changes
+                temp_elos[i] = new_elo_i
+                temp_elos[j] = new_elo_j
         
         # Check for convergence
-        converged = True
-        for i in range(num_players):
-            if abs(current_elos[i] - temp_elos[i]) > tolerance:
-                converged = False
-                break
+        iterations = iteration + 1
+        residual = max(abs(current_elos[i] - temp_elos[i]) for i in range(num_players))
+        converged = residual <= tolerance
         
         current_elos = temp_elos # Apply all changes for the next iteration
 
         if converged:
             break
 
-    # Normalize the final Elo ratings to a [0, 1] range
-    min_elo = min(current_elos)
-    max_elo = max(current_elos)
+    info = {'solver': 'sequential', 'iterations': iterations, 'residual': residual, 'converged': residual <= tolerance}
+    return current_elos, info
 
-    if max_elo == min_elo:
-        return [0.5 for _ in current_elos]
+def normalize_elos(elos):
+    """
+    Normalizes raw Elo ratings to a [0, 1] range.
+    """
+    if not elos:
+        return []
+
+    min_elo = min(elos)
+    max_elo = max(elos)
 
-    normalized_elos = [(elo - min_elo) / (max_elo - min_elo) for elo in current_elos]
+    if max_elo == min_elo:
+        return [0.5 for _ in elos]
 
-    return normalized_elos
+    return [(elo - min_elo) / (max_elo - min_elo) for elo in elos]
 
 # Helper function to parse the table, similar to your existing algorithm.py
 def parse_elo_table(table):
@@ -125,17 +178,8 @@ def parse_elo_table(table):
     """
     parsed = []
     for row in table:
-        parsed_row = []
-        for cell in row:
-            try:
-                x, y = map(int, cell.strip().split('--'))
-                parsed_row.append((x, y))
-            except Exception:
-                # If a cell is malformed or empty, treat it as 0 wins and 0 losses
-                # This prevents errors but might need more sophisticated handling
-                # depending on your specific data input expectations.
-                parsed_row.append((0, 0))
-        parsed.append(parsed_row)
+        # If a cell is malformed or empty, treat it as 0 wins and 0 losses
+        parsed.append([parse_cell(cell) or (0, 0) for cell in row])
     return parsed
 
 
@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+
+from .elo import INITIAL_ELO, normalize_elos, update_elo
+
+# Persistent online Elo. Match events ("winner beat loser at time t") are
+# appended to an event log and applied one at a time with the same
+# update_elo / K_FACTOR rule as elo.py, so each match costs O(1) and the
+# current ratings can be read back without recomputing anything. Ratings and
+# the event log live in SQLite; each league's ratings are also cached in
+# memory once loaded.
+
+# events are written to the log in chunks of this size during a backfill
+EVENT_CHUNK_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    league TEXT NOT NULL,
+    player TEXT NOT NULL,
+    elo REAL NOT NULL,
+    games INTEGER NOT NULL,
+    PRIMARY KEY (league, player)
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    league TEXT NOT NULL,
+    winner TEXT NOT NULL,
+    loser TEXT NOT NULL,
+    draw INTEGER NOT NULL,
+    time TEXT
+);
+"""
+
+def parse_event(event):
+    """
+    Validates one match event dict: {"winner": str, "loser": str,
+    "draw": bool (optional), "time": any (optional)}.
+
+    Returns:
+        tuple: (winner, loser, draw, time)
+    """
+    if not isinstance(event, dict):
+        raise ValueError("Each match event must be an object")
+    winner = event.get('winner')
+    loser = event.get('loser')
+    if not isinstance(winner, str) or not isinstance(loser, str) or not winner or not loser:
+        raise ValueError("Each match event needs non-empty 'winner' and 'loser' names")
+    if winner == loser:
+        raise ValueError(f"Player '{winner}' cannot play against themselves")
+    time = event.get('time')
+    return winner, loser, bool(event.get('draw', False)), None if time is None else str(time)
+
+class RatingStore:
+    """
+    SQLite-backed store of online Elo ratings, keyed by league.
+    Safe to share between request threads.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.leagues = {} # league -> {player: [elo, games]}
+
+    def _league(self, league):
+        ratings = self.leagues.get(league)
+        if ratings is None:
+            rows = self.conn.execute('SELECT player, elo, games FROM ratings WHERE league = ?', (league,))
+            ratings = {player: [elo, games] for player, elo, games in rows}
+            self.leagues[league] = ratings
+        return ratings
+
+    def record(self, league, events):
+        """
+        Applies match events in order, in a single pass over `events` (any
+        iterable, so a backfill can be streamed). Each event costs O(1).
+        Either every event is applied and persisted, or none is.
+
+        Returns:
+            int: The number of events applied.
+        """
+        with self.lock:
+            ratings = self._league(league)
+            originals = {} # player -> entry before this call (None if new), to undo on failure
+            pending = []
+            count = 0
+            try:
+                with self.conn:
+                    for event in events:
+                        winner, loser, draw, time = parse_event(event)
+                        for player in (winner, loser):
+                            if player not in originals:
+                                entry = ratings.get(player)
+                                originals[player] = None if entry is None else list(entry)
+                        winner_entry = ratings.setdefault(winner, [float(INITIAL_ELO), 0])
+                        loser_entry = ratings.setdefault(loser, [float(INITIAL_ELO), 0])
+                        winner_entry[0], loser_entry[0] = update_elo(winner_entry[0], loser_entry[0], 0.5 if draw else 1)
+                        winner_entry[1] += 1
+                        loser_entry[1] += 1
+
+                        pending.append((league, winner, loser, int(draw), time))
+                        count += 1
+                        if len(pending) >= EVENT_CHUNK_SIZE:
+                            self._write_events(pending)
+                            pending = []
+
+                    self._write_events(pending)
+                    self.conn.executemany(
+                        'INSERT INTO ratings (league, player, elo, games) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (league, player) DO UPDATE SET elo = excluded.elo, games = excluded.games',
+                        ((league, player, ratings[player][0], ratings[player][1]) for player in originals)
+                    )
+            except Exception:
+                # The transaction was rolled back, so undo the in-memory updates too
+                for player, entry in originals.items():
+                    if entry is None:
+                        ratings.pop(player, None)
+                    else:
+                        ratings[player] = entry
+                raise
+            return count
+
+    def _write_events(self, pending):
+        self.conn.executemany(
+            'INSERT INTO events (league, winner, loser, draw, time) VALUES (?, ?, ?, ?, ?)', pending
+        )
+
+    def ratings(self, league):
+        """
+        Returns the current ratings of a league without recomputation.
+
+        Returns:
+            dict: 'players', raw 'elo', 'games' played and the normalized
+                  'ranking', all in the same player order.
+        """
+        with self.lock:
+            ratings = self._league(league)
+            players = sorted(ratings)
+            elos = [ratings[player][0] for player in players]
+            games = [ratings[player][1] for player in players]
+        return {'players': players, 'elo': elos, 'games': games, 'ranking': normalize_elos(elos)}
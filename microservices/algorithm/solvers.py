@@ -0,0 +1,76 @@
+import numpy as np
+
+# Solvers for the fixed-point ranking iteration ranks = step(ranks), shared by
+# the dense and sparse engines. Each returns the final ranking together with
+# convergence metadata (iterations used, final residual, whether it converged)
+# where the residual is the largest change made by the last step.
+
+SOLVERS = ('fixed_point', 'anderson')
+
+# history length kept by the Anderson solver
+ANDERSON_MEMORY = 5
+
+def convergence_info(solver, iterations, residual, tolerance):
+    return {
+        'solver': solver,
+        'iterations': iterations,
+        'residual': float(residual),
+        'converged': bool(residual < tolerance),
+    }
+
+# plain fixed-point iteration, the loop algorithm.rank has always used
+def fixed_point(step, ranks, max_iters=100, tolerance=0.001):
+    new_ranks = ranks
+    residual = np.inf
+    iterations = 0
+    while iterations < max_iters:
+        new_ranks = step(ranks)
+        iterations += 1
+        residual = np.abs(new_ranks - ranks).max()
+        if residual < tolerance:
+            break
+        ranks = new_ranks
+    return new_ranks, convergence_info('fixed_point', iterations, residual, tolerance)
+
+# Anderson-accelerated iteration: each new iterate is the combination of the
+# last few step results that best cancels their residuals (a small least
+# squares solve), clipped to the [0, 1] range the normalized ranking lives in.
+# The history is dropped whenever an extrapolated step makes things worse.
+def anderson(step, ranks, max_iters=100, tolerance=0.001, memory=ANDERSON_MEMORY):
+    stepped = step(ranks)
+    residual_vec = stepped - ranks
+    residual = np.abs(residual_vec).max()
+    iterations = 1
+    stepped_history, residual_history = [], []
+
+    while residual >= tolerance and iterations < max_iters:
+        if residual_history:
+            residual_diffs = np.column_stack(residual_history)
+            stepped_diffs = np.column_stack(stepped_history)
+            gamma = np.linalg.lstsq(residual_diffs, residual_vec, rcond=None)[0]
+            next_ranks = np.clip(stepped - stepped_diffs @ gamma, 0.0, 1.0)
+        else:
+            next_ranks = stepped
+
+        next_stepped = step(next_ranks)
+        next_residual_vec = next_stepped - next_ranks
+        next_residual = np.abs(next_residual_vec).max()
+        iterations += 1
+
+        if next_residual > residual and residual_history:
+            stepped_history, residual_history = [], []
+        else:
+            stepped_history.append(next_stepped - stepped)
+            residual_history.append(next_residual_vec - residual_vec)
+            del stepped_history[:-memory], residual_history[:-memory]
+
+        ranks, stepped, residual_vec, residual = next_ranks, next_stepped, next_residual_vec, next_residual
+
+    return stepped, convergence_info('anderson', iterations, residual, tolerance)
+
+def solve(step, ranks, solver='fixed_point', max_iters=100, tolerance=0.001):
+    if solver == 'anderson':
+        return anderson(step, ranks, max_iters, tolerance)
+    if solver == 'fixed_point':
+        return fixed_point(step, ranks, max_iters, tolerance)
+    raise ValueError(f"Unknown solver '{solver}'. Choose one of: {', '.join(SOLVERS)}")
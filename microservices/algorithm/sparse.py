@@ -0,0 +1,96 @@
+from collections import namedtuple
+
+import numpy as np
+
+from .elo import normalize_elos, run_elo_cells
+from .solvers import convergence_info, solve
+from .vectorized import normalize, parse
+
+# Sparse ranking mode for leagues where most pairs never meet.
+# Played pairings are kept as a COO edge list sorted by (row, col), so memory
+# and per-iteration cost grow with the number of played pairings instead of n^2.
+# Each edge is one cell of the dense table: player `row` went `wins -- losses`
+# against player `col`.
+EdgeList = namedtuple('EdgeList', ['num_players', 'rows', 'cols', 'wins', 'losses'])
+
+# builds an EdgeList from [i, j, wins, losses] records; duplicate pairings are
+# summed, self-play and empty pairings are dropped. With mirror=True every
+# record also fills the reciprocal (j, i) cell, as the dense table does.
+def from_edges(num_players, edges, mirror=False):
+    records = np.asarray(edges, dtype=np.int64).reshape(-1, 4)
+    rows, cols, wins, losses = records.T
+    if len(records) and (rows.min() < 0 or cols.min() < 0
+                         or rows.max() >= num_players or cols.max() >= num_players):
+        raise ValueError(f"Edge player index out of range for {num_players} players")
+    if len(records) and (wins.min() < 0 or losses.min() < 0):
+        raise ValueError("Edge wins and losses must be non-negative")
+
+    if mirror:
+        rows, cols = np.concatenate((rows, cols)), np.concatenate((cols, rows))
+        wins, losses = np.concatenate((wins, losses)), np.concatenate((losses, wins))
+
+    keep = (rows != cols) & (wins + losses > 0)
+    rows, cols, wins, losses = rows[keep], cols[keep], wins[keep], losses[keep]
+
+    # sort row-major and merge duplicate pairings
+    keys = rows * num_players + cols
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    merged_wins = np.bincount(inverse, weights=wins, minlength=len(unique_keys)).astype(np.int64)
+    merged_losses = np.bincount(inverse, weights=losses, minlength=len(unique_keys)).astype(np.int64)
+    return EdgeList(num_players, unique_keys // num_players, unique_keys % num_players,
+                    merged_wins, merged_losses)
+
+# converts dense (wins, losses) matrices into an EdgeList
+def from_matrices(wins, losses):
+    games = wins + losses
+    np.fill_diagonal(games, 0)
+    rows, cols = np.nonzero(games)
+    return EdgeList(len(wins), rows, cols, wins[rows, cols], losses[rows, cols])
+
+# converts a dense 2D table of "X -- Y" cells into an EdgeList
+def from_table(table):
+    return from_matrices(*parse(table))
+
+# sums per-edge values into one total per row player
+def row_sums(edges, values):
+    return np.bincount(edges.rows, weights=values, minlength=edges.num_players)
+
+# create an initial ranking based purely on win-rate
+def init_ranking(edges):
+    total_wins = row_sums(edges, edges.wins)
+    total = row_sums(edges, edges.wins + edges.losses)
+    return np.divide(total_wins, total, out=np.zeros(edges.num_players), where=total > 0)
+
+# updates the ranking by weighting wins according to opponent ranks
+def update(edges, prev_ranks, scaling_factor=1.0):
+    opponent_weights = prev_ranks[edges.cols] ** scaling_factor
+    weighted_wins = row_sums(edges, edges.wins * opponent_weights)
+    weight_total = row_sums(edges, (edges.wins + edges.losses) * opponent_weights)
+    new_ranks = np.divide(weighted_wins, weight_total, out=np.zeros(edges.num_players), where=weight_total > 0)
+    return normalize(new_ranks)
+
+# sparse counterpart of algorithm.rank, returns (ranking, convergence info);
+# `initial` warm-starts the iteration
+def solve_default(edges, max_iters=100, scaling_factor=1.0, tolerance=0.001, initial=None, solver='fixed_point'):
+    if edges.num_players == 0:
+        return [], convergence_info(solver, 0, 0.0, tolerance)
+    if initial is None:
+        initial = init_ranking(edges)
+    prev_ranks = normalize(np.asarray(initial, dtype=np.float64))
+    step = lambda ranks: update(edges, ranks, scaling_factor)
+    ranks, info = solve(step, prev_ranks, solver, max_iters, tolerance)
+    return ranks.tolist(), info
+
+def rank_default(edges, max_iters=100, scaling_factor=1.0, tolerance=0.001, initial=None, solver='fixed_point'):
+    return solve_default(edges, max_iters, scaling_factor, tolerance, initial, solver)[0]
+
+# replays the played pairings in table order, returning raw Elo ratings and
+# convergence info; starts from `initial_elos` when given
+def run_elo(edges, max_iters=100, tolerance=0.001, initial_elos=None):
+    cells = list(zip(edges.rows.tolist(), edges.cols.tolist(),
+                     edges.wins.tolist(), edges.losses.tolist()))
+    return run_elo_cells(edges.num_players, cells, max_iters, tolerance, initial_elos)
+
+# sparse counterpart of elo.rank
+def rank_elo(edges, max_iters=100, tolerance=0.001):
+    return normalize_elos(run_elo(edges, max_iters, tolerance)[0])
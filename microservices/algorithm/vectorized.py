@@ -0,0 +1,119 @@
+import numpy as np
+
+from scores.scores import parse_cell as parse_score_cell, parse_table
+from .solvers import convergence_info, solve
+
+# NumPy engine for the iterative win-rate ranking in algorithm.py.
+# The h2h table is held as two integer matrices (wins, losses) with the
+# diagonal masked out, so each update step is one matrix-vector product
+# instead of an O(n^2) walk over a list of tuples.
+
+# used to parse a single "X -- Y" cell, malformed cells count as 0 -- 0
+def parse_cell(cell):
+    return parse_score_cell(cell) or (0, 0)
+
+# used to parse a 2D table of h2h records formatted as "X -- Y" into square
+# (wins, losses) integer matrices, malformed cells count as 0 -- 0
+def parse(table):
+    wins, losses, _ = parse_table(table)
+    return square(wins, losses, len(table))
+
+# crops or zero-pads parsed (wins, losses) matrices to num_players columns
+def square(wins, losses, num_players):
+    squared = np.zeros((2, num_players, num_players), dtype=np.int64)
+    num_cols = min(num_players, wins.shape[1])
+    squared[0, :, :num_cols] = wins[:, :num_cols]
+    squared[1, :, :num_cols] = losses[:, :num_cols]
+    return squared[0], squared[1]
+
+# zeroes the diagonal so self-play cells never contribute
+def mask_diagonal(wins, losses):
+    wins = np.array(wins, dtype=np.int64)
+    losses = np.array(losses, dtype=np.int64)
+    np.fill_diagonal(wins, 0)
+    np.fill_diagonal(losses, 0)
+    return wins, losses
+
+# create an initial ranking based purely on win-rate
+def init_ranking(wins, losses):
+    total_wins = wins.sum(axis=1)
+    total = total_wins + losses.sum(axis=1)
+    return np.divide(total_wins, total, out=np.zeros(len(total)), where=total > 0)
+
+# normalizes an array of floats to the range [0, 1]
+def normalize(ranks):
+    min_rank = ranks.min()
+    max_rank = ranks.max()
+    if max_rank == min_rank:
+        return np.full(len(ranks), 0.5)
+    return (ranks - min_rank) / (max_rank - min_rank)
+
+# stacks wins on top of games played so one product yields both sums
+def build_operator(wins, losses):
+    return np.vstack((wins, wins + losses)).astype(np.float64)
+
+# updates the ranking by weighting wins according to opponent ranks
+def update(operator, prev_ranks, scaling_factor=1.0):
+    num_players = len(prev_ranks)
+    weights = prev_ranks ** scaling_factor
+    sums = operator @ weights
+    weighted_wins, weight_total = sums[:num_players], sums[num_players:]
+    new_ranks = np.divide(weighted_wins, weight_total, out=np.zeros(num_players), where=weight_total > 0)
+    return normalize(new_ranks)
+
+# writes changed "X -- Y" cells into the matrices and the matching operator
+# rows, so an edit only touches the affected rows instead of re-parsing;
+# every [row, col, "X -- Y"] entry is checked before anything is written,
+# so a rejected edit (ValueError) leaves the matrices and operator as they were
+def set_cells(wins, losses, operator, cells):
+    num_players = len(wins)
+    scores = []
+    for entry in cells:
+        if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+            raise ValueError(f'{entry!r} is not a [row, col, "X -- Y"] entry')
+        i, j, cell = entry
+        if not all(isinstance(k, (int, np.integer)) and not isinstance(k, bool) for k in (i, j)):
+            raise ValueError(f"Cell ({i!r}, {j!r}) needs integer indexes")
+        if not (0 <= i < num_players and 0 <= j < num_players):
+            raise ValueError(f"Cell ({i}, {j}) is outside the {num_players}-player table")
+        score = parse_score_cell(cell)
+        if score is None:
+            raise ValueError(f'Cell ({i}, {j}) is not an "X -- Y" score: {cell!r}')
+        if i != j:
+            scores.append((i, j, score))
+
+    touched = set()
+    for i, j, score in scores:
+        wins[i, j], losses[i, j] = score
+        touched.add(i)
+    for i in touched:
+        operator[i] = wins[i]
+        operator[num_players + i] = wins[i] + losses[i]
+
+# iterates from prev_ranks until the ranking stabilizes, returning the
+# ranking and its convergence metadata (see solvers.py)
+def iterate(operator, prev_ranks, max_iters=100, scaling_factor=1.0, tolerance=0.001, solver='fixed_point'):
+    step = lambda ranks: update(operator, ranks, scaling_factor)
+    return solve(step, prev_ranks, solver, max_iters, tolerance)
+
+# main loop over already-parsed matrices, returns (ranking, convergence info);
+# `initial` warm-starts the iteration from a previous ranking
+def solve_matrices(wins, losses, max_iters=100, scaling_factor=1.0, tolerance=0.001, initial=None, solver='fixed_point'):
+    wins, losses = mask_diagonal(wins, losses)
+    if len(wins) == 0:
+        return [], convergence_info(solver, 0, 0.0, tolerance)
+    operator = build_operator(wins, losses)
+    if initial is None:
+        initial = init_ranking(wins, losses)
+    prev_ranks = normalize(np.asarray(initial, dtype=np.float64))
+    ranks, info = iterate(operator, prev_ranks, max_iters, scaling_factor, tolerance, solver)
+    return ranks.tolist(), info
+
+# mirrors algorithm.rank over already-parsed matrices
+def rank_matrices(wins, losses, max_iters=100, scaling_factor=1.0, tolerance=0.001, initial=None, solver='fixed_point'):
+    return solve_matrices(wins, losses, max_iters, scaling_factor, tolerance, initial, solver)[0]
+
+# drop-in replacement for algorithm.rank
+def rank(table, max_iters=100, scaling_factor=1.0, tolerance=0.001, initial=None, solver='fixed_point'):
+    wins, losses = parse(table)
+    return rank_matrices(wins, losses, max_iters, scaling_factor, tolerance, initial, solver)
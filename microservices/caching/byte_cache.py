@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Shared two-tier cache of byte strings (response bodies, images) under
+# content-hash keys, used by the ranking service's result cache, the
+# heatmap generator's render cache and the gateway's tile cache. Values are
+# kept least-recently-used in memory up to max_bytes. Given a directory,
+# they are also written there as one file per key, which survives restarts
+# and is trimmed least recently used first to max_disk_bytes.
+
+class ByteCache:
+    def __init__(self, max_bytes, directory=None, max_disk_bytes=0, suffix='.bin'):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.suffix = suffix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self._counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+        self._disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory)
+                                   if entry.name.endswith(suffix))
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f'{key}{self.suffix}')
+
+    def _store(self, key, value):
+        """
+        Adds an entry to the memory tier; the caller holds _lock.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._total_bytes += len(value)
+        while self._total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= len(evicted)
+            self._counters['evictions'] += 1
+
+    def get(self, key, count_miss=True):
+        """
+        Returns the cached bytes for a key, or None on a miss. A caller that
+        will look the same request up again under another key passes
+        count_miss=False, so the request is counted once.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return value
+
+        if self.directory:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    value = f.read()
+                os.utime(self._disk_path(key)) # mark as recently used for the disk trim
+            except OSError:
+                value = None
+            if value is not None:
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+                    self._store(key, value)
+                return value
+
+        if count_miss:
+            with self._lock:
+                self._counters['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Caches bytes under a key, in memory and on disk.
+        """
+        value = bytes(value)
+        with self._lock:
+            self._store(key, value)
+        if self.directory:
+            self._write_disk(key, value)
+
+    def _write_disk(self, key, value):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        # Write then rename, so a crash never leaves a truncated entry behind
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(value)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self._lock:
+            self._disk_bytes += len(value)
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """
+        Deletes the least recently used disk entries until the tier fits max_disk_bytes.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self):
+        """
+        Hit/miss counters and the current size of each tier.
+        """
+        with self._lock:
+            return {
+                **self._counters,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'disk_dir': self.directory,
+                'disk_bytes': self._disk_bytes if self.directory else 0,
+                'max_disk_bytes': self.max_disk_bytes if self.directory else 0,
+            }
@@ -1,30 +1,116 @@
 import socket
 import os
+import threading
+import Heatmap_Protocol
+import Heatmap_UploadStore
 
 PORT = 5555
 SEPARATOR = "<SEPERATOR>"
 BUFFER_SIZE = 4096
 MESSAGE_SIZE = 1024
+# a third header field asking the server to acknowledge each file and keep the connection open
+KEEP_ALIVE = "keep-alive"
+# seconds a kept-alive connection may sit idle before the server closes it
+IDLE_TIMEOUT = 300
 
-def receiveFile(socket):
-    received = socket.recv(MESSAGE_SIZE).decode()
-    filename, filesize = received.split(SEPARATOR)
+def pad_string(text, length=MESSAGE_SIZE, char=' '):
+    return text.ljust(length, char)
+
+def recv_exact(socket, size):
+    """
+    Reads exactly `size` bytes. Returns None if the peer closed the connection
+    before sending anything, and raises ConnectionError if it closed part way.
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = socket.recv(min(size - len(data), BUFFER_SIZE))
+        if not chunk:
+            if not data:
+                return None
+            raise ConnectionError(f"Connection closed after {len(data)} of {size} bytes")
+        data += chunk
+    return bytes(data)
+
+def receiveFile(socket, start=b''):
+    """
+    Receives one file announced by a 1024-byte header, of which `start` has
+    already been read. Returns whether the client asked to keep the
+    connection open.
+    """
+    rest = recv_exact(socket, MESSAGE_SIZE - len(start))
+    if rest is None:
+        raise ConnectionError("Connection closed in the middle of a header")
+    fields = (start + rest).decode().split(SEPARATOR)
+    filename, filesize = fields[0], fields[1]
+    keep_alive = len(fields) > 2 and fields[2].strip() == KEEP_ALIVE
 
-    # remove absolute path if there is
-    filename = os.path.basename(filename)
     # convert to integer
     filesize = int(filesize)
+    try:
+        Heatmap_UploadStore.check_size(filesize)
+    except ValueError as e:
+        # the file is not read, so the connection cannot be used again
+        if keep_alive:
+            socket.sendall(pad_string(f'02 {e}').encode())
+        return False
+
+    filename, digest, duplicate = Heatmap_UploadStore.receive(socket, filename, filesize)
+    print(f"Stored {filename} ({filesize} bytes, {'already stored' if duplicate else 'new'}) as {digest}")
+
+    if keep_alive:
+        socket.sendall(pad_string(f'00 Received {filename}.').encode())
+    return keep_alive
+
+def receiveFrame(socket, start):
+    """
+    Receives one binary-framed upload (see Heatmap_Protocol.py) and acknowledges it.
+    A header with a "sha256" and no body links the name to a file stored earlier.
+    Returns whether the connection can serve another request.
+    """
+    try:
+        op, header, body_size = Heatmap_Protocol.read(socket, start, recv_exact)
+        if op != Heatmap_Protocol.OP_UPLOAD:
+            raise Heatmap_Protocol.ProtocolError(f"Unsupported operation {op}; heatmaps are served on port 5556.")
+        Heatmap_UploadStore.check_size(body_size)
+    except ValueError as e:
+        socket.sendall(Heatmap_Protocol.reply(f'02 {e}'))
+        return False
 
-    with open(filename, "wb") as f:
+    filename = str(header.get('name', ''))
+    if 'sha256' in header and body_size == 0:
+        # the client already sent these contents once: just point the name at them
+        if Heatmap_UploadStore.link(filename, str(header['sha256'])):
+            socket.sendall(Heatmap_Protocol.reply(f'00 Received {os.path.basename(filename)}.'))
+        else:
+            socket.sendall(Heatmap_Protocol.reply('01 I do not have this file.'))
+        return True
+
+    filename, digest, duplicate = Heatmap_UploadStore.receive(socket, filename, body_size)
+    print(f"Stored {filename} ({body_size} bytes, {'already stored' if duplicate else 'new'}) as {digest}")
+    socket.sendall(Heatmap_Protocol.reply(f'00 Received {filename}.'))
+    return True
+
+def handle_connection(client_socket, addr):
+    # Serve files until the client closes the connection or stops asking to keep it open
+    try:
+        client_socket.settimeout(IDLE_TIMEOUT)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         while True:
-            # read 1024 bytes from the socket (receive)
-            bytes_read = client_socket.recv(BUFFER_SIZE)
-            if not bytes_read:
-                # nothing is received
-                # file transmitting is done
+            # the first bytes tell a binary frame from a 1024-byte text header
+            start = recv_exact(client_socket, len(Heatmap_Protocol.MAGIC))
+            if start is None:
+                break
+            if start == Heatmap_Protocol.MAGIC:
+                keep_open = receiveFrame(client_socket, start)
+            else:
+                keep_open = receiveFile(client_socket, start)
+            if not keep_open:
                 break
-            # write to the file the bytes we just received
-            f.write(bytes_read)
+    except (OSError, ValueError) as e:
+        print(f"Dropped connection from {addr}: {e}")
+    finally:
+        # close the client socket
+        client_socket.close()
 
 s = socket.socket()
 s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -33,17 +119,17 @@ print("I'm the server. Socket created.")
 s.bind(('', PORT))
 print("Socket bound to %s" %(PORT))
 
-s.listen(5)
+s.listen(64)
 print("Socket listening")
 
+Heatmap_UploadStore.start_sweeper()
+
 while True:
     client_socket, addr = s.accept()
     print("Got connection from: ", addr)
 
-    receiveFile(client_socket)
-
-    # close the client socket
-    client_socket.close()
+    # One thread per connection, so an idle kept-alive connection does not hold up the others
+    threading.Thread(target=handle_connection, args=(client_socket, addr), daemon=True).start()
 
 # close the server socket
-s.close()
\ No newline at end of file
+s.close()
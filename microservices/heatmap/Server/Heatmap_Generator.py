@@ -1,41 +1,89 @@
-import matplotlib.pyplot as plt
+import matplotlib
 from  matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import csv
+import io
+import itertools
+import os
+import sys
 
-# personal addition for formatting issue
-import re
+import numpy as np
 
-def makePlot(labels, winPct, scores, outputFilename, goodColor="#00FF00", midColor="#FFFF00", badColor="#FF0000"):
+# shared "X -- Y" score parser lives in microservices/scores
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')))
+from scores.scores import parse_cell_block, parse_table
+
+# Leagues with more players than this are drawn as one raster image rather
+# than one polygon per cell; HEATMAP_RENDER_MODE=vector or raster forces a mode
+RASTER_MIN_PLAYERS = 100
+RENDER_MODE = os.environ.get('HEATMAP_RENDER_MODE', 'auto')
+# largest league loadCSV accepts
+MAX_PLAYERS = 5000
+# leagues up to this size have the score written in each cell
+ANNOTATE_MAX_PLAYERS = 10
+# loadCSV parses about this many cells at a time, so the parser's temporary arrays stay in cache
+PARSE_CHUNK_CELLS = 1 << 15
+# at most this many names along each axis; larger leagues label every k-th player
+MAX_TICK_LABELS = 100
+# side of the square raster figure is capped at this many inches (100 pixels each)
+MAX_RASTER_INCHES = 30
+
+def tickPositions(plotSize):
+    step = -(-plotSize // MAX_TICK_LABELS)
+    return list(range(0, plotSize, step))
+
+def makePlot(labels, winPct, scores, outputFilename, goodColor="#00FF00", midColor="#FFFF00", badColor="#FF0000", mode=None):
     plotSize = len(labels)
+    mode = mode or RENDER_MODE
+    raster = mode == 'raster' or (mode == 'auto' and plotSize > RASTER_MIN_PLAYERS)
 
     cmap=ListedColormap([badColor, midColor, goodColor])
     cmap.set_under('gray')
     cmap.set_over('black')
-    fig, ax = plt.subplots()
-
-    plotFontSize = 15 if plotSize < 15 else 250//len(labels)
-    plt.rcParams.update({'font.size': plotFontSize})
-
-    ax.pcolor(winPct, edgecolors='k', cmap=cmap, linewidths=1, vmin=0, vmax=1)
-
-    # UNCOMMENT FOR TEXT IN BOX
-    if plotSize <= 10:
-        for j, row in enumerate(scores):
-            for i, txt in enumerate(row):
-                x_offset = 0.5 - 0.05*(len(txt))*(plotSize/5)
-                ax.annotate(txt, xy=(i+x_offset, j+0.575), fontsize=plotFontSize-3)
-
-    ax.invert_yaxis()
-    xticks = []
-    yticks = []
-    count = 0
-    for _ in labels:
-        xticks.append(count+0.5)
-        yticks.append(count+0.5)
-        count += 1
-    plt.xticks(fontsize = plotFontSize)
-    ax.set(xticks=xticks, xticklabels=labels)
-    ax.set(yticks=yticks, yticklabels=labels)
+
+    shown = tickPositions(plotSize)
+    if raster:
+        # Grow the figure with the league so cells stay at least a few pixels wide
+        side = min(max(6.4, plotSize / 40), MAX_RASTER_INCHES)
+        figsize = (side, side)
+        plotFontSize = max(2, min(15, int(side * 72 * 0.7 / len(shown))))
+    else:
+        figsize = None
+        plotFontSize = 15 if len(shown) < 15 else 250//len(shown)
+
+    # A standalone Agg figure (not registered with pyplot, so nothing keeps it
+    # alive after this call) and rc settings scoped to this render
+    with matplotlib.rc_context({'font.size': plotFontSize}):
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        drawPlot(ax, labels, winPct, scores, cmap, shown, plotSize, plotFontSize, raster)
+        fig.savefig(outputFilename, bbox_inches = 'tight')
+    fig.clear()
+
+def drawPlot(ax, labels, winPct, scores, cmap, shown, plotSize, plotFontSize, raster):
+    if raster:
+        # One image for the whole table; the extent puts cell (row j, column i) on
+        # [i, i+1] x [j, j+1] with the first row on top, as pcolor + invert_yaxis does
+        ax.imshow(winPct, cmap=cmap, vmin=0, vmax=1, interpolation='nearest',
+                  extent=(0, plotSize, plotSize, 0))
+    else:
+        ax.pcolor(winPct, edgecolors='k', cmap=cmap, linewidths=1, vmin=0, vmax=1)
+
+        # UNCOMMENT FOR TEXT IN BOX
+        if plotSize <= ANNOTATE_MAX_PLAYERS:
+            for j, row in enumerate(scores):
+                for i, txt in enumerate(row):
+                    x_offset = 0.5 - 0.05*(len(txt))*(plotSize/5)
+                    ax.annotate(txt, xy=(i+x_offset, j+0.575), fontsize=plotFontSize-3)
+
+        ax.invert_yaxis()
+
+    ticks = [i + 0.5 for i in shown]
+    tickLabels = [labels[i] for i in shown]
+    ax.set(xticks=ticks, xticklabels=tickLabels)
+    ax.set(yticks=ticks, yticklabels=tickLabels)
     ax.tick_params(top=True, labeltop=True, bottom=False, labelbottom=False)
     ax.tick_params(axis=u'both', which=u'both',length=0, labelsize=plotFontSize)
     ax.tick_params(axis='x', labelrotation=90)
@@ -45,73 +93,107 @@ def makePlot(labels, winPct, scores, outputFilename, goodColor="#00FF00", midCol
     # ax.set_ylabel('Opponent')
     # ax.xaxis.set_label_position('top')
 
-    plt.savefig(outputFilename, bbox_inches = 'tight')
-    # plt.show()
-
-def verifyCSV(filename):
-    with open (filename, 'r') as file:
-        csvreader = csv.reader(file)
-        header = next(csvreader)
-        size = len(header)-1
-        if size > 200:
-            return False
-        row_count = 0
-        for row in csvreader:
-            row_count += 1
-            if (len(row)-1 != size):
-                return False
-        if (row_count != size):
-            return False
-    return True
-
-def readCSV(filename):
-    with open (filename, 'r') as file:
-        csvreader = csv.reader(file)
-        players = next(csvreader)[1:]
-        size = len(players)
-        scores = [[] for _ in range(size)]
-        row_count = 0
-        for row in csvreader:
-            scores[row_count] = row[1:]
-            row_count += 1
-    return (players, scores)
-
-# added by myself, helper function to parse scoring for multiple formats
-# i.e. (3 -- 2) vs (3-2)
-def parse_score(score):
-    match = re.match(r'^\s*(\d+)\s*[-–]{1,2}\s*(\d+)\s*$', score)
-    if not match:
-        return 0, 0
-    return int(match.group(1)), int(match.group(2))
-
-# modified to deal with formatting issue
-def analyzeScores(scores):
-    size = len(scores)
-    winPct = [[None for _ in range(size)] for _ in range(size)]
-    gamesPlayed = [[None for _ in range(size)] for _ in range(size)]
-    for j, row in enumerate(scores):
-        for i, score in enumerate(row):
-            wins, losses = parse_score(score)
-            thisGamesPlayed = wins + losses
-            thisWinPct = wins / thisGamesPlayed if thisGamesPlayed > 0 else -1
-            winPct[j][i] = thisWinPct
-            gamesPlayed[j][i] = thisGamesPlayed
-            if i == j:
-                winPct[j][i] = 2
-                gamesPlayed[j][i] = 0
-    return (winPct, gamesPlayed)
-
-def handle_request(inFilename, outFilename, colorString=''):
-    if not verifyCSV(inFilename):
-        return(False, "Error with input file.")
+def loadCSV(source):
+    """
+    Reads, checks and analyzes a CSV (its path, or its contents as bytes) in
+    one pass. Returns (players, winPct, gamesPlayed, scores), or None unless it
+    is a square table of at most MAX_PLAYERS. winPct is float32, with -1 for
+    cells with no games and 2 on the diagonal; gamesPlayed is uint32. scores
+    is the cell text, kept only for leagues small enough to annotate.
+    """
+    if not isinstance(source, (bytes, bytearray)):
+        with open(source, 'rb') as file:
+            source = file.read()
+    try:
+        text = bytes(source).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return None
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    # Quoted fields may hold commas or line breaks, so only they need the csv module
+    quoted = '"' in text
+    if quoted:
+        lines = list(csv.reader(io.StringIO(text)))
+        rowSize = len
     else:
-        (players, scores) = readCSV(inFilename)
-        (winPct, gamesPlayed) = analyzeScores(scores)
-        if colorString == '':
-            makePlot(players, winPct, scores, outFilename)
+        lines = text.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        rowSize = lambda line: line.count(',') + 1
+    if not lines:
+        return None
+
+    header = lines[0] if quoted else lines[0].split(',')
+    players = header[1:]
+    size = len(players)
+    if size > MAX_PLAYERS or len(lines) - 1 != size:
+        return None
+    if any(rowSize(line) - 1 != size for line in lines[1:]):
+        return None
+
+    winPct = np.empty((size, size), dtype=np.float32)
+    gamesPlayed = np.empty((size, size), dtype=np.uint32)
+    if not quoted:
+        # Where each line starts in text, so a block of rows is one slice of it
+        lineStarts = list(itertools.accumulate((len(line) + 1 for line in lines), initial=0))
+    # Parse a block of rows at a time
+    chunkRows = max(1, PARSE_CHUNK_CELLS // max(size, 1))
+    for first in range(0, size, chunkRows):
+        rows = lines[1 + first:1 + first + chunkRows]
+        if quoted:
+            wins, losses, _ = parse_table([row[1:] for row in rows])
         else:
-            goodColor = colorString[:7]
-            midColor = colorString[8:15]
-            badColor = colorString[16:23]
-            makePlot(players, winPct, scores, outFilename, goodColor, midColor, badColor)
-        return(True, "See OutputChart.png for plotted data.")
\ No newline at end of file
+            # The name column is parsed along with the cells and dropped afterwards
+            block = text[lineStarts[1 + first]:lineStarts[1 + first + len(rows)] - 1]
+            wins, losses, _ = parse_cell_block(block)
+            wins, losses = wins.reshape(-1, size + 1)[:, 1:], losses.reshape(-1, size + 1)[:, 1:]
+        games = wins.astype(np.int64) + losses
+        gamesPlayed[first:first + len(rows)] = games
+        winPct[first:first + len(rows)] = np.divide(wins, games, out=np.full(games.shape, -1.0), where=games > 0)
+    np.fill_diagonal(winPct, 2)
+    np.fill_diagonal(gamesPlayed, 0)
+
+    scores = None
+    if size <= ANNOTATE_MAX_PLAYERS:
+        scores = [row[1:] if quoted else row.split(',')[1:] for row in lines[1:]]
+    return (players, winPct, gamesPlayed, scores)
+
+def handle_request(inFilename, outFilename, colorString='', mode=None):
+    loaded = loadCSV(inFilename)
+    if loaded is None:
+        return(False, "Error with input file.")
+    else:
+        (players, winPct, gamesPlayed, scores) = loaded
+        (goodColor, midColor, badColor) = parseColors(colorString)
+        makePlot(players, winPct, scores, outFilename, goodColor, midColor, badColor, mode)
+        return(True, "See OutputChart.png for plotted data.")
+
+def parseColors(colorString):
+    """
+    (good, mid, bad) colors from a "#RRGGBB #RRGGBB #RRGGBB" color string, or the defaults if it is empty.
+    """
+    if colorString == '':
+        return ("#00FF00", "#FFFF00", "#FF0000")
+    return (colorString[:7], colorString[8:15], colorString[16:23])
+
+def render(inFilename, colorString='', mode=None):
+    """
+    handle_request into an in-memory PNG, for the generator server's worker processes.
+    inFilename may also be the CSV's contents as bytes.
+    Returns (True, png bytes) or (False, error message).
+    """
+    output = io.BytesIO()
+    result = handle_request(inFilename, output, colorString, mode)
+    if not result[0]:
+        return result
+    return (True, output.getvalue())
+
+def warm_up():
+    """
+    Draws a throwaway two-player heatmap in both modes, so that the first
+    real request does not pay for loading matplotlib's fonts and caches.
+    """
+    winPct = np.array([[2.0, 1.0], [0.0, 2.0]])
+    scores = [['-', '1 -- 0'], ['0 -- 1', '-']]
+    for mode in ('vector', 'raster'):
+        makePlot(['A', 'B'], winPct, scores, io.BytesIO(), mode=mode)
@@ -1,67 +1,314 @@
 import socket
 import os
+import hashlib
+import json
 import Heatmap_Generator
+import Heatmap_Protocol
+import Heatmap_UploadStore
+import Heatmap_RenderCache
+import Heatmap_RenderWorkers
+import Heatmap_Tiles
+import threading
 import time
+from collections import OrderedDict
 
 PORT = 5556
 SEPARATOR = "<SEPERATOR>"
 BUFFER_SIZE = 4096
 MESSAGE_SIZE = 1024
+# a third header field asking the server to keep the connection open for further requests
+KEEP_ALIVE = "keep-alive"
+# seconds a kept-alive connection may sit idle before the server closes it
+IDLE_TIMEOUT = 300
+
+# Rendering is CPU-bound matplotlib work, so it runs in a pool of worker
+# processes (see Heatmap_RenderWorkers.py), each drawing into its own
+# in-memory PNG. Connections are still served by one thread each; at most
+# WORKERS + QUEUE_SIZE renders are accepted at a time and further requests
+# get a '03' busy reply at once.
+WORKERS = int(os.environ.get('HEATMAP_WORKERS', os.cpu_count() or 1))
+QUEUE_SIZE = int(os.environ.get('HEATMAP_QUEUE_SIZE', 2 * WORKERS))
+
+# Uploads used by a request are remembered (most recent first, up to
+# RECENT_INPUT_BYTES), so the same league can be asked for again in other
+# colors without uploading it again
+RECENT_INPUT_BYTES = int(os.environ.get('HEATMAP_RECENT_INPUT_BYTES', 64 * 1024 * 1024))
+recent_inputs = OrderedDict()
+recent_inputs_lock = threading.Lock()
 
 def pad_string(text, length=MESSAGE_SIZE, char=' '):
     return text.ljust(length, char)
 
-def send_file(socket, fileToSend):
-    fileSize = os.path.getsize(fileToSend)
-    message = fileToSend + SEPARATOR + str(fileSize)
+def recv_exact(socket, size):
+    """
+    Reads exactly `size` bytes. Returns None if the peer closed the connection
+    before sending anything, and raises ConnectionError if it closed part way.
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = socket.recv(size - len(data))
+        if not chunk:
+            if not data:
+                return None
+            raise ConnectionError(f"Connection closed after {len(data)} of {size} bytes")
+        data += chunk
+    return bytes(data)
+
+def send_file(socket, fileToSend, data):
+    message = fileToSend + SEPARATOR + str(len(data))
     message = pad_string(message)
-    socket.send(message.encode())
+    socket.sendall(message.encode())
+    # we use sendall to assure transimission in busy networks
+    socket.sendall(data)
 
-    with open(fileToSend, "rb") as f:
-        while True:
-            # read the bytes from the file
-            bytes_read = f.read(BUFFER_SIZE)
-            if not bytes_read:
-                # file transmitting is done
-                break
-            # we use sendall to assure transimission in busy networks
-            socket.sendall(bytes_read)
+def read_input(filename):
+    """
+    The uploaded CSV's bytes, or those of a recently used upload of that name. None if neither exists.
+    """
+    try:
+        with open(Heatmap_UploadStore.name_path(filename), "rb") as f:
+            return f.read()
+    except (OSError, ValueError):
+        pass
+    with recent_inputs_lock:
+        return recent_inputs.get(filename)
 
-s = socket.socket()
-s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-print("I'm the server. Socket created.")
+def remember_input(filename, csv_data):
+    """
+    Keeps a CSV's contents in recent_inputs, so it can be asked for again by name.
+    """
+    with recent_inputs_lock:
+        recent_inputs.pop(filename, None)
+        if len(csv_data) > RECENT_INPUT_BYTES:
+            return
+        recent_inputs[filename] = csv_data
+        total = sum(len(data) for data in recent_inputs.values())
+        while total > RECENT_INPUT_BYTES:
+            _, evicted = recent_inputs.popitem(last=False)
+            total -= len(evicted)
 
-s.bind(('', PORT))
-print("Socket bound to %s" %(PORT))
+def finish_input(filename, csv_data):
+    """
+    Removes a used upload's name, keeping its contents in recent_inputs
+    instead. The stored contents stay until the upload store's TTL sweep,
+    so uploading them again is only a hash lookup.
+    """
+    try:
+        os.remove(Heatmap_UploadStore.name_path(filename))
+    except (OSError, ValueError):
+        pass
+    remember_input(filename, csv_data)
 
-s.listen(5)
-print("Socket listening")
+def make_heatmap(name, csv_data, requestColorString):
+    """
+    Renders the heatmap for a CSV's bytes, or finds it in the render cache.
+    Returns the status reply ("00 ...", "02 ..." or "03 ...") and the PNG, or None if there is none.
+    """
+    key = Heatmap_RenderCache.make_key(csv_data, Heatmap_Generator.parseColors(requestColorString),
+                                       {'mode': Heatmap_Generator.RENDER_MODE})
+    image = Heatmap_RenderCache.get(key)
+    if image is not None:
+        print(f"Served {name} from the render cache")
+        return '00 Created heatmap (cached).', image
 
-while True:
-    client_socket, addr = s.accept()
+    if not render_slots.acquire(blocking=False):
+        return '03 Heatmap server is busy, try again later.', None
     try:
-        received = client_socket.recv(MESSAGE_SIZE).decode()
-        requestedInputFilename, requestColorString = received.split(SEPARATOR)
-        requestColorString = requestColorString.strip()
+        result, stats = pool.render(csv_data, requestColorString)
+    finally:
+        render_slots.release()
+    rss_mb = stats.get('rss_bytes', 0) / (1024 * 1024)
+    print(f"Rendered {name} in {stats.get('render_ms')} ms on worker {stats['pid']} (RSS {rss_mb:.0f} MB)")
 
-        print(f"Trying to make a heatmap for {requestedInputFilename}")
+    if result[0]:
+        Heatmap_RenderCache.put(key, result[1])
+        return f"00 Created heatmap in {stats['render_ms']} ms (worker RSS {rss_mb:.0f} MB).", result[1]
+    return '02 Could not create heatmap: Error: ' + result[1], None
+
+def make_pyramid(name, csv_data):
+    """
+    Builds the tile pyramid of a CSV's bytes, or finds it already built.
+    Returns the status reply and the pyramid's metadata as JSON, or None if there is none.
+    """
+    digest = hashlib.sha256(csv_data).hexdigest()
+    meta = Heatmap_Tiles.load_meta(digest)
+    if meta is not None:
+        print(f"Found the tile pyramid of {name} already built")
+        return '00 Tile pyramid ready (cached).', json.dumps(meta).encode()
+
+    # Building shares the render slots and workers: it is the same loadCSV work as a render
+    if not render_slots.acquire(blocking=False):
+        return '03 Heatmap server is busy, try again later.', None
+    try:
+        result, stats = pool.call(Heatmap_Tiles.build, csv_data, digest)
+    finally:
+        render_slots.release()
+    print(f"Built the tile pyramid of {name} in {stats.get('render_ms')} ms on worker {stats['pid']}")
+
+    if result[0]:
+        return f"00 Built {result[1]['levels']} tile levels in {stats['render_ms']} ms.", json.dumps(result[1]).encode()
+    return '02 Could not create tile pyramid: Error: ' + result[1], None
+
+def make_tile(digest, level, x, y, requestColorString):
+    """
+    Draws one tile of a built pyramid, or finds it in the render cache.
+    Tiles are small, so they are drawn on the connection's thread.
+    Returns the status reply ("04 ..." for a tile outside the pyramid) and the PNG, or None if there is none.
+    """
+    key = Heatmap_RenderCache.make_key(digest.encode(), Heatmap_Generator.parseColors(requestColorString),
+                                       {'tile': [level, x, y], 'tile_size': Heatmap_Tiles.TILE_SIZE})
+    image = Heatmap_RenderCache.get(key)
+    if image is not None:
+        return '00 Created tile (cached).', image
+
+    try:
+        image = Heatmap_Tiles.render_tile(digest, level, x, y, requestColorString)
+    except ValueError as e:
+        return f'04 {e}', None
+    if image is None:
+        return '01 I do not have this heatmap.', None
+    Heatmap_RenderCache.put(key, image)
+    return '00 Created tile.', image
+
+def handle_request(client_socket, requestedInputFilename, requestColorString):
+    print(f"Trying to make a heatmap for {requestedInputFilename}")
 
-        if os.path.exists(requestedInputFilename):
-            result = Heatmap_Generator.handle_request(requestedInputFilename, "Output.png", requestColorString)
-            if result[0]:
-                client_socket.send(pad_string('00 Created heatmap.').encode())
-                send_file(client_socket, "Output.png")
-            else:
-                reply = '02 Could not create heatmap: Error: ' + result[1]
-                client_socket.send(pad_string(reply).encode())
-
-            # Delete local files
-            os.remove(requestedInputFilename)
-            os.remove("Output.png")
+    csv_data = read_input(requestedInputFilename)
+    if csv_data is None:
+        client_socket.sendall(pad_string('01 I do not have this file.').encode())
+        return
+
+    reply, image = make_heatmap(requestedInputFilename, csv_data, requestColorString)
+    # a busy server keeps the upload, so the same request can be sent again
+    if not reply.startswith('03'):
+        finish_input(requestedInputFilename, csv_data)
+
+    client_socket.sendall(pad_string(reply).encode())
+    if image is not None:
+        send_file(client_socket, "Output.png", image)
+
+def handle_frame(client_socket, start):
+    """
+    Answers one binary-framed request (see Heatmap_Protocol.py): a heatmap
+    of an uploaded file or of the CSV sent in the frame's body, a tile
+    pyramid, or one of its tiles. Returns whether the connection can serve
+    another request.
+    """
+    try:
+        op, header, body_size = Heatmap_Protocol.read(client_socket, start, recv_exact)
+        if op not in (Heatmap_Protocol.OP_HEATMAP, Heatmap_Protocol.OP_UPLOAD_HEATMAP,
+                      Heatmap_Protocol.OP_TILE_PYRAMID, Heatmap_Protocol.OP_TILE):
+            raise Heatmap_Protocol.ProtocolError(f"Unsupported operation {op}; uploads are received on port 5555.")
+        if op != Heatmap_Protocol.OP_UPLOAD_HEATMAP and body_size:
+            raise Heatmap_Protocol.ProtocolError("Only a request that uploads a CSV has a body.")
+        Heatmap_UploadStore.check_size(body_size)
+    except ValueError as e:
+        client_socket.sendall(Heatmap_Protocol.reply(f'02 {e}'))
+        return False
+
+    requestColorString = str(header.get('colors', '')).strip()
+    if op == Heatmap_Protocol.OP_TILE:
+        try:
+            reply, body = make_tile(str(header.get('sha256', '')), int(header['level']),
+                                     int(header['x']), int(header['y']), requestColorString)
+        except (KeyError, TypeError, ValueError) as e:
+            reply, body = f'04 Invalid tile request: {e!r}', None
+    elif op == Heatmap_Protocol.OP_TILE_PYRAMID:
+        requestedInputFilename = str(header.get('name', ''))
+        digest = str(header.get('sha256', ''))
+        print(f"Trying to make a tile pyramid for {requestedInputFilename or digest}")
+        csv_data = None
+        if requestedInputFilename:
+            csv_data = read_input(requestedInputFilename)
+        elif Heatmap_UploadStore.is_digest(digest):
+            # contents still in the upload store, e.g. to rebuild a pyramid the sweep deleted
+            try:
+                with open(Heatmap_UploadStore.object_path(digest), 'rb') as f:
+                    csv_data = f.read()
+            except OSError:
+                pass
+        if csv_data is None:
+            reply, body = '01 I do not have this file.', None
         else:
-            client_socket.send(pad_string('01 I do not have this file.').encode())
+            reply, body = make_pyramid(requestedInputFilename or digest, csv_data)
+            if requestedInputFilename and not reply.startswith('03'):
+                finish_input(requestedInputFilename, csv_data)
+    elif op == Heatmap_Protocol.OP_HEATMAP:
+        requestedInputFilename = str(header.get('name', ''))
+        print(f"Trying to make a heatmap for {requestedInputFilename}")
+        csv_data = read_input(requestedInputFilename)
+        if csv_data is None:
+            client_socket.sendall(Heatmap_Protocol.reply('01 I do not have this file.'))
+            return True
+        reply, body = make_heatmap(requestedInputFilename, csv_data, requestColorString)
+        if not reply.startswith('03'):
+            finish_input(requestedInputFilename, csv_data)
+    else:
+        # The upload and the request in one round trip; the CSV never touches the disk
+        requestedInputFilename = os.path.basename(str(header.get('name', '')))
+        csv_data = recv_exact(client_socket, body_size) if body_size else b''
+        if csv_data is None:
+            raise ConnectionError("Connection closed before the CSV was sent")
+        label = requestedInputFilename or 'an inline CSV'
+        print(f"Trying to make a heatmap for {label}")
+        reply, body = make_heatmap(label, csv_data, requestColorString)
+        if requestedInputFilename:
+            remember_input(requestedInputFilename, csv_data)
+
+    client_socket.sendall(Heatmap_Protocol.reply(reply, len(body) if body is not None else 0))
+    if body is not None:
+        client_socket.sendall(body)
+    return True
+
+def handle_connection(client_socket, addr):
+    # Serve requests until the client closes the connection or stops asking to keep it open
+    try:
+        client_socket.settimeout(IDLE_TIMEOUT)
+        # replies are several small writes; don't let Nagle hold them back for the client's delayed ACK
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            # the first bytes tell a binary frame from a 1024-byte text header
+            start = recv_exact(client_socket, len(Heatmap_Protocol.MAGIC))
+            if start is None:
+                break
+            if start == Heatmap_Protocol.MAGIC:
+                if not handle_frame(client_socket, start):
+                    break
+                continue
+
+            rest = recv_exact(client_socket, MESSAGE_SIZE - len(start))
+            if rest is None:
+                raise ConnectionError("Connection closed in the middle of a header")
+            fields = (start + rest).decode().split(SEPARATOR)
+            requestedInputFilename, requestColorString = fields[0], fields[1].strip()
+            keep_alive = len(fields) > 2 and fields[2].strip() == KEEP_ALIVE
 
+            handle_request(client_socket, requestedInputFilename, requestColorString)
+            if not keep_alive:
+                break
+    except (OSError, ValueError, IndexError) as e:
+        print(f"Dropped connection from {addr}: {e}")
     finally:
         client_socket.close()
 
-s.close()
\ No newline at end of file
+if __name__ == '__main__':
+    pool = Heatmap_RenderWorkers.RenderPool(WORKERS)
+    render_slots = threading.BoundedSemaphore(WORKERS + QUEUE_SIZE)
+    Heatmap_UploadStore.start_sweeper(Heatmap_Tiles.PYRAMID_TTL, Heatmap_Tiles.sweep)
+
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    print("I'm the server. Socket created.")
+
+    s.bind(('', PORT))
+    print("Socket bound to %s" %(PORT))
+
+    s.listen(64)
+    print(f"Socket listening, rendering with {WORKERS} worker processes")
+
+    while True:
+        client_socket, addr = s.accept()
+        # One thread per connection, so an idle kept-alive connection does not hold up the others
+        threading.Thread(target=handle_connection, args=(client_socket, addr), daemon=True).start()
+
+    s.close()
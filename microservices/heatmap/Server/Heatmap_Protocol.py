@@ -0,0 +1,73 @@
+import json
+import struct
+
+# Binary framing, accepted by both servers next to the 1024-byte text
+# headers. Every message is a fixed prefix (MAGIC, version, op, header
+# length, body length), a UTF-8 JSON header and then the body bytes. MAGIC
+# starts with a byte that cannot begin a UTF-8 file name, so the first four
+# bytes of a connection tell the two protocols apart. Binary connections
+# stay open until the client closes them, and every request gets a reply.
+MAGIC = b'\x89HMP'
+VERSION = 1
+PREFIX = struct.Struct('!4sBBIQ')
+# largest JSON header accepted
+MAX_HEADER_SIZE = 64 * 1024
+
+# Requests: OP_UPLOAD stores the body as {"name"} (upload server);
+# OP_HEATMAP renders an uploaded {"name"} in {"colors"} (generator server);
+# OP_UPLOAD_HEATMAP renders the CSV in the body at once (generator server);
+# OP_TILE_PYRAMID builds the tile pyramid of an uploaded {"name"} or stored
+# {"sha256"}, replying with its JSON metadata as the body, and OP_TILE draws
+# tile {"x"}, {"y"} of a pyramid's {"level"} in {"colors"} (generator server)
+OP_UPLOAD = 1
+OP_HEATMAP = 2
+OP_UPLOAD_HEATMAP = 3
+OP_TILE_PYRAMID = 4
+OP_TILE = 5
+# Replies: {"status": "00", "message": ...}, with the PNG as the body of a successful heatmap
+OP_REPLY = 0x80
+
+class ProtocolError(ValueError):
+    """
+    A frame this server cannot read; it is answered with a '02' reply and the connection closed.
+    """
+
+def pack(op, header, body_size=0):
+    """
+    The prefix and header of a frame whose body of `body_size` bytes follows.
+    """
+    header = json.dumps(header).encode()
+    return PREFIX.pack(MAGIC, VERSION, op, len(header), body_size) + header
+
+def reply(text, body_size=0):
+    """
+    A reply frame for a status line such as "00 Created heatmap.".
+    """
+    return pack(OP_REPLY, {'status': text[:2], 'message': text[3:]}, body_size)
+
+def read(socket, start, recv_exact):
+    """
+    Reads the rest of a frame after its first bytes `start` (the magic) with
+    the server's recv_exact. Returns (op, header dict, body size); the body
+    is left for the caller to read.
+    """
+    def receive(size):
+        data = recv_exact(socket, size)
+        if data is None:
+            raise ConnectionError("Connection closed in the middle of a frame")
+        return data
+
+    magic, version, op, header_size, body_size = PREFIX.unpack(start + receive(PREFIX.size - len(start)))
+    if magic != MAGIC:
+        raise ProtocolError("Not a heatmap protocol frame.")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}.")
+    if header_size > MAX_HEADER_SIZE:
+        raise ProtocolError(f"Frame header of {header_size} bytes is too large.")
+    try:
+        header = json.loads(receive(header_size) or b'{}')
+    except ValueError:
+        raise ProtocolError("Frame header is not valid JSON.")
+    if not isinstance(header, dict):
+        raise ProtocolError("Frame header is not a JSON object.")
+    return op, header, body_size
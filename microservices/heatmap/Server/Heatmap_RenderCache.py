@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import sys
+
+# the two-tier cache shared with the ranking service lives in microservices/caching
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')))
+from caching.byte_cache import ByteCache
+
+# Content-addressed cache of finished heatmap PNGs. Keys are sha256 digests
+# of the CSV's bytes together with the normalized colors and every render
+# option, so asking again for the same league in a color scheme that was
+# already drawn is answered without a render. Images are kept
+# least-recently-used in memory up to MAX_CACHE_BYTES; if HEATMAP_CACHE_DIR
+# is set they are also written there, one file per key, which survives
+# restarts and is trimmed oldest-first to MAX_DISK_BYTES.
+MAX_CACHE_BYTES = int(os.environ.get('HEATMAP_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+CACHE_DIR = os.environ.get('HEATMAP_CACHE_DIR') or None
+MAX_DISK_BYTES = int(os.environ.get('HEATMAP_CACHE_MAX_DISK_BYTES', 1024 * 1024 * 1024))
+
+_cache = ByteCache(MAX_CACHE_BYTES, CACHE_DIR, MAX_DISK_BYTES, suffix='.png')
+
+def make_key(csv_data, colors, options):
+    """
+    Digest of the CSV's bytes, its (good, mid, bad) colors and a dict of render options.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'csv:{len(csv_data)};'.encode())
+    digest.update(csv_data)
+    digest.update(json.dumps([[color.upper() for color in colors], options], sort_keys=True).encode())
+    return digest.hexdigest()
+
+def get(key):
+    """
+    Returns the cached PNG for a key, or None on a miss.
+    """
+    return _cache.get(key)
+
+def put(key, image):
+    """
+    Caches a rendered PNG under a key, in memory and on disk.
+    """
+    _cache.put(key, image)
+
+def stats():
+    """
+    Hit/miss counters and the current size of each tier.
+    """
+    return _cache.stats()
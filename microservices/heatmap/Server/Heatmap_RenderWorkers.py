@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+import queue
+import resource
+import time
+
+import Heatmap_Generator
+
+# Long-lived rendering processes for the generator server. Each worker
+# imports matplotlib and draws a warm-up heatmap once at start, then serves
+# renders (and other CPU-bound jobs, such as building tile pyramids) over
+# its own pipe. A worker retires itself after MAX_RENDERS
+# renders or once its resident memory passes MAX_RSS_BYTES, and the pool
+# starts (and warms) a replacement in the background, so slow growth in
+# matplotlib's caches never accumulates for the life of the server.
+MAX_RENDERS = int(os.environ.get('HEATMAP_WORKER_MAX_RENDERS', 200))
+MAX_RSS_BYTES = int(os.environ.get('HEATMAP_WORKER_MAX_RSS_MB', 1024)) * 1024 * 1024
+
+def current_rss():
+    """
+    Resident set size of this process in bytes (peak RSS where /proc is unavailable).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _worker_main(conn, max_renders, max_rss):
+    Heatmap_Generator.warm_up()
+    renders = 0
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        function, args = job
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+        except Exception as e:
+            result = (False, f"{type(e).__name__}: {e}")
+        renders += 1
+        rss = current_rss()
+        stats = {
+            'pid': os.getpid(),
+            'render_ms': round((time.perf_counter() - start) * 1000, 1),
+            'rss_bytes': rss,
+            'renders': renders,
+        }
+        retire = renders >= max_renders or rss > max_rss
+        conn.send((result, stats, retire))
+        if retire:
+            break
+    conn.close()
+
+class RenderPool:
+    """
+    A fixed number of render workers; render() blocks until one is free.
+    """
+    def __init__(self, workers, max_renders=MAX_RENDERS, max_rss=MAX_RSS_BYTES):
+        # spawn, not fork: the workers must not inherit the server's connection threads
+        self._context = multiprocessing.get_context('spawn')
+        self.max_renders = max_renders
+        self.max_rss = max_rss
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(self._start_worker())
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn, self.max_renders, self.max_rss), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def render(self, inFilename, colorString=''):
+        """
+        Renders a heatmap (from a CSV path or the CSV's bytes) in a worker.
+        Returns ((ok, png bytes or error message), stats).
+        """
+        return self.call(Heatmap_Generator.render, inFilename, colorString)
+
+    def call(self, function, *args):
+        """
+        Runs function(*args) in a worker. The function is sent by reference,
+        so it must be defined at the top level of a module, and return
+        (ok, result or error message). Returns that and the stats.
+        """
+        process, conn = self._idle.get()
+        try:
+            conn.send((function, args))
+            result, stats, retire = conn.recv()
+        except (EOFError, OSError) as e:
+            # The worker died mid-render (e.g. killed for running out of memory)
+            result, stats, retire = (False, f"Render worker exited: {e!r}"), {'pid': process.pid}, True
+
+        if retire:
+            conn.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+            self._idle.put(self._start_worker())
+            print(f"Recycled render worker {process.pid} after {stats.get('renders', '?')} renders")
+        else:
+            self._idle.put((process, conn))
+        return result, stats
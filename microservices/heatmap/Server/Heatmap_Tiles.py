@@ -0,0 +1,181 @@
+import io
+import json
+import math
+import os
+import shutil
+import threading
+import time
+
+import matplotlib.image
+import numpy as np
+from matplotlib.colors import ListedColormap
+
+import Heatmap_Generator
+import Heatmap_UploadStore
+
+# Tiled, multi-resolution heatmaps for leagues too large to read in one
+# image. A league's pyramid is built once from its analyzed matrix
+# (Heatmap_Generator.loadCSV) and kept under TILE_DIR/<sha256 of the CSV>/
+# as one .npy array of win rates per zoom level, which any process can
+# memory-map. The deepest level has one block per cell; each level above
+# halves the resolution by summing the wins and games of 2x2 blocks, so a
+# coarse block shows the combined win rate of all the games it covers. A
+# tile is TILE_BLOCKS x TILE_BLOCKS blocks of one level, drawn BLOCK_PIXELS
+# pixels each in the same colors as the full heatmap; only requested tiles
+# are ever drawn. Pyramids unused for PYRAMID_TTL seconds are deleted by a
+# background sweep.
+TILE_DIR = os.environ.get('HEATMAP_TILE_DIR', 'tiles')
+TILE_BLOCKS = 64
+BLOCK_PIXELS = 4
+TILE_SIZE = TILE_BLOCKS * BLOCK_PIXELS
+PYRAMID_TTL = float(os.environ.get('HEATMAP_TILE_TTL', 3600))
+# rows of the full matrix merged at a time when building the first coarse level
+BUILD_CHUNK_ROWS = 512
+
+os.makedirs(TILE_DIR, exist_ok=True)
+
+def level_count(size):
+    """
+    Zoom levels of a league of `size` players: level 0 fits it in one tile.
+    """
+    return 1 + max(0, math.ceil(math.log2(max(size, 1) / TILE_BLOCKS)))
+
+def pyramid_path(digest):
+    if not Heatmap_UploadStore.is_digest(digest):
+        raise ValueError("Invalid heatmap id.")
+    return os.path.join(TILE_DIR, digest)
+
+def _level_path(directory, level):
+    return os.path.join(directory, f'level_{level}.npy')
+
+def _sum_blocks(a):
+    """
+    Sums each 2x2 block of a 2D array, padding an odd side with zeros.
+    """
+    rows, cols = a.shape
+    if rows % 2 or cols % 2:
+        a = np.pad(a, ((0, rows % 2), (0, cols % 2)))
+    return a.reshape(a.shape[0] // 2, 2, a.shape[1] // 2, 2).sum(axis=(1, 3))
+
+def _win_rates(wins, games):
+    return np.divide(wins, games, out=np.full(games.shape, -1.0), where=games > 0).astype(np.float32)
+
+def build(csv_data, digest):
+    """
+    Builds the tile pyramid of a CSV's bytes under its sha256 `digest`, for
+    the generator server's worker processes. Returns (True, metadata) or
+    (False, error message).
+    """
+    loaded = Heatmap_Generator.loadCSV(csv_data)
+    if loaded is None:
+        return (False, "Error with input file.")
+    (players, winPct, gamesPlayed, _) = loaded
+    size = len(players)
+    levels = level_count(size)
+    meta = {
+        'sha256': digest,
+        'players': players,
+        'size': size,
+        'levels': levels,
+        'tile_size': TILE_SIZE,
+        'tile_blocks': TILE_BLOCKS,
+    }
+
+    # Written to a temporary directory and renamed, so a pyramid is only ever seen complete
+    directory = pyramid_path(digest)
+    temp_dir = f'{directory}.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(temp_dir)
+    try:
+        # The deepest level is the heatmap's own matrix: -1 without games, 2 on the diagonal
+        np.save(_level_path(temp_dir, levels - 1), winPct)
+        if levels > 1:
+            # Wins back from the win rates, a few rows at a time to bound the float64 copies
+            merged = []
+            for first in range(0, size, BUILD_CHUNK_ROWS):
+                games = gamesPlayed[first:first + BUILD_CHUNK_ROWS].astype(np.float64)
+                wins = np.where(games > 0, np.rint(winPct[first:first + BUILD_CHUNK_ROWS] * games), 0)
+                merged.append((_sum_blocks(wins), _sum_blocks(games)))
+            wins = np.concatenate([w for w, _ in merged])
+            games = np.concatenate([g for _, g in merged])
+            del merged
+            for level in range(levels - 2, -1, -1):
+                np.save(_level_path(temp_dir, level), _win_rates(wins, games))
+                if level:
+                    wins, games = _sum_blocks(wins), _sum_blocks(games)
+        with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_dir, directory)
+    except OSError:
+        # Another worker finished the same pyramid first
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            raise
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return (True, meta)
+
+def load_meta(digest):
+    """
+    A built pyramid's metadata, or None if there is none. Marks it as used for the TTL sweep.
+    """
+    path = os.path.join(pyramid_path(digest), 'meta.json')
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return meta
+
+def tile_grid(meta, level):
+    """
+    Tiles along each side at a zoom level.
+    """
+    blocks = -(-meta['size'] // 2 ** (meta['levels'] - 1 - level))
+    return -(-blocks // TILE_BLOCKS)
+
+def render_tile(digest, level, x, y, colorString=''):
+    """
+    Draws tile (x, y) (column, row) of a zoom level as PNG bytes. Blocks
+    past the edge of the league are transparent. Returns None if the
+    pyramid is not built; raises ValueError for a tile outside it.
+    """
+    meta = load_meta(digest)
+    if meta is None:
+        return None
+    if not 0 <= level < meta['levels']:
+        raise ValueError(f"Level {level} is outside 0-{meta['levels'] - 1}.")
+    grid = tile_grid(meta, level)
+    if not (0 <= x < grid and 0 <= y < grid):
+        raise ValueError(f"Tile ({x}, {y}) is outside the {grid}x{grid} tiles of level {level}.")
+
+    rates = np.load(_level_path(pyramid_path(digest), level), mmap_mode='r')
+    block = np.asarray(rates[y * TILE_BLOCKS:(y + 1) * TILE_BLOCKS, x * TILE_BLOCKS:(x + 1) * TILE_BLOCKS])
+
+    (goodColor, midColor, badColor) = Heatmap_Generator.parseColors(colorString)
+    cmap = ListedColormap([badColor, midColor, goodColor])
+    cmap.set_under('gray')
+    cmap.set_over('black')
+    rgba = np.zeros((TILE_BLOCKS, TILE_BLOCKS, 4), dtype=np.uint8)
+    rgba[:block.shape[0], :block.shape[1]] = cmap(block, bytes=True)
+    rgba = rgba.repeat(BLOCK_PIXELS, axis=0).repeat(BLOCK_PIXELS, axis=1)
+
+    output = io.BytesIO()
+    matplotlib.image.imsave(output, rgba, format='png')
+    return output.getvalue()
+
+def sweep(ttl=PYRAMID_TTL):
+    """
+    Deletes pyramids not used for `ttl` seconds, and builds left unfinished.
+    """
+    cutoff = time.time() - ttl
+    for entry in os.scandir(TILE_DIR):
+        try:
+            if entry.name.endswith('.tmp'):
+                stale = entry.stat().st_mtime < cutoff
+            else:
+                stale = os.stat(os.path.join(entry.path, 'meta.json')).st_mtime < cutoff
+        except OSError:
+            stale = True
+        if stale:
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import time
+
+# Content-addressed storage for uploaded CSVs, shared by both servers. Each
+# upload is written to a temporary file while it is hashed, then kept once
+# as objects/<sha256>.csv however many times (and under however many names)
+# it is uploaded. names/<file name> is a symlink to the object, replaced
+# atomically, so concurrent uploads under one name never see each other's
+# partial writes. Objects and names unused for UPLOAD_TTL seconds are
+# deleted by a background sweep.
+UPLOAD_DIR = os.environ.get('HEATMAP_UPLOAD_DIR', 'uploads')
+OBJECT_DIR = os.path.join(UPLOAD_DIR, 'objects')
+NAME_DIR = os.path.join(UPLOAD_DIR, 'names')
+MAX_UPLOAD_BYTES = int(os.environ.get('HEATMAP_MAX_UPLOAD_MB', 256)) * 1024 * 1024
+UPLOAD_TTL = float(os.environ.get('HEATMAP_UPLOAD_TTL', 3600))
+# bytes read from the socket at a time
+RECEIVE_BUFFER_SIZE = 64 * 1024
+
+os.makedirs(OBJECT_DIR, exist_ok=True)
+os.makedirs(NAME_DIR, exist_ok=True)
+
+class UploadTooLarge(ValueError):
+    """
+    An announced upload is larger than MAX_UPLOAD_BYTES.
+    """
+
+def check_size(size):
+    if size < 0:
+        raise ValueError(f"Invalid file size {size}.")
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(f"File of {size} bytes is larger than the {MAX_UPLOAD_BYTES} bytes allowed.")
+
+def name_path(name):
+    # remove absolute path if there is
+    name = os.path.basename(name)
+    if not name:
+        raise ValueError("Missing file name.")
+    if name in ('.', '..'):
+        raise ValueError(f"Invalid file name {name!r}.")
+    return os.path.join(NAME_DIR, name)
+
+def is_digest(digest):
+    return len(digest) == 64 and all(c in '0123456789abcdef' for c in digest)
+
+def object_path(digest):
+    return os.path.join(OBJECT_DIR, f'{digest}.csv')
+
+def receive(socket, name, size):
+    """
+    Reads exactly `size` bytes of a file from the socket into the store and
+    links `name` to them. Returns (stored name, sha256 hex digest, whether
+    the same contents were already stored).
+    """
+    check_size(size)
+    name_path(name) # reject a missing name before reading the file
+    digest = hashlib.sha256()
+    temp_path = os.path.join(OBJECT_DIR, f'.{threading.get_ident()}.{time.monotonic_ns()}.tmp')
+    try:
+        with open(temp_path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                bytes_read = socket.recv(min(remaining, RECEIVE_BUFFER_SIZE))
+                if not bytes_read:
+                    raise ConnectionError(f"Connection closed after {size - remaining} of {size} bytes of {name}")
+                digest.update(bytes_read)
+                f.write(bytes_read)
+                remaining -= len(bytes_read)
+
+        digest = digest.hexdigest()
+        try:
+            # already stored: only refresh it for the TTL sweep
+            os.utime(object_path(digest))
+            duplicate = True
+            os.remove(temp_path)
+        except FileNotFoundError:
+            duplicate = False
+            os.replace(temp_path, object_path(digest))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    link(name, digest)
+    return os.path.basename(name), digest, duplicate
+
+def link(name, digest):
+    """
+    Points `name` at already stored contents. Returns False if no upload with that digest is stored.
+    """
+    if not is_digest(digest):
+        return False
+    try:
+        # a use counts as fresh for the TTL sweep
+        os.utime(object_path(digest))
+    except OSError:
+        return False
+
+    path = name_path(name)
+    # unique, so a link left behind by a crash never blocks the next one
+    temp_path = os.path.join(NAME_DIR, f'.{threading.get_ident()}.{time.monotonic_ns()}.tmp')
+    os.symlink(os.path.join('..', 'objects', f'{digest}.csv'), temp_path)
+    try:
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return True
+
+def sweep(ttl=UPLOAD_TTL):
+    """
+    Deletes objects and names not used for `ttl` seconds, and names whose object is gone.
+    """
+    cutoff = time.time() - ttl
+    for entry in os.scandir(OBJECT_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            continue
+    for entry in os.scandir(NAME_DIR):
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime < cutoff or not os.path.exists(entry.path):
+                os.remove(entry.path)
+        except OSError:
+            continue
+
+def start_sweeper(ttl=UPLOAD_TTL, sweep=sweep):
+    """
+    Runs sweep(ttl) in a daemon thread every quarter TTL, or every minute if
+    that is sooner. Also sweeps Heatmap_Tiles' pyramids, given its sweep.
+    """
+    def run():
+        while True:
+            time.sleep(min(ttl / 4, 60))
+            sweep(ttl)
+
+    threading.Thread(target=run, daemon=True).start()
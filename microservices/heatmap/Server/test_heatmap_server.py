@@ -0,0 +1,128 @@
+import hashlib
+import os
+import socket
+import struct
+import tempfile
+import threading
+
+import pytest
+
+# Uploads and tile pyramids go to a scratch directory, not the working directory
+scratch_dir = tempfile.mkdtemp(prefix='heatmap_test_')
+os.environ.setdefault('HEATMAP_UPLOAD_DIR', os.path.join(scratch_dir, 'uploads'))
+os.environ.setdefault('HEATMAP_TILE_DIR', os.path.join(scratch_dir, 'tiles'))
+
+import Heatmap_GeneratorServer as server
+import Heatmap_Protocol
+import Heatmap_Tiles
+
+def league_csv(size, seed=0):
+    names = [f'Player {i}' for i in range(size)]
+    lines = [','.join([''] + names)]
+    for i in range(size):
+        cells = ['X' if i == j else f'{(i * 7 + j + seed) % 5} -- {(j * 7 + i + seed) % 5}' for j in range(size)]
+        lines.append(','.join([names[i]] + cells))
+    return ('\n'.join(lines) + '\n').encode()
+
+def ask(op, header, body=b''):
+    """
+    Sends one binary frame to handle_connection over a local TCP connection.
+    Returns the reply's (header, body).
+    """
+    listener = socket.create_server(('127.0.0.1', 0))
+    client = socket.create_connection(listener.getsockname())
+    connection, addr = listener.accept()
+    listener.close()
+    thread = threading.Thread(target=server.handle_connection, args=(connection, addr))
+    thread.start()
+    try:
+        client.sendall(Heatmap_Protocol.pack(op, header, len(body)) + body)
+        start = server.recv_exact(client, len(Heatmap_Protocol.MAGIC))
+        reply_op, reply_header, body_size = Heatmap_Protocol.read(client, start, server.recv_exact)
+        assert reply_op == Heatmap_Protocol.OP_REPLY
+        return reply_header, server.recv_exact(client, body_size) if body_size else b''
+    finally:
+        client.close()
+        thread.join(timeout=10)
+
+@pytest.fixture
+def busy(monkeypatch):
+    # Every render slot taken, and no workers to reach
+    monkeypatch.setattr(server, 'render_slots', threading.Semaphore(0), raising=False)
+    monkeypatch.setattr(server, 'pool', None, raising=False)
+
+def test_busy_server_replies_03_to_an_inline_csv(busy):
+    header, body = ask(Heatmap_Protocol.OP_UPLOAD_HEATMAP, {'name': 'busy_inline.csv'}, league_csv(5, seed=1))
+    assert header['status'] == '03'
+    assert body == b''
+
+def test_busy_server_keeps_the_upload_for_a_retry(busy):
+    csv_data = league_csv(5, seed=2)
+    server.remember_input('busy_upload.csv', csv_data)
+    header, _ = ask(Heatmap_Protocol.OP_HEATMAP, {'name': 'busy_upload.csv'})
+    assert header['status'] == '03'
+    assert server.read_input('busy_upload.csv') == csv_data
+
+def test_busy_server_replies_03_over_the_text_protocol(busy):
+    server.remember_input('busy_text.csv', league_csv(5, seed=3))
+    listener = socket.create_server(('127.0.0.1', 0))
+    client = socket.create_connection(listener.getsockname())
+    connection, addr = listener.accept()
+    listener.close()
+    thread = threading.Thread(target=server.handle_connection, args=(connection, addr))
+    thread.start()
+    try:
+        client.sendall(server.pad_string('busy_text.csv' + server.SEPARATOR).encode())
+        reply = server.recv_exact(client, server.MESSAGE_SIZE).decode()
+    finally:
+        client.close()
+        thread.join(timeout=10)
+    assert reply.startswith('03')
+
+def test_busy_server_replies_03_to_a_pyramid_build(busy):
+    server.remember_input('busy_pyramid.csv', league_csv(5, seed=4))
+    header, _ = ask(Heatmap_Protocol.OP_TILE_PYRAMID, {'name': 'busy_pyramid.csv'})
+    assert header['status'] == '03'
+
+@pytest.fixture(scope='module')
+def pyramid():
+    # 100 players: two levels, a 1x1 tile grid above a 2x2 one
+    csv_data = league_csv(100)
+    digest = hashlib.sha256(csv_data).hexdigest()
+    built, meta = Heatmap_Tiles.build(csv_data, digest)
+    assert built
+    return meta
+
+def test_pyramid_levels_and_grids(pyramid):
+    assert pyramid['levels'] == 2
+    assert Heatmap_Tiles.tile_grid(pyramid, 0) == 1
+    assert Heatmap_Tiles.tile_grid(pyramid, 1) == 2
+
+def png_size(image):
+    assert image[:8] == b'\x89PNG\r\n\x1a\n'
+    return struct.unpack('!II', image[16:24])
+
+@pytest.mark.parametrize('level, x, y', [(0, 0, 0), (1, 0, 0), (1, 1, 1)])
+def test_tiles_inside_the_pyramid(pyramid, level, x, y):
+    header, body = ask(Heatmap_Protocol.OP_TILE, {'sha256': pyramid['sha256'], 'level': level, 'x': x, 'y': y})
+    assert header['status'] == '00'
+    assert png_size(body) == (Heatmap_Tiles.TILE_SIZE, Heatmap_Tiles.TILE_SIZE)
+
+@pytest.mark.parametrize('level, x, y', [(2, 0, 0), (-1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 2, 0), (1, 0, -1)])
+def test_tiles_outside_the_pyramid(pyramid, level, x, y):
+    header, body = ask(Heatmap_Protocol.OP_TILE, {'sha256': pyramid['sha256'], 'level': level, 'x': x, 'y': y})
+    assert header['status'] == '04'
+    assert body == b''
+
+@pytest.mark.parametrize('header', [
+    {'sha256': 'not a digest', 'level': 0, 'x': 0, 'y': 0},
+    {'level': 0, 'x': 0, 'y': 0},
+    {'sha256': '0' * 64, 'level': 'top', 'x': 0, 'y': 0},
+])
+def test_invalid_tile_requests(header):
+    reply, _ = ask(Heatmap_Protocol.OP_TILE, header)
+    assert reply['status'] == '04'
+
+def test_tile_of_a_pyramid_never_built():
+    header, _ = ask(Heatmap_Protocol.OP_TILE, {'sha256': '0' * 64, 'level': 0, 'x': 0, 'y': 0})
+    assert header['status'] == '01'
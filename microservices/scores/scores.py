@@ -0,0 +1,156 @@
+import csv
+import io
+import re
+import warnings
+
+import numpy as np
+
+# Shared parser for head-to-head score cells, used by the ranking and heatmap
+# services so they all agree on what a cell means. A cell is "X -- Y": X
+# games won and Y games lost against the column player, each at most nine
+# ASCII digits. One or two hyphens (or en dashes) are accepted as the
+# separator, so "3-2", "3 -- 2" and "3 – 2" are all the same cell. Anything
+# else, including a cell with a line break in it, is invalid.
+
+# Whitespace around the numbers and the separator: anything \s matches but a
+# newline, which separates cells when a whole table is matched at once
+_SPACE = r'[^\S\n]*'
+_CELL = rf'{_SPACE}(\d{{1,9}}){_SPACE}[-–]{{1,2}}{_SPACE}(\d{{1,9}}){_SPACE}'
+
+CELL_PATTERN = re.compile(_CELL, re.A)
+
+# Same pattern applied line by line to the newline-joined cells, so a whole
+# table is matched in one regex scan. The empty alternative makes every line,
+# valid or not, produce exactly one match.
+_JOINED_CELL_PATTERN = re.compile(rf'^{_CELL}$|^.*$', re.M | re.A)
+
+# Matches every line of the joined cells that is NOT a valid score
+_INVALID_LINE_PATTERN = re.compile(rf'^(?!{_CELL}$).*$', re.M | re.A)
+
+# Ten digits, so it can never be produced by a valid cell
+_INVALID_MARKER = 1000000000
+
+# wins and losses are stored compactly; at most nine digits always fit
+SCORE_DTYPE = np.int32
+
+def parse_cell(cell):
+    """
+    Parses one "X -- Y" cell.
+
+    Returns:
+        tuple: (wins, losses) as ints, or None if the cell is not a valid score.
+    """
+    match = CELL_PATTERN.fullmatch(str(cell))
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+def parse_cells(cells):
+    """
+    Parses a flat sequence of cells in one pass.
+
+    Returns:
+        tuple: (wins, losses, valid) 1D arrays; invalid cells are 0 -- 0 with valid False.
+    """
+    # A newline inside a cell would split it in two, and a cell containing one is invalid anyway
+    text = '\n'.join(str(cell) for cell in cells)
+    if text.count('\n') != len(cells) - 1:
+        text = '\n'.join(str(cell).replace('\n', '\0') for cell in cells)
+    return _parse_lines(text, len(cells))
+
+def parse_cell_block(block):
+    """
+    Parses cells separated by commas or newlines in one text block (e.g. the
+    cell columns of an unquoted CSV), without splitting it into a string per
+    cell first. Same rules as parse_cell.
+
+    Returns:
+        tuple: (wins, losses, valid) 1D arrays, one entry per cell; invalid cells are 0 -- 0.
+    """
+    if isinstance(block, (bytes, bytearray, memoryview)):
+        block = bytes(block).decode()
+    text = block.replace(',', '\n')
+    return _parse_lines(text, text.count('\n') + 1)
+
+def _parse_lines(text, count):
+    """
+    Parses `count` cells joined by newlines.
+    """
+    if count == 0:
+        empty = np.zeros(0, dtype=SCORE_DTYPE)
+        return empty, empty.copy(), np.zeros(0, dtype=bool)
+
+    # Fast path, all at C speed: overwrite invalid lines with a marker pair,
+    # turn the separators into spaces and read every number in one call
+    marked = _INVALID_LINE_PATTERN.sub(f'{_INVALID_MARKER} {_INVALID_MARKER}', text)
+    marked = marked.replace('–', ' ').replace('-', ' ')
+    try:
+        with warnings.catch_warnings():
+            # Older NumPy warns instead of raising when it stops early
+            warnings.simplefilter('error', DeprecationWarning)
+            numbers = np.fromstring(marked, dtype=np.int64, sep=' ')
+    except (ValueError, DeprecationWarning):
+        numbers = None
+    if numbers is not None and len(numbers) == 2 * count:
+        numbers = numbers.reshape(-1, 2)
+        valid = numbers[:, 0] != _INVALID_MARKER
+        numbers[~valid] = 0
+    else:
+        # Unexpected text confused the fast path; match cell by cell
+        pairs = np.array(_JOINED_CELL_PATTERN.findall(text), dtype=str).reshape(-1, 2)
+        valid = pairs[:, 0] != ''
+        numbers = np.where(valid[:, None], pairs, '0').astype(np.int64)
+
+    numbers = numbers.astype(SCORE_DTYPE)
+    return numbers[:, 0], numbers[:, 1], valid
+
+def parse_table(table):
+    """
+    Parses a 2D table (list of rows) of "X -- Y" cells. Short rows are padded
+    with invalid cells to the width of the longest row.
+
+    Returns:
+        tuple: (wins, losses, valid) 2D arrays of shape (rows, columns).
+    """
+    num_rows = len(table)
+    num_cols = max((len(row) for row in table), default=0)
+    if all(len(row) == num_cols for row in table):
+        flat = [cell for row in table for cell in row]
+    else:
+        flat = [cell for row in table for cell in list(row) + [''] * (num_cols - len(row))]
+    wins, losses, valid = parse_cells(flat)
+    shape = (num_rows, num_cols)
+    return wins.reshape(shape), losses.reshape(shape), valid.reshape(shape)
+
+def read_csv(data):
+    """
+    Reads a head-to-head CSV (text or bytes) with the opponent names in the
+    top row and each player's name in the first column.
+
+    Returns:
+        tuple: (column_names, row_names, cell_rows) with the name column and
+               the corner cell removed from cell_rows.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode('utf-8-sig')
+    reader = csv.reader(io.StringIO(data))
+    header = next(reader, [])
+    row_names = []
+    cell_rows = []
+    for row in reader:
+        if not row:
+            continue
+        row_names.append(row[0])
+        cell_rows.append(row[1:])
+    return header[1:], row_names, cell_rows
+
+def parse_csv(data):
+    """
+    Parses a head-to-head CSV (text or bytes) straight into score matrices.
+
+    Returns:
+        tuple: (column_names, row_names, wins, losses, valid)
+    """
+    column_names, row_names, cell_rows = read_csv(data)
+    wins, losses, valid = parse_table(cell_rows)
+    return column_names, row_names, wins, losses, valid
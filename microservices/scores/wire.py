@@ -0,0 +1,125 @@
+import io
+import itertools
+import json
+import operator
+import re
+import zipfile
+import zlib
+
+import numpy as np
+
+from .scores import parse_table
+
+# Compact binary wire format for head-to-head tables sent between the gateway
+# and the microservices, as an alternative to JSON arrays of "X -- Y" strings.
+# The body is an .npz archive (zip of .npy arrays, optionally deflated) with
+# the parsed 'wins', 'losses' and 'valid' matrices plus a 'meta' entry holding
+# the request's other fields as UTF-8 JSON. Receivers never re-parse strings.
+
+CONTENT_TYPE = 'application/x-h2h-npz'
+
+# A cell in exactly this form ("3 -- 2", no padding or leading zeros) is
+# rebuilt by decode_table from the matrices alone; encode_table sends every
+# other cell as it is, in meta['raw_cells'] ({"i,j": cell})
+CANONICAL_CELL = re.compile(r'(?:0|[1-9][0-9]{0,8}) -- (?:0|[1-9][0-9]{0,8})')
+
+def encode(wins, losses, valid, meta=None, compress=False):
+    """
+    Packs score matrices and a JSON-serializable meta dict into a request body.
+    """
+    wins, losses = np.asarray(wins), np.asarray(losses)
+    # Scores are non-negative, so pack them into the narrowest unsigned type that holds them
+    largest = max(int(wins.max(initial=0)), int(losses.max(initial=0)))
+    dtype = np.min_scalar_type(largest) if min(wins.min(initial=0), losses.min(initial=0)) >= 0 else np.int64
+
+    buffer = io.BytesIO()
+    save = np.savez_compressed if compress else np.savez
+    save(
+        buffer,
+        wins=wins.astype(dtype),
+        losses=losses.astype(dtype),
+        valid=np.asarray(valid, dtype=bool),
+        meta=np.frombuffer(json.dumps(meta or {}).encode('utf-8'), dtype=np.uint8),
+    )
+    return buffer.getvalue()
+
+# What np.load and zipfile raise for a truncated or corrupt body: missing
+# entries, bad headers, broken deflate streams, or zip features (encryption,
+# other compression methods) that a body from encode never uses
+MALFORMED_BODY_ERRORS = (KeyError, OSError, EOFError, ValueError, zipfile.BadZipFile, zlib.error,
+                         RuntimeError, NotImplementedError)
+
+def decode(body):
+    """
+    Unpacks a request body produced by encode.
+
+    Returns:
+        tuple: (wins, losses, valid, meta)
+    """
+    try:
+        archive = np.load(io.BytesIO(body), allow_pickle=False)
+        # a bare .npy body loads as one array rather than an archive
+        if not isinstance(archive, np.lib.npyio.NpzFile):
+            raise ValueError("not an .npz archive")
+        with archive:
+            wins, losses, valid = archive['wins'], archive['losses'], archive['valid']
+            meta = json.loads(archive['meta'].tobytes().decode('utf-8'))
+    except MALFORMED_BODY_ERRORS as e:
+        raise ValueError(f"Malformed {CONTENT_TYPE} body: {e}")
+    if wins.ndim != 2 or wins.shape != losses.shape or wins.shape != valid.shape:
+        raise ValueError(f"Malformed {CONTENT_TYPE} body: wins, losses and valid must be matrices of one shape")
+    if not isinstance(meta, dict):
+        raise ValueError(f"Malformed {CONTENT_TYPE} body: meta must be a JSON object")
+    return wins, losses, valid, meta
+
+def encode_table(table, meta=None, compress=False):
+    """
+    Packs a rectangular table (list of rows of cells) so that decode_table
+    gives back every cell exactly, for receivers that read the cells
+    themselves. Returns None if the rows are not lists of one length.
+    """
+    if not all(isinstance(row, list) and len(row) == len(table[0]) for row in table):
+        return None
+    # Whether each distinct text is canonical; looked up a row at a time
+    canonical = {}
+    raw_cells = {}
+    for i, row in enumerate(table):
+        try:
+            known = map(operator.not_, map(canonical.get, row))
+            unknown_or_raw = list(itertools.compress(range(len(row)), known))
+        except TypeError:
+            # An unhashable cell, which is always sent raw
+            unknown_or_raw = range(len(row))
+        for j in unknown_or_raw:
+            cell = row[j]
+            if type(cell) is str:
+                is_canonical = canonical.get(cell)
+                if is_canonical is None:
+                    is_canonical = canonical[cell] = CANONICAL_CELL.fullmatch(cell) is not None
+                if is_canonical:
+                    continue
+            raw_cells[f'{i},{j}'] = cell
+    wins, losses, valid = parse_table(table)
+    return encode(wins, losses, valid, dict(meta or {}, raw_cells=raw_cells), compress)
+
+def decode_table(wins, losses, meta):
+    """
+    The table packed by encode_table, as a list of rows of cells.
+    """
+    raw_cells = meta.get('raw_cells')
+    if not isinstance(raw_cells, dict):
+        raise ValueError(f"Malformed {CONTENT_TYPE} body: meta needs a 'raw_cells' object")
+    # Each distinct score is formatted once
+    pairs = (wins.astype(np.int64) << 32) | losses.astype(np.int64)
+    unique, inverse = np.unique(pairs.ravel(), return_inverse=True)
+    texts = np.array([f'{pair >> 32} -- {pair & 0xFFFFFFFF}' for pair in unique.tolist()] or [''], dtype=object)
+    cells = texts[inverse.reshape(wins.shape)]
+    for key, cell in raw_cells.items():
+        try:
+            i, j = map(int, key.split(','))
+            if i < 0 or j < 0:
+                raise IndexError(key)
+            cells[i, j] = cell
+        except (ValueError, IndexError):
+            raise ValueError(f"Malformed {CONTENT_TYPE} body: bad raw cell index '{key}'")
+    return cells.tolist()